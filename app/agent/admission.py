@@ -0,0 +1,200 @@
+"""
+Upstream admission control for LLM calls.
+
+Every `generate_content` call (primary, hedge or probe) passes through
+`upstream_admission.admit(...)` first. A caller is admitted only when all
+of these hold:
+
+- a requests-per-minute token is available (LLM_RPM, 0 = unlimited)
+- enough tokens-per-minute budget is available for the estimated prompt and
+  response size (LLM_TPM, 0 = unlimited)
+- fewer than LLM_MAX_CONCURRENCY calls are in flight
+- no 429 back-off is active. A 429 response blocks new admissions until
+  its Retry-After time, or LLM_429_BACKOFF_SECONDS if the header is missing.
+
+Waiters queue FIFO. A caller that cannot be admitted within
+LLM_ADMISSION_TIMEOUT_SECONDS gets UpstreamBusyError instead of adding to a
+thundering herd.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator, Optional
+
+from app.config.config import (
+    LLM_429_BACKOFF_SECONDS,
+    LLM_ADMISSION_TIMEOUT_SECONDS,
+    LLM_EXPECTED_OUTPUT_TOKENS,
+    LLM_MAX_CONCURRENCY,
+    LLM_RPM,
+    LLM_TPM,
+)
+from app.services.metrics import (
+    LLM_ADMISSION_QUEUE_DEPTH,
+    LLM_ADMISSION_REJECTED,
+    LLM_ADMISSION_WAIT_SECONDS,
+    LLM_RATE_LIMITED,
+    LLM_UPSTREAM_IN_FLIGHT,
+)
+from app.utils.log import get_logger
+
+logger = get_logger("admission")
+
+
+class UpstreamBusyError(Exception):
+    """Raised when an LLM call could not be admitted in time."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap prompt size estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Continuous-refill bucket; `rate_per_minute` <= 0 disables it. Not thread-safe.
+    Holds a minute's worth of tokens unless a smaller `capacity` (burst) is given.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.capacity = float(rate_per_minute if capacity is None else capacity)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.capacity > 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self.tokens -= min(amount, self.capacity)
+
+
+class UpstreamAdmission:
+    def __init__(
+        self,
+        rpm: float = LLM_RPM,
+        tpm: float = LLM_TPM,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_ADMISSION_TIMEOUT_SECONDS,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.token_budget = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._queue: Deque[object] = deque()
+        self._cond = threading.Condition()
+
+    # -----------------------------
+    # internal helpers (lock held)
+    # -----------------------------
+    def _wait_time(self, tokens: int, now: float) -> Optional[float]:
+        """Seconds until the head waiter can go; None means wait for a release."""
+        if self.max_concurrency > 0 and self.in_flight >= self.max_concurrency:
+            return None
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.token_budget.wait_time(tokens, now),
+            0.0,
+        )
+
+    # -----------------------------
+    # public API
+    # -----------------------------
+    @contextmanager
+    def admit(self, prompt: str, timeout: Optional[float] = None) -> Iterator[None]:
+        """Block until this call may go upstream; release the slot on exit."""
+        tokens = estimate_tokens(prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        ticket = object()
+
+        with self._cond:
+            self._queue.append(ticket)
+            LLM_ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(tokens, now) if self._queue[0] is ticket else None
+                    if wait == 0.0:
+                        self.requests.take(1)
+                        self.token_budget.take(tokens)
+                        self.in_flight += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        LLM_ADMISSION_REJECTED.labels(reason="timeout").inc()
+                        raise UpstreamBusyError(
+                            f"LLM upstream busy: not admitted within {deadline - start:.1f}s"
+                        )
+                    self._cond.wait(timeout=remaining if wait is None else min(wait, remaining))
+            finally:
+                self._queue.remove(ticket)
+                LLM_ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+                # The next waiter may now be at the head
+                self._cond.notify_all()
+
+        LLM_ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start)
+        LLM_UPSTREAM_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            LLM_UPSTREAM_IN_FLIGHT.dec()
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def note_rate_limited(self, retry_after: Optional[float]) -> None:
+        """Record a 429 and hold new admissions until Retry-After."""
+        backoff = retry_after if retry_after is not None and retry_after > 0 else LLM_429_BACKOFF_SECONDS
+        LLM_RATE_LIMITED.inc()
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+            self._cond.notify_all()
+        logger.warning("LLM upstream rate limited", extra={"fields": {"backoff_s": backoff}})
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": len(self._queue),
+                "blocked_for_s": round(max(self.blocked_until - now, 0.0), 2),
+                "rpm_available": round(self.requests.tokens, 1) if self.requests.enabled else None,
+                "tpm_available": round(self.token_budget.tokens) if self.token_budget.enabled else None,
+            }
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Return the Retry-After delay from a 429 error, or None if it is not a 429."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code != 429:
+        return None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        # HTTP-date form; fall back to the configured back-off
+        return 0.0
+
+
+upstream_admission = UpstreamAdmission()
@@ -1,7 +1,24 @@
+import asyncio
+import json
+import time
 from google import genai
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import Type
 from app.config.config import GEMINI_API_KEY  # Load API key from env
+from app.agent.admission import UpstreamBusyError, retry_after_seconds, upstream_admission
+from app.agent.hedging import hedged_generate
+from app.agent.routing import model_router
+from app.agent.schema import DiagnosisOutput
+from app.agent.singleflight import flight_key, llm_flights
+from app.services.metrics import (
+    LLM_ATTEMPTS,
+    LLM_ATTEMPT_SECONDS,
+    LLM_FALLBACKS,
+    LLM_JSON_PARSE_FAILURES,
+)
+from app.utils.log import get_logger, log_payload
+
+logger = get_logger("agent")
 
 # Lazy client (initialized on first use) to avoid startup failures when env is missing
 _client: genai.Client | None = None
@@ -14,6 +31,46 @@ def _get_client() -> genai.Client:
         _client = genai.Client(api_key=GEMINI_API_KEY)
     return _client
 
+class LLMResponseError(Exception):
+    """Raised by `json_agent` when no attempt produced a valid result."""
+
+def _generate(client: genai.Client, model: str, contents: str):
+    """One admitted upstream call; 429s feed the admission back-off."""
+    with upstream_admission.admit(contents):
+        try:
+            return client.models.generate_content(model=model, contents=contents)
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                upstream_admission.note_rate_limited(retry_after)
+            raise
+
+def _build_prompt(system_prompt: str, user_query: str, response_model: Type[BaseModel]) -> str:
+    """Render the full prompt sent upstream (also the coalescing key)."""
+    # Add JSON schema instruction to prompt for structured output
+    schema_dict = response_model.model_json_schema()
+    schema_json = json.dumps(schema_dict, indent=2)
+    
+    # Build prompt with clear JSON format instructions
+    return f"""{system_prompt}
+
+**CRITICAL: Respond with ONLY valid JSON matching this schema:**
+{schema_json}
+
+**Response format rules:**
+- "message": Explain what you're doing (required)
+- "command": PowerShell command to execute. If you provide a command, set "next_step" to "command". If no command needed, use empty string and set "next_step" to "message"
+- "next_step": Use "command" when you provided a command to execute, "message" when just responding without executing
+- "commands": Optional list of extra read-only diagnostic commands that do not depend on "command" or on each other. The client runs them all at the same time and sends every output back in one step. Use it to gather several independent facts in one round (e.g. IP config, DNS and adapter status). Never put fixes or commands that change the system here
+
+**Examples:**
+- User says "open settings" → {{"message": "Opening Windows Settings...", "command": "Start-Process ms-settings:", "next_step": "command"}}
+- User asks a question → {{"message": "Answer here", "command": "", "next_step": "message"}}
+- Network check → {{"message": "Checking IP configuration, DNS and adapters...", "command": "ipconfig /all", "commands": ["Resolve-DnsName google.com", "Get-NetAdapter"], "next_step": "command"}}
+
+**Your response (ONLY JSON, no markdown):**
+User query: {user_query}"""
+
 def custom_agent(
     system_prompt: str,
     user_query: str,
@@ -23,6 +80,9 @@ def custom_agent(
     """
     Sends a system prompt and user query to Gemini, parses the response with a Pydantic model.
 
+    Identical concurrent calls are coalesced into one upstream call
+    (see app/agent/singleflight.py).
+
     Args:
         system_prompt (str): The system message prompt.
         user_query (str): The user message/query.
@@ -32,47 +92,77 @@ def custom_agent(
     Returns:
         An instance of the response_model parsed from the output.
     """
+    full_prompt = _build_prompt(system_prompt, user_query, response_model)
+    key = flight_key(model_name, response_model.__name__, full_prompt)
+    result, shared = llm_flights.do(key, lambda: _call_llm(full_prompt, response_model, model_name))
+    # Waiters get their own copy so callers can never mutate each other's result
+    return result.model_copy() if shared else result
 
-    # Add JSON schema instruction to prompt for structured output
-    import json
-    schema_dict = response_model.model_json_schema()
-    schema_json = json.dumps(schema_dict, indent=2)
-    
-    # Build prompt with clear JSON format instructions
-    full_prompt = f"""{system_prompt}
+async def acustom_agent(
+    system_prompt: str,
+    user_query: str,
+    response_model: Type[BaseModel],
+    model_name: str = "gemini-2.0-flash"
+):
+    """`custom_agent` for async callers; waits for coalesced calls on the event loop."""
+    full_prompt = _build_prompt(system_prompt, user_query, response_model)
+    key = flight_key(model_name, response_model.__name__, full_prompt)
+    result, shared = await llm_flights.ado(
+        key, lambda: asyncio.to_thread(_call_llm, full_prompt, response_model, model_name)
+    )
+    return result.model_copy() if shared else result
 
-**CRITICAL: Respond with ONLY valid JSON matching this schema:**
-{schema_json}
+def json_agent(prompt: str, response_model: Type[BaseModel], model_name: str = "gemini-2.0-flash"):
+    """
+    Send an already rendered prompt and parse the JSON reply into `response_model`.
 
-**Response format rules:**
-- "message": Explain what you're doing (required)
-- "command": PowerShell command to execute. If you provide a command, set "next_step" to "command". If no command needed, use empty string and set "next_step" to "message"
-- "next_step": Use "command" when you provided a command to execute, "message" when just responding without executing
+    Same routing, hedging, admission and coalescing as `custom_agent`, without
+    the diagnose response rules. Raises LLMResponseError if no attempt
+    produced a valid result, instead of returning a fallback message.
+    """
+    key = flight_key(model_name, response_model.__name__, prompt)
+    result, shared = llm_flights.do(key, lambda: _call_llm(prompt, response_model, model_name, fallback=False))
+    return result.model_copy() if shared else result
 
-**Examples:**
-- User says "open settings" → {{"message": "Opening Windows Settings...", "command": "Start-Process ms-settings:", "next_step": "command"}}
-- User asks a question → {{"message": "Answer here", "command": "", "next_step": "message"}}
+def _fallback_response(response_model: Type[BaseModel], message: str, fallback: bool):
+    """The user-facing "please try again" reply, or LLMResponseError when the caller wants no fallback."""
+    if not fallback:
+        raise LLMResponseError(message)
+    result = response_model(message=message, command="", next_step="message")
+    if isinstance(result, DiagnosisOutput):
+        result._transient = True
+    return result
 
-**Your response (ONLY JSON, no markdown):**
-User query: {user_query}"""
+def _call_llm(full_prompt: str, response_model: Type[BaseModel], model_name: str, fallback: bool = True):
+    """
+    Attempt loop for one rendered prompt: routing, hedging, JSON parsing and fallbacks.
 
+    With `fallback` the last failure becomes a diagnose-shaped message reply;
+    without it, LLMResponseError is raised.
+    """
     # Generate content
     client = _get_client()
     max_retries = 2
-    models_to_try = [model_name, "gemini-2.5-flash", "gemini-2.0-flash"]
+    # Healthy models first; tripped circuits are skipped (see app/agent/routing.py)
+    models_to_try = model_router.attempt_order(model_name, max_retries + 1)
+    last_attempt = len(models_to_try) - 1
     
-    for attempt, current_model in enumerate(models_to_try[:max_retries + 1]):
+    for attempt, current_model in enumerate(models_to_try):
+        attempt_start = time.perf_counter()
+        outcome = "error"
+        attempt_error = None
         try:
-            print(f"[Attempt {attempt + 1}] Using model {current_model}")
+            logger.debug("LLM attempt", extra={"fields": {"attempt": attempt + 1, "model": current_model}})
             # Use simple text generation first, then parse JSON
-            response = client.models.generate_content(
-                model=current_model,
-                contents=full_prompt
+            response = hedged_generate(
+                lambda model, contents: _generate(client, model, contents),
+                current_model,
+                full_prompt,
             )
             
             # Extract JSON from response
             response_text = response.text.strip()
-            print(f"[Raw response] First 200 chars: {response_text[:200]}")
+            log_payload(logger, "LLM raw response", response_text, model=current_model)
             
             # Clean up response text - remove markdown code blocks if present
             if "```json" in response_text:
@@ -98,13 +188,22 @@ User query: {user_query}"""
             # Parse JSON
             try:
                 parsed_data = json.loads(response_text)
-                print(f"[SUCCESS] Parsed JSON: {parsed_data}")
+                log_payload(logger, "LLM parsed response", parsed_data, model=current_model)
                 # Validate and create response model instance
-                return response_model(**parsed_data)
-            except json.JSONDecodeError as json_error:
-                print(f"[WARNING] JSON parse error: {json_error}")
-                print(f"   Attempted to parse: {response_text[:500]}")
-                if attempt < max_retries:
+                result = response_model(**parsed_data)
+                outcome = "success"
+                return result
+            except (json.JSONDecodeError, ValidationError, TypeError) as json_error:
+                # Valid JSON in the wrong shape is a bad reply too, not a model outage
+                outcome = "parse_error"
+                LLM_JSON_PARSE_FAILURES.labels(model=current_model).inc()
+                logger.warning(
+                    "LLM JSON parse error",
+                    extra={"fields": {"model": current_model, "error": str(json_error), "response_chars": len(response_text)}},
+                )
+                log_payload(logger, "LLM unparseable response", response_text, model=current_model)
+                if attempt < last_attempt:
+                    LLM_FALLBACKS.labels(kind="next_model").inc()
                     continue
                 # Last resort: try to extract just the JSON part
                 import re
@@ -112,28 +211,46 @@ User query: {user_query}"""
                 if json_match:
                     try:
                         parsed_data = json.loads(json_match.group())
-                        return response_model(**parsed_data)
+                        result = response_model(**parsed_data)
+                        outcome = "success"
+                        return result
                     except:
                         pass
                 raise ValueError(f"Failed to parse JSON from response: {response_text[:500]}")
                 
+        except UpstreamBusyError as e:
+            # Other models share the same admission queue; retrying only adds load
+            outcome = "throttled"
+            logger.warning("LLM call not admitted", extra={"fields": {"model": current_model, "error": str(e)}})
+            LLM_FALLBACKS.labels(kind="error_response").inc()
+            return _fallback_response(
+                response_model,
+                "The assistant is handling a lot of requests right now. Please try again in a moment.",
+                fallback,
+            )
         except Exception as e:
-            print(f"Error with model {current_model}: {type(e).__name__}: {e}")
-            if attempt < max_retries:
-                print(f" Retrying with next model...")
+            attempt_error = f"{type(e).__name__}: {e}"
+            logger.warning(
+                "LLM attempt failed",
+                extra={"fields": {"model": current_model, "error_type": type(e).__name__, "error": str(e)[:500]}},
+            )
+            if attempt < last_attempt:
+                LLM_FALLBACKS.labels(kind="next_model").inc()
                 continue
             else:
                 # Last attempt failed - return a fallback response
-                print(f"All attempts failed. Returning fallback response.")
-                return response_model(
-                    message=f"I encountered an error processing your request. Please try again. Error: {str(e)[:100]}",
-                    command="",
-                    next_step="message"
+                logger.error("All LLM attempts failed", extra={"fields": {"fallback_response": fallback}})
+                LLM_FALLBACKS.labels(kind="error_response").inc()
+                return _fallback_response(
+                    response_model,
+                    f"I encountered an error processing your request. Please try again. Error: {str(e)[:100]}",
+                    fallback,
                 )
+        finally:
+            elapsed = time.perf_counter() - attempt_start
+            LLM_ATTEMPTS.labels(model=current_model, outcome=outcome).inc()
+            LLM_ATTEMPT_SECONDS.labels(model=current_model, outcome=outcome).observe(elapsed)
+            model_router.record(current_model, outcome, elapsed, error=attempt_error)
     
     # Should not reach here, but just in case
-    return response_model(
-        message="Unable to process request. Please try again.",
-        command="",
-        next_step="message"
-    )
+    return _fallback_response(response_model, "Unable to process request. Please try again.", fallback)
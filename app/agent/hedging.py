@@ -0,0 +1,176 @@
+"""
+Hedged LLM requests to cut tail latency.
+
+When LLM_HEDGE_ENABLED is on, `hedged_generate` starts the primary
+`generate_content` call on a worker thread. If it has not returned after
+the LLM_HEDGE_PERCENTILE latency of recent primary calls, it fires one
+more request (same model, or LLM_HEDGE_MODEL). It then takes whichever
+finishes first with a result, and the other is cancelled.
+
+The google-genai sync client cannot abort an HTTP call that is already
+running. "Cancelled" therefore means the loser's future is cancelled if it
+has not started, and otherwise its result is discarded when it arrives.
+Hedges are capped at LLM_HEDGE_MAX_RATE of primary calls over a rolling
+minute, so a slow upstream does not get double the traffic.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Optional
+
+from app.config.config import (
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MAX_RATE,
+    LLM_HEDGE_MAX_WORKERS,
+    LLM_HEDGE_MIN_DELAY_MS,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_MODEL,
+    LLM_HEDGE_PERCENTILE,
+)
+from app.services.metrics import LLM_HEDGE_DELAY_SECONDS, LLM_HEDGES
+from app.utils.log import get_logger
+
+logger = get_logger("hedging")
+
+_BUDGET_WINDOW_SECONDS = 60.0
+
+
+class LatencyTracker:
+    """Sliding window of recent successful primary-call latencies."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(pct * len(ordered)), len(ordered) - 1)]
+
+
+class HedgeBudget:
+    """Allows at most `max_rate` hedges per primary call over a rolling window."""
+
+    def __init__(self, max_rate: float, window_seconds: float = _BUDGET_WINDOW_SECONDS):
+        self.max_rate = max_rate
+        self.window_seconds = window_seconds
+        self._calls: Deque[float] = deque()
+        self._hedges: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0] < cutoff:
+            self._calls.popleft()
+        while self._hedges and self._hedges[0] < cutoff:
+            self._hedges.popleft()
+
+    def record_call(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._hedges) + 1 > self.max_rate * len(self._calls):
+                return False
+            self._hedges.append(now)
+            return True
+
+
+class Hedger:
+    """Runs a call with an optional delayed backup request."""
+
+    def __init__(
+        self,
+        enabled: bool = LLM_HEDGE_ENABLED,
+        percentile: float = LLM_HEDGE_PERCENTILE,
+        max_rate: float = LLM_HEDGE_MAX_RATE,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        min_delay_ms: float = LLM_HEDGE_MIN_DELAY_MS,
+        max_workers: int = LLM_HEDGE_MAX_WORKERS,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay_ms / 1000.0
+        self.latencies = LatencyTracker()
+        self.budget = HedgeBudget(max_rate)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def _timed(self, fn: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = fn()
+        self.latencies.record(time.perf_counter() - start)
+        return result
+
+    def call(self, primary: Callable[[], Any], hedge: Callable[[], Any]) -> Any:
+        if not self.enabled:
+            return self._timed(primary)
+
+        self.budget.record_call()
+        delay = self.latencies.percentile(self.percentile, self.min_samples)
+        if delay is None:
+            # Not enough history to know what "slow" means yet
+            return self._timed(primary)
+        delay = max(delay, self.min_delay)
+
+        pool = self._pool()
+        primary_future = pool.submit(self._timed, primary)
+        done, _ = wait([primary_future], timeout=delay)
+        if done:
+            return primary_future.result()
+
+        if not self.budget.try_acquire():
+            LLM_HEDGES.labels(result="budget_exhausted").inc()
+            return primary_future.result()
+
+        LLM_HEDGE_DELAY_SECONDS.observe(delay)
+        hedge_future = pool.submit(hedge)
+        return self._first_success(primary_future, hedge_future)
+
+    def _first_success(self, primary_future: Future, hedge_future: Future) -> Any:
+        pending = {primary_future, hedge_future}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    won = "hedge_won" if future is hedge_future else "primary_won"
+                    LLM_HEDGES.labels(result=won).inc()
+                    return future.result()
+                first_error = first_error or future.exception()
+        LLM_HEDGES.labels(result="both_failed").inc()
+        raise first_error
+
+
+_hedger = Hedger()
+
+
+def hedged_generate(generate: Callable[[str, str], Any], model: str, contents: str):
+    """`generate(model, contents)`, hedged when enabled."""
+    hedge_model = LLM_HEDGE_MODEL or model
+    return _hedger.call(
+        lambda: generate(model, contents),
+        lambda: generate(hedge_model, contents),
+    )
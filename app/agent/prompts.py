@@ -55,7 +55,7 @@ Detect when user describes or shows:
 2. **Detect Problem Type**: Identify if it's Windows system issue or development/package issue
 3. **Stay Focused**: Only perform diagnostics directly related to the reported issue
 4. **Clarify When Needed**: Ask specific questions only if the problem description is ambiguous
-5. **Sequential Analysis**: Execute one command at a time, analyze output, then proceed logically
+5. **Sequential Analysis**: Execute one command at a time, analyze output, then proceed logically. Independent read-only checks may be batched in `commands` and run together
 6. **Avoid Redundancy**: Don't repeat commands unless system state has changed
 7. **Progressive Logic**: Start with basic checks before advanced investigations
 8. **Context Awareness**: Use conversation history to understand the full context
@@ -0,0 +1,237 @@
+"""
+Per-model health tracking, circuit breakers and latency-aware routing.
+
+Every LLM attempt reports its outcome and latency to `model_router`. Each
+model tracks an EWMA of latency and error rate plus a circuit breaker:
+
+- closed: normal traffic
+- open: too many failures; skipped by `attempt_order` for LLM_CB_OPEN_SECONDS
+- half_open: cool-down elapsed; one background probe decides between
+  closing the circuit and reopening it (a probe still running after
+  LLM_CB_OPEN_SECONDS counts as failed)
+
+`attempt_order` ranks the closed models by expected cost (EWMA latency
+inflated by error rate, with a bonus for the caller's preferred model), so a
+degraded model stops costing every request a failed attempt.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.config.config import (
+    LLM_CB_ERROR_RATE,
+    LLM_CB_FAILURE_THRESHOLD,
+    LLM_CB_MIN_CALLS,
+    LLM_CB_OPEN_SECONDS,
+    LLM_EWMA_ALPHA,
+    LLM_MODELS,
+)
+from app.services.metrics import LLM_CIRCUIT_STATE
+from app.utils.log import get_logger
+
+logger = get_logger("routing")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Preferred model keeps first place unless it is this much slower than another
+_PREFERRED_BONUS = 0.67
+# Latency assumed for a model with no history yet
+_DEFAULT_LATENCY = 2.0
+_PROBE_PROMPT = 'Reply with exactly: {"ok": true}'
+
+
+class ModelHealth:
+    """Health of one model. Mutated only under the router lock."""
+
+    __slots__ = (
+        "model", "state", "ewma_latency", "ewma_error_rate", "calls",
+        "consecutive_failures", "opened_at", "probing", "probe_started", "last_error",
+    )
+
+    def __init__(self, model: str):
+        self.model = model
+        self.state = CLOSED
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.calls = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.last_error: Optional[str] = None
+
+    def cost(self) -> float:
+        latency = self.ewma_latency if self.ewma_latency is not None else _DEFAULT_LATENCY
+        return latency * (1.0 + 4.0 * self.ewma_error_rate)
+
+    def snapshot(self) -> Dict:
+        return {
+            "model": self.model,
+            "state": self.state,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "ewma_error_rate": round(self.ewma_error_rate, 4),
+            "calls": self.calls,
+            "consecutive_failures": self.consecutive_failures,
+            "open_for_s": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else None,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        models: List[str],
+        alpha: float = LLM_EWMA_ALPHA,
+        failure_threshold: int = LLM_CB_FAILURE_THRESHOLD,
+        error_rate_threshold: float = LLM_CB_ERROR_RATE,
+        min_calls: int = LLM_CB_MIN_CALLS,
+        open_seconds: float = LLM_CB_OPEN_SECONDS,
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._health: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+        for model in models:
+            self._get(model)
+
+    # -----------------------------
+    # internal helpers (lock held)
+    # -----------------------------
+    def _get(self, model: str) -> ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = ModelHealth(model)
+            LLM_CIRCUIT_STATE.labels(model=model).set(_STATE_VALUES[CLOSED])
+        return health
+
+    def _set_state(self, health: ModelHealth, state: str) -> None:
+        if health.state != state:
+            logger.warning(
+                "Model circuit state changed",
+                extra={"fields": {"model": health.model, "from": health.state, "to": state}},
+            )
+        health.state = state
+        if state == OPEN:
+            health.opened_at = time.monotonic()
+        if state == CLOSED:
+            health.consecutive_failures = 0
+        LLM_CIRCUIT_STATE.labels(model=health.model).set(_STATE_VALUES[state])
+
+    def _maybe_start_probe(self, health: ModelHealth) -> None:
+        now = time.monotonic()
+        if health.probing and now - health.probe_started >= self.open_seconds:
+            # The probe hung; its result (if it ever returns) is ignored
+            health.probing = False
+            health.last_error = "probe timed out"
+            self._set_state(health, OPEN)
+        if health.state == OPEN and now - health.opened_at >= self.open_seconds:
+            self._set_state(health, HALF_OPEN)
+        if health.state == HALF_OPEN and not health.probing:
+            health.probing = True
+            health.probe_started = now
+            threading.Thread(
+                target=self._probe, args=(health.model, now), name=f"llm-probe-{health.model}", daemon=True
+            ).start()
+
+    def _rank(self, preferred: str) -> List[str]:
+        def cost(h: ModelHealth) -> float:
+            return h.cost() * (_PREFERRED_BONUS if h.model == preferred else 1.0)
+
+        closed = sorted((h for h in self._health.values() if h.state == CLOSED), key=cost)
+        if closed:
+            return [h.model for h in closed]
+        # Everything is tripped: try the models anyway, longest-open first
+        return [h.model for h in sorted(self._health.values(), key=lambda h: h.opened_at)]
+
+    # -----------------------------
+    # routing
+    # -----------------------------
+    def attempt_order(self, preferred: str, attempts: int) -> List[str]:
+        """Models to try, best first, padded by repeating the best to `attempts`."""
+        with self._lock:
+            self._get(preferred)
+            for health in self._health.values():
+                self._maybe_start_probe(health)
+            order = self._rank(preferred)
+
+        ranked = list(order)
+        while len(order) < attempts:
+            order.append(ranked[len(order) % len(ranked)])
+        return order[:attempts]
+
+    # -----------------------------
+    # feedback
+    # -----------------------------
+    def record(self, model: str, outcome: str, seconds: float, error: Optional[str] = None) -> None:
+        """Report one attempt. `outcome` is success, parse_error, error or throttled."""
+        if outcome == "throttled":
+            # Never reached the model; says nothing about its health
+            return
+        failed = outcome == "error"
+        with self._lock:
+            health = self._get(model)
+            health.calls += 1
+            if not failed:
+                # Failed calls often return fast; keep them out of the latency estimate
+                health.ewma_latency = seconds if health.ewma_latency is None else (
+                    self.alpha * seconds + (1 - self.alpha) * health.ewma_latency
+                )
+            health.ewma_error_rate = self.alpha * float(failed) + (1 - self.alpha) * health.ewma_error_rate
+
+            if not failed:
+                health.consecutive_failures = 0
+                return
+
+            health.consecutive_failures += 1
+            health.last_error = (error or "")[:200]
+            if health.state == CLOSED and (
+                health.consecutive_failures >= self.failure_threshold
+                or (health.calls >= self.min_calls and health.ewma_error_rate >= self.error_rate_threshold)
+            ):
+                self._set_state(health, OPEN)
+
+    def _probe(self, model: str, started: float) -> None:
+        from app.agent.agents import _generate, _get_client
+
+        start = time.perf_counter()
+        try:
+            _generate(_get_client(), model, _PROBE_PROMPT)
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            health = self._get(model)
+            if not health.probing or health.probe_started != started:
+                # Already timed out (and possibly superseded by a newer probe)
+                return
+            health.probing = False
+            if ok:
+                health.ewma_error_rate = 0.0
+                health.ewma_latency = elapsed if health.ewma_latency is None else health.ewma_latency
+                self._set_state(health, CLOSED)
+            else:
+                health.last_error = (error or "")[:200]
+                self._set_state(health, OPEN)
+
+    # -----------------------------
+    # introspection
+    # -----------------------------
+    def snapshot(self, preferred: Optional[str] = None) -> Dict:
+        """Read-only view; unlike `attempt_order` it never starts a probe."""
+        preferred = preferred or LLM_MODELS[0]
+        with self._lock:
+            order = self._rank(preferred)
+            models = [h.snapshot() for h in self._health.values()]
+        return {"preferred": preferred, "attempt_order": order, "models": models}
+
+
+model_router = ModelRouter(LLM_MODELS)
@@ -0,0 +1,237 @@
+"""
+Per-user weighted fair scheduling of diagnose work.
+
+Routes wrap their `custom_agent` call in `diagnose_scheduler.slot(user_id,
+priority)`. At most SCHED_MAX_ACTIVE calls run at once. Waiting work is
+queued per user and per priority class:
+
+- across classes, stride scheduling by weight: with the defaults, interactive
+  work gets 8 slots for every 1 batch slot while both are waiting
+- within a class, users are served round-robin, one ticket per turn
+- each user can hold at most SCHED_{INTERACTIVE,BATCH}_USER_CONCURRENCY
+  active slots and SCHED_MAX_QUEUED_PER_USER queued tickets
+
+As a result, an automation account flooding /diagnose only grows its own
+queue, and interactive p95 stays flat.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional
+
+from app.config.config import (
+    SCHED_BATCH_USER_CONCURRENCY,
+    SCHED_BATCH_USERS,
+    SCHED_BATCH_WEIGHT,
+    SCHED_INTERACTIVE_USER_CONCURRENCY,
+    SCHED_INTERACTIVE_WEIGHT,
+    SCHED_MAX_ACTIVE,
+    SCHED_MAX_QUEUED_PER_USER,
+    SCHED_QUEUE_TIMEOUT_SECONDS,
+)
+from app.services.metrics import SCHED_ACTIVE, SCHED_QUEUE_DEPTH, SCHED_REJECTED, SCHED_WAIT_SECONDS
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class SchedulerBusyError(Exception):
+    """Raised when work cannot be queued or did not start in time."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("user_id", "priority", "granted")
+
+    def __init__(self, user_id: str, priority: str):
+        self.user_id = user_id
+        self.priority = priority
+        self.granted = False
+
+
+class _PriorityClass:
+    __slots__ = ("name", "weight", "user_limit", "pass_value", "queues", "queued")
+
+    def __init__(self, name: str, weight: float, user_limit: int):
+        self.name = name
+        self.weight = weight
+        self.user_limit = user_limit
+        # Stride-scheduling virtual time; lowest eligible class goes next
+        self.pass_value = 0.0
+        # user_id -> FIFO of tickets; order of keys is the round-robin order
+        self.queues: "OrderedDict[str, Deque[_Ticket]]" = OrderedDict()
+        self.queued = 0
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        max_active: int = SCHED_MAX_ACTIVE,
+        interactive_weight: float = SCHED_INTERACTIVE_WEIGHT,
+        batch_weight: float = SCHED_BATCH_WEIGHT,
+        interactive_user_limit: int = SCHED_INTERACTIVE_USER_CONCURRENCY,
+        batch_user_limit: int = SCHED_BATCH_USER_CONCURRENCY,
+        max_queued_per_user: int = SCHED_MAX_QUEUED_PER_USER,
+        timeout: float = SCHED_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_active = max_active
+        self.max_queued_per_user = max_queued_per_user
+        self.timeout = timeout
+        self._classes: Dict[str, _PriorityClass] = {
+            INTERACTIVE: _PriorityClass(INTERACTIVE, interactive_weight, interactive_user_limit),
+            BATCH: _PriorityClass(BATCH, batch_weight, batch_user_limit),
+        }
+        self._active_total = 0
+        self._active_by_user: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    # -----------------------------
+    # internal helpers (lock held)
+    # -----------------------------
+    def _next_user(self, cls: _PriorityClass) -> Optional[str]:
+        for user_id in cls.queues:
+            if self._active_by_user.get(user_id, 0) < cls.user_limit:
+                return user_id
+        return None
+
+    def _grant(self, cls: _PriorityClass, user_id: str) -> None:
+        queue = cls.queues[user_id]
+        ticket = queue.popleft()
+        cls.queued -= 1
+        # Rotate: served user goes to the back of the round-robin
+        del cls.queues[user_id]
+        if queue:
+            cls.queues[user_id] = queue
+
+        ticket.granted = True
+        self._active_total += 1
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+        cls.pass_value += 1.0 / cls.weight
+        SCHED_QUEUE_DEPTH.labels(priority=cls.name).set(cls.queued)
+        SCHED_ACTIVE.labels(priority=cls.name).inc()
+
+    def _dispatch(self) -> None:
+        granted = False
+        while self._active_total < self.max_active:
+            candidates = [
+                (cls.pass_value, cls.name, cls, user_id)
+                for cls in self._classes.values()
+                for user_id in [self._next_user(cls)]
+                if user_id is not None
+            ]
+            if not candidates:
+                break
+            _, _, cls, user_id = min(candidates, key=lambda c: (c[0], c[1] != INTERACTIVE))
+            self._grant(cls, user_id)
+            granted = True
+
+        # A class that sat idle must not bank credit against busy ones
+        waiting = [c.pass_value for c in self._classes.values() if c.queued]
+        if waiting:
+            floor = min(waiting)
+            for cls in self._classes.values():
+                if not cls.queued and cls.pass_value < floor:
+                    cls.pass_value = floor
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, ticket: _Ticket) -> None:
+        cls = self._classes[ticket.priority]
+        queue = cls.queues.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            cls.queued -= 1
+            if not queue:
+                del cls.queues[ticket.user_id]
+            SCHED_QUEUE_DEPTH.labels(priority=cls.name).set(cls.queued)
+
+    def _release(self, ticket: _Ticket) -> None:
+        self._active_total -= 1
+        remaining = self._active_by_user.get(ticket.user_id, 1) - 1
+        if remaining:
+            self._active_by_user[ticket.user_id] = remaining
+        else:
+            self._active_by_user.pop(ticket.user_id, None)
+        SCHED_ACTIVE.labels(priority=ticket.priority).dec()
+        self._dispatch()
+
+    # -----------------------------
+    # public API
+    # -----------------------------
+    @contextmanager
+    def slot(self, user_id: Optional[str], priority: str = INTERACTIVE) -> Iterator[None]:
+        """Wait for this user's fair turn, then hold a slot for the block."""
+        priority = priority if priority in self._classes else INTERACTIVE
+        user_key = user_id or "anonymous"
+        cls = self._classes[priority]
+        ticket = _Ticket(user_key, priority)
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        with self._cond:
+            queue = cls.queues.get(user_key)
+            if queue is not None and len(queue) >= self.max_queued_per_user:
+                SCHED_REJECTED.labels(priority=priority, reason="queue_full").inc()
+                raise SchedulerBusyError("Too many queued diagnose requests for this user", "queue_full")
+            if queue is None:
+                queue = cls.queues[user_key] = deque()
+            queue.append(ticket)
+            cls.queued += 1
+            SCHED_QUEUE_DEPTH.labels(priority=priority).set(cls.queued)
+            self._dispatch()
+
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    SCHED_REJECTED.labels(priority=priority, reason="timeout").inc()
+                    raise SchedulerBusyError("Diagnose request waited too long for capacity", "timeout")
+                self._cond.wait(timeout=remaining)
+
+        SCHED_WAIT_SECONDS.labels(priority=priority).observe(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._release(ticket)
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                "active": self._active_total,
+                "max_active": self.max_active,
+                "classes": {
+                    cls.name: {
+                        "weight": cls.weight,
+                        "user_concurrency": cls.user_limit,
+                        "queued": cls.queued,
+                        "queued_users": len(cls.queues),
+                    }
+                    for cls in self._classes.values()
+                },
+            }
+
+
+def priority_for(user: Dict, requested: Optional[str] = None) -> str:
+    """
+    Priority class for a request.
+
+    Accounts listed in SCHED_BATCH_USERS, or whose user row has
+    priority_class = "batch", are always batch. Anyone else may demote
+    themselves with the X-Glitch-Priority: batch header, but cannot promote.
+    """
+    if user.get("priority_class") == BATCH:
+        return BATCH
+    if user.get("email") in SCHED_BATCH_USERS or user.get("id") in SCHED_BATCH_USERS:
+        return BATCH
+    if requested and requested.strip().lower() == BATCH:
+        return BATCH
+    return INTERACTIVE
+
+
+diagnose_scheduler = FairScheduler()
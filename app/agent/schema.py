@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import Optional, Literal, List
 from datetime import datetime
 
@@ -36,6 +36,19 @@ class DiagnoseContinueRequest(BaseModel):
     command_output: str
 
 
+# =============================================
+# REQUEST: CONTINUE AFTER SEVERAL COMMANDS RAN
+# =============================================
+class CommandResult(BaseModel):
+    command: str
+    command_output: str
+
+
+class DiagnoseContinueBatchRequest(BaseModel):
+    thread_id: str
+    results: List[CommandResult] = Field(..., min_length=1)
+
+
 # =============================================
 # RESPONSE BACK TO FRONTEND
 # =============================================
@@ -44,6 +57,9 @@ class DiagnoseResponse(BaseModel):
     command: Optional[str] = None
     next_step: Literal["command", "message"]
 
+    # Independent commands the client may run in parallel (includes `command`)
+    commands: Optional[List[str]] = None
+
     # Compatibility — session_id == thread_id
     session_id: str
     thread_id: Optional[str] = None
@@ -59,7 +75,11 @@ class DiagnosisOutput(BaseModel):
     Structured response from the AI model.
     next_step = "command" → AI wants user machine to run a command
     next_step = "message" → AI is done and returns explanation
+    commands = independent diagnostics that can run at the same time
     """
     message: str
     command: str = ""         # Command to run (optional)
     next_step: Literal["command", "message"]
+    commands: List[str] = []  # Extra independent commands (optional)
+    # Set on "please try again" fallbacks (busy, upstream errors); never replayed for an Idempotency-Key
+    _transient: bool = PrivateAttr(default=False)
@@ -0,0 +1,139 @@
+"""
+Coalescing of identical concurrent LLM calls ("singleflight").
+
+During an outage many machines send the same problem at the same moment.
+`custom_agent` hashes the fully rendered prompt, and `llm_flights` makes
+sure only one call per hash is in flight: the first caller (the leader)
+runs it, and everyone arriving while it runs waits for the leader's result
+instead of starting their own.
+
+Flights are `concurrent.futures.Future`s, so a key started by a threadpool
+caller (`do`) can be joined from the event loop (`ado`) and vice versa.
+Only concurrent callers are coalesced; nothing is cached once a flight ends.
+
+Waiters share the leader's result or `Exception`. A leader stopped by
+anything else (cancellation, KeyboardInterrupt) abandons the flight instead:
+its waiters start over and one of them becomes the new leader.
+"""
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from app.config.config import LLM_COALESCE_ENABLED
+from app.services.metrics import LLM_COALESCE_GROUP_SIZE, LLM_COALESCE_IN_FLIGHT, LLM_COALESCED_WAITERS
+from app.utils.log import get_logger
+
+logger = get_logger("singleflight")
+
+
+def flight_key(*parts: str) -> str:
+    """Stable key for the given prompt parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _LeaderGone(Exception):
+    """Set on an abandoned flight; its waiters re-join."""
+
+
+class _Flight:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = LLM_COALESCE_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str, mode: str) -> Tuple[_Flight, bool]:
+        """Return (flight, is_leader) for `key`."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                LLM_COALESCED_WAITERS.labels(mode=mode).inc()
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            LLM_COALESCE_IN_FLIGHT.set(len(self._flights))
+            return flight, True
+
+    def _land(self, key: str, flight: _Flight) -> None:
+        """Unregister the flight; call before resolving it so waiters that re-join get a new one."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            LLM_COALESCE_IN_FLIGHT.set(len(self._flights))
+            waiters = flight.waiters
+        LLM_COALESCE_GROUP_SIZE.observe(waiters + 1)
+        if waiters:
+            logger.info("Coalesced LLM call", extra={"fields": {"key": key[:12], "waiters": waiters}})
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run `fn` once per concurrent `key`. Returns (result, shared)."""
+        if not self.enabled:
+            return fn(), False
+
+        while True:
+            flight, leader = self._join(key, "thread")
+            if leader:
+                break
+            try:
+                return flight.future.result(), True
+            except _LeaderGone:
+                continue
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, flight)
+            flight.future.set_exception(e if isinstance(e, Exception) else _LeaderGone())
+            raise
+        self._land(key, flight)
+        flight.future.set_result(result)
+        return result, False
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async `do`: the event loop is never blocked while waiting."""
+        if not self.enabled:
+            return await fn(), False
+
+        while True:
+            flight, leader = self._join(key, "async")
+            if leader:
+                break
+            try:
+                return await asyncio.wrap_future(flight.future), True
+            except _LeaderGone:
+                continue
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._land(key, flight)
+            # Cancellation is the leader's own fate, not the call's outcome
+            flight.future.set_exception(e if isinstance(e, Exception) else _LeaderGone())
+            raise
+        self._land(key, flight)
+        flight.future.set_result(result)
+        return result, False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._flights),
+                "waiting": sum(f.waiters for f in self._flights.values()),
+            }
+
+
+llm_flights = SingleFlight()
@@ -0,0 +1,263 @@
+"""
+Rolling per-thread conversation summary.
+
+Prompts show a thread as "summary of earlier steps" plus the newest messages
+verbatim. Once more than SUMMARY_FOLD_MESSAGES messages (or
+SUMMARY_FOLD_TOKENS tokens) sit beyond the SUMMARY_RECENT_MESSAGES window,
+a background job folds them into the stored summary. The job sends the
+current summary and only the new messages, so the summary is extended, not
+regenerated from the whole thread.
+
+Summaries live in the `thread_summaries` table (thread_id, summary,
+covered_until, covered_messages, updated_at). `covered_until` is the
+created_at of the last folded message; anything newer is still verbatim.
+The table is created by app/database/migrations/003_thread_summaries.sql.
+Prompt size is therefore bounded by the summary cap plus
+SUMMARY_RECENT_MESSAGES + SUMMARY_FOLD_MESSAGES messages, however long the
+thread runs.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from app.agent.admission import estimate_tokens
+from app.agent.agents import json_agent
+from app.agent.scheduler import BATCH, diagnose_scheduler
+from app.agent.schema import HistoryEntry
+from app.config.config import (
+    SUMMARY_CACHE_TTL_SECONDS,
+    SUMMARY_ENABLED,
+    SUMMARY_FOLD_MESSAGES,
+    SUMMARY_FOLD_TOKENS,
+    SUMMARY_MAX_CHARS,
+    SUMMARY_RECENT_MESSAGES,
+    SUMMARY_WORKERS,
+)
+from app.database.thread_service import ThreadService
+from app.services.metrics import SUMMARY_FOLD_SECONDS, SUMMARY_FOLDS
+from app.utils.log import get_logger
+
+logger = get_logger("summarizer")
+
+# Newest messages a fold looks at; older unsummarised history is skipped
+_FOLD_SCAN_MESSAGES = 200
+# Per-message output shown to the summariser
+_FOLD_OUTPUT_CHARS = 1500
+_CACHE_MAX_THREADS = 10000
+
+_FOLD_PROMPT = """You maintain the running summary of a Windows / developer-environment troubleshooting session.
+
+## Current summary
+{summary}
+
+## New messages to fold in (oldest first)
+{messages}
+
+## Task
+Return the updated summary as JSON: {{"summary": "..."}}.
+Keep: the user's problem, commands already run and their key findings, what has been ruled out,
+fixes attempted and whether they worked, and anything still open. Keep exact error codes, names,
+versions and paths. Drop pleasantries and repeated output. At most {max_words} words.
+Respond with ONLY the JSON object."""
+
+
+class ThreadSummary(BaseModel):
+    summary: str
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _covered_until(summary: Optional[Dict]) -> Optional[datetime]:
+    raw = (summary or {}).get("covered_until")
+    if not raw:
+        return None
+    try:
+        return _aware(datetime.fromisoformat(str(raw).replace("Z", "+00:00")))
+    except ValueError:
+        return None
+
+
+def _entry_tokens(entry: HistoryEntry) -> int:
+    return estimate_tokens(entry.message + (entry.command or "") + (entry.command_output or ""))
+
+
+def _render_for_fold(entries: List[HistoryEntry]) -> str:
+    lines = []
+    for entry in entries:
+        line = entry.message
+        if entry.command:
+            line += f"\n  command: {entry.command}"
+        if entry.command_output:
+            output = entry.command_output
+            if len(output) > _FOLD_OUTPUT_CHARS:
+                output = output[:_FOLD_OUTPUT_CHARS] + " ...[truncated]"
+            line += f"\n  output: {output}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class ThreadSummarizer:
+    def __init__(
+        self,
+        enabled: bool = SUMMARY_ENABLED,
+        recent_messages: int = SUMMARY_RECENT_MESSAGES,
+        fold_messages: int = SUMMARY_FOLD_MESSAGES,
+        fold_tokens: int = SUMMARY_FOLD_TOKENS,
+        max_chars: int = SUMMARY_MAX_CHARS,
+        workers: int = SUMMARY_WORKERS,
+        cache_ttl: float = SUMMARY_CACHE_TTL_SECONDS,
+    ):
+        self.enabled = enabled
+        self.recent_messages = recent_messages
+        self.fold_messages = fold_messages
+        self.fold_tokens = fold_tokens
+        self.max_chars = max_chars
+        self.cache_ttl = cache_ttl
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # thread_id -> (expires_at, summary row or None)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._folding: Set[str] = set()
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # summary rows (process-local read cache)
+    # -----------------------------
+    def _remember(self, thread_id: str, row: Optional[Dict]) -> None:
+        with self._lock:
+            self._cache[thread_id] = (time.monotonic() + self.cache_ttl, row)
+            self._cache.move_to_end(thread_id)
+            while len(self._cache) > _CACHE_MAX_THREADS:
+                self._cache.popitem(last=False)
+
+    def _summary(self, thread_id: str) -> Optional[Dict]:
+        with self._lock:
+            hit = self._cache.get(thread_id)
+            if hit is not None and hit[0] > time.monotonic():
+                return hit[1]
+        row = ThreadService.get_summary(thread_id)
+        self._remember(thread_id, row)
+        return row
+
+    def forget(self, thread_id: str) -> None:
+        with self._lock:
+            self._cache.pop(thread_id, None)
+
+    # -----------------------------
+    # prompt context
+    # -----------------------------
+    def context(
+        self,
+        thread_id: str,
+        user_id: Optional[str] = None,
+        entries: Optional[List[HistoryEntry]] = None,
+    ) -> Tuple[Optional[str], List[HistoryEntry]]:
+        """
+        (summary, recent entries) to show in a prompt.
+
+        `entries` may be passed by callers that already hold the thread's
+        newest messages (the WebSocket session); otherwise the tail is read.
+        Schedules a background fold when too much sits outside the summary.
+        """
+        if not self.enabled:
+            if entries is None:
+                entries = ThreadService.get_recent_messages(thread_id, limit=5)
+            return None, entries[-5:]
+
+        window = self.recent_messages + self.fold_messages
+        summary = self._summary(thread_id)
+        if entries is None:
+            entries = ThreadService.get_recent_messages(thread_id, limit=window + self.fold_messages)
+
+        covered = _covered_until(summary)
+        unfolded = [e for e in entries if covered is None or _aware(e.timestamp) > covered]
+
+        beyond = unfolded[:-self.recent_messages] if self.recent_messages else unfolded
+        if beyond and (
+            len(beyond) >= self.fold_messages
+            or sum(_entry_tokens(e) for e in beyond) >= self.fold_tokens
+        ):
+            self._schedule(thread_id, user_id)
+
+        text = (summary or {}).get("summary") or None
+        return text, unfolded[-window:]
+
+    # -----------------------------
+    # background folding
+    # -----------------------------
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="summary")
+            return self._executor
+
+    def _schedule(self, thread_id: str, user_id: Optional[str]) -> None:
+        with self._lock:
+            if thread_id in self._folding:
+                return
+            self._folding.add(thread_id)
+        self._pool().submit(self._fold, thread_id, user_id)
+
+    def _fold(self, thread_id: str, user_id: Optional[str]) -> None:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            outcome = self.fold(thread_id, user_id)
+        except Exception as e:
+            logger.warning("Summary fold failed", extra={"fields": {"thread_id": thread_id, "error": str(e)[:300]}})
+        finally:
+            with self._lock:
+                self._folding.discard(thread_id)
+            SUMMARY_FOLDS.labels(outcome=outcome).inc()
+            SUMMARY_FOLD_SECONDS.observe(time.perf_counter() - start)
+
+    def fold(self, thread_id: str, user_id: Optional[str] = None) -> str:
+        """Fold everything older than the recent window into the summary; returns the outcome."""
+        summary = ThreadService.get_summary(thread_id)
+        entries = ThreadService.get_recent_messages(thread_id, limit=_FOLD_SCAN_MESSAGES)
+        covered = _covered_until(summary)
+        unfolded = [e for e in entries if covered is None or _aware(e.timestamp) > covered]
+        to_fold = unfolded[:-self.recent_messages] if self.recent_messages else unfolded
+        if not to_fold:
+            self._remember(thread_id, summary)
+            return "noop"
+
+        prompt = _FOLD_PROMPT.format(
+            summary=(summary or {}).get("summary") or "(none yet)",
+            messages=_render_for_fold(to_fold),
+            max_words=self.max_chars // 6,
+        )
+        # Background work: never take capacity ahead of interactive turns
+        with diagnose_scheduler.slot(user_id, BATCH):
+            result: ThreadSummary = json_agent(prompt, ThreadSummary)
+
+        text = result.summary.strip()[: self.max_chars]
+        if not text:
+            return "empty"
+
+        covered_messages = int((summary or {}).get("covered_messages") or 0) + len(to_fold)
+        covered_until = _aware(to_fold[-1].timestamp).isoformat()
+        if not ThreadService.save_summary(thread_id, text, covered_until, covered_messages):
+            return "error"
+
+        self._remember(thread_id, {
+            "thread_id": thread_id,
+            "summary": text,
+            "covered_until": covered_until,
+            "covered_messages": covered_messages,
+        })
+        logger.info(
+            "Folded messages into thread summary",
+            extra={"fields": {"thread_id": thread_id, "folded": len(to_fold), "summary_chars": len(text)}},
+        )
+        return "success"
+
+
+thread_summarizer = ThreadSummarizer()
@@ -18,3 +18,152 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 # Check if the critical secret is present
 if not JWT_SECRET:
     print("[CRITICAL WARNING] JWT_SECRET environment variable is missing. Authentication will fail.")
+
+# Comma-separated emails or user ids allowed to read the /admin routes (empty: nobody)
+ADMIN_USERS = frozenset(u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip())
+
+# --- Thread storage ---
+# "auto" uses Supabase when configured and the in-memory store otherwise
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto")
+
+# Bounds for the in-memory store (whole LRU threads are evicted past the byte budget)
+MEMORY_STORE_MAX_BYTES = int(os.getenv("MEMORY_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+MEMORY_STORE_MAX_MESSAGES_PER_THREAD = int(os.getenv("MEMORY_STORE_MAX_MESSAGES_PER_THREAD", "200"))
+
+# --- Hot-thread message cache (write-through, in front of remote storage) ---
+MESSAGE_CACHE_ENABLED = os.getenv("MESSAGE_CACHE_ENABLED", "true").lower() == "true"
+MESSAGE_CACHE_MAX_ENTRIES = int(os.getenv("MESSAGE_CACHE_MAX_ENTRIES", "20000"))
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MESSAGE_CACHE_TTL_SECONDS = float(os.getenv("MESSAGE_CACHE_TTL_SECONDS", "300"))
+
+# --- Logging ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "json" for Cloud Run structured logs, "text" for local development
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Fraction of verbose payload logs (raw LLM responses etc.) kept at DEBUG
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+# --- Hedged LLM requests (opt-in) ---
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+# Fire the backup once the primary is slower than this percentile of recent calls
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+# Max hedges per primary call over a rolling minute
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_MS = float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", "250"))
+LLM_HEDGE_MAX_WORKERS = int(os.getenv("LLM_HEDGE_MAX_WORKERS", "64"))
+# Model for the backup request; empty means the same model as the primary
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "")
+
+# --- LLM model routing and circuit breakers ---
+# Candidate models, in default preference order (duplicates are ignored)
+LLM_MODELS = list(dict.fromkeys(
+    m.strip() for m in os.getenv("LLM_MODELS", "gemini-2.0-flash,gemini-2.5-flash").split(",") if m.strip()
+))
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.2"))
+# Open a model's circuit after this many consecutive failures...
+LLM_CB_FAILURE_THRESHOLD = int(os.getenv("LLM_CB_FAILURE_THRESHOLD", "3"))
+# ...or once its EWMA error rate passes this (after LLM_CB_MIN_CALLS calls)
+LLM_CB_ERROR_RATE = float(os.getenv("LLM_CB_ERROR_RATE", "0.5"))
+LLM_CB_MIN_CALLS = int(os.getenv("LLM_CB_MIN_CALLS", "10"))
+# How long an open circuit waits before a background probe
+LLM_CB_OPEN_SECONDS = float(os.getenv("LLM_CB_OPEN_SECONDS", "30"))
+
+# --- Upstream LLM admission (0 disables a limit) ---
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_ADMISSION_TIMEOUT_SECONDS = float(os.getenv("LLM_ADMISSION_TIMEOUT_SECONDS", "20"))
+# Output size assumed when charging the tokens-per-minute budget
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "256"))
+# Back-off after a 429 that carries no usable Retry-After header
+LLM_429_BACKOFF_SECONDS = float(os.getenv("LLM_429_BACKOFF_SECONDS", "5"))
+
+# Concurrent calls with an identical rendered prompt share one upstream call
+LLM_COALESCE_ENABLED = os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "true"
+
+# Most commands returned to the client in one diagnose turn
+DIAGNOSE_MAX_COMMANDS = int(os.getenv("DIAGNOSE_MAX_COMMANDS", "5"))
+
+# --- Embedding input (app/services/embeddings.py) ---
+# Characters per encoded chunk; MiniLM only reads ~256 tokens (~1000 chars of logs)
+EMBEDDING_CHUNK_CHARS = int(os.getenv("EMBEDDING_CHUNK_CHARS", "1000"))
+# Chunks per long message: the head plus windows around error markers in the
+# output. Each chunk is a full encode; 1 splices head and error into one chunk
+EMBEDDING_MAX_CHUNKS = int(os.getenv("EMBEDDING_MAX_CHUNKS", "2"))
+
+# --- Embedding micro-batching (app/services/embedding_batcher.py) ---
+# Concurrent encodes are collected and run as one batch; false encodes per call
+EMBEDDING_BATCH_ENABLED = os.getenv("EMBEDDING_BATCH_ENABLED", "true").lower() == "true"
+# A batch is encoded once this many texts are waiting...
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "32"))
+# ...or the oldest has waited this long
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+
+# --- Out-of-process embedding workers (app/services/embedding_pool.py) ---
+# Worker processes that each hold the model; 0 encodes inside the API process
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "0"))
+# torch intra-op threads per worker (0 = torch default, i.e. all cores each)
+EMBEDDING_WORKER_TORCH_THREADS = int(os.getenv("EMBEDDING_WORKER_TORCH_THREADS", "1"))
+# A worker that takes longer than this on one batch is killed and respawned
+EMBEDDING_WORKER_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_WORKER_TIMEOUT_SECONDS", "60"))
+
+# --- Stored embedding encoding (app/services/vector_codec.py) ---
+# float32 | halfvec | float16 | int8
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "float32").strip().lower()
+# .npz PCA basis from app/scripts/fit_embedding_pca.py; empty keeps full dimension
+EMBEDDING_PCA_PATH = os.getenv("EMBEDDING_PCA_PATH", "")
+
+# Diagnose and thread-message responses are encoded with orjson, skipping the
+# response_model re-validation (app/services/serialization.py)
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "true").lower() == "true"
+
+# Most thread ids accepted by one /threads/bulk/* request
+THREADS_BULK_MAX_IDS = int(os.getenv("THREADS_BULK_MAX_IDS", "500"))
+
+# NDJSON export / import of thread history
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+# Longest NDJSON line accepted by /threads/import (after decompression); longer is a 413
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(4 * 1024 * 1024)))
+
+# --- Command-output compaction (app/services/compaction.py) ---
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"
+# Outputs shorter than this (and free of escape codes) are kept as sent
+COMPACTION_MIN_CHARS = int(os.getenv("COMPACTION_MIN_CHARS", "200"))
+# Hard cap after compaction; the middle of longer outputs is cut (0 disables)
+COMPACTION_MAX_CHARS = int(os.getenv("COMPACTION_MAX_CHARS", "20000"))
+
+# --- Rolling per-thread conversation summary ---
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+# Newest messages always shown verbatim after a fold
+SUMMARY_RECENT_MESSAGES = int(os.getenv("SUMMARY_RECENT_MESSAGES", "6"))
+# Fold once this many messages (or tokens) sit beyond the recent window
+SUMMARY_FOLD_MESSAGES = int(os.getenv("SUMMARY_FOLD_MESSAGES", "6"))
+SUMMARY_FOLD_TOKENS = int(os.getenv("SUMMARY_FOLD_TOKENS", "3000"))
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "2400"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_CACHE_TTL_SECONDS = float(os.getenv("SUMMARY_CACHE_TTL_SECONDS", "300"))
+
+# --- Idempotency-Key on the diagnose routes (app/services/idempotency.py) ---
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+# How long a finished response is replayed for its key
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Finished responses kept in process (storage keeps the rest)
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# A duplicate waits this long for the in-flight original before a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+
+# --- Per-user fair scheduling of diagnose work ---
+SCHED_MAX_ACTIVE = int(os.getenv("SCHED_MAX_ACTIVE", str(LLM_MAX_CONCURRENCY)))
+SCHED_INTERACTIVE_WEIGHT = float(os.getenv("SCHED_INTERACTIVE_WEIGHT", "8"))
+SCHED_BATCH_WEIGHT = float(os.getenv("SCHED_BATCH_WEIGHT", "1"))
+SCHED_INTERACTIVE_USER_CONCURRENCY = int(os.getenv("SCHED_INTERACTIVE_USER_CONCURRENCY", "2"))
+SCHED_BATCH_USER_CONCURRENCY = int(os.getenv("SCHED_BATCH_USER_CONCURRENCY", "4"))
+SCHED_MAX_QUEUED_PER_USER = int(os.getenv("SCHED_MAX_QUEUED_PER_USER", "100"))
+SCHED_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SCHED_QUEUE_TIMEOUT_SECONDS", "60"))
+# Comma-separated emails or user ids that always run as batch
+SCHED_BATCH_USERS = frozenset(u.strip() for u in os.getenv("SCHED_BATCH_USERS", "").split(",") if u.strip())
+# Worker threads for sync routes; queued diagnose requests each hold one
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "200"))
@@ -7,6 +7,7 @@ or still import submodules like `from app.database.thread_service import ThreadS
 """
 from .supabase_client import supabase, is_supabase_available  # type: ignore
 from .supabase_auth import get_user_by_email, create_user, verify_user_credentials  # type: ignore
+from .storage import ThreadStorage, get_storage, set_storage  # type: ignore
 from .thread_service import ThreadService  # type: ignore
 
 __all__ = [
@@ -15,5 +16,8 @@ __all__ = [
 	"get_user_by_email",
 	"create_user",
 	"verify_user_credentials",
+	"ThreadStorage",
+	"get_storage",
+	"set_storage",
 	"ThreadService",
 ]
@@ -0,0 +1,315 @@
+"""
+Bounded in-memory thread storage
+
+Used when Supabase is not configured (local dev, tests, load tests) and
+usable as a fast local tier in front of a remote backend. Memory is bounded
+twice: each thread keeps at most MEMORY_STORE_MAX_MESSAGES_PER_THREAD
+messages (oldest dropped first), and once the estimated footprint of all
+threads passes MEMORY_STORE_MAX_BYTES, whole least-recently-used threads
+are evicted.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.config.config import MEMORY_STORE_MAX_BYTES, MEMORY_STORE_MAX_MESSAGES_PER_THREAD
+from app.database.storage import ThreadStorage
+
+
+# Rough fixed cost of a record on top of its string payloads
+_MESSAGE_OVERHEAD = 120
+_THREAD_OVERHEAD = 400
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _size(value: Optional[str]) -> int:
+    return len(value) if value else 0
+
+
+class _MessageRecord(NamedTuple):
+    id: str
+    role: str
+    content: str
+    command: Optional[str]
+    command_output: Optional[str]
+    user_id: Optional[str]
+    created_at: str
+
+    def nbytes(self) -> int:
+        return (
+            _MESSAGE_OVERHEAD
+            + _size(self.content)
+            + _size(self.command)
+            + _size(self.command_output)
+        )
+
+
+class _ThreadRecord:
+    __slots__ = (
+        "id", "user_id", "title", "created_at", "updated_at", "archived_at", "messages", "summary", "nbytes",
+    )
+
+    def __init__(self, thread_id: str, user_id: Optional[str], title: str, created_at: str):
+        self.id = thread_id
+        self.user_id = user_id
+        self.title = title
+        self.created_at = created_at
+        self.updated_at = created_at
+        self.archived_at: Optional[str] = None
+        self.messages: List[_MessageRecord] = []
+        self.summary: Optional[Dict] = None
+        self.nbytes = _THREAD_OVERHEAD + _size(title)
+
+    def as_row(self) -> Dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "title": self.title,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "archived_at": self.archived_at,
+        }
+
+
+def _message_row(thread_id: str, rec: _MessageRecord) -> Dict:
+    return {
+        "id": rec.id,
+        "thread_id": thread_id,
+        "user_id": rec.user_id,
+        "role": rec.role,
+        "content": rec.content,
+        "command": rec.command,
+        "command_output": rec.command_output,
+        "created_at": rec.created_at,
+    }
+
+
+class InMemoryStorage(ThreadStorage):
+    """Thread-safe LRU store of threads and their messages."""
+
+    stores_embeddings = False
+    is_local = True
+
+    def __init__(
+        self,
+        max_bytes: int = MEMORY_STORE_MAX_BYTES,
+        max_messages_per_thread: int = MEMORY_STORE_MAX_MESSAGES_PER_THREAD,
+    ):
+        self.max_bytes = max_bytes
+        self.max_messages_per_thread = max_messages_per_thread
+        self._threads: "OrderedDict[str, _ThreadRecord]" = OrderedDict()
+        self._by_user: Dict[Optional[str], set] = {}
+        self._nbytes = 0
+        self._evicted_threads = 0
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # internal helpers (lock held)
+    # -----------------------------
+    def _touch(self, thread_id: str) -> Optional[_ThreadRecord]:
+        rec = self._threads.get(thread_id)
+        if rec is not None:
+            self._threads.move_to_end(thread_id)
+        return rec
+
+    def _drop(self, rec: _ThreadRecord) -> None:
+        self._threads.pop(rec.id, None)
+        self._nbytes -= rec.nbytes
+        owned = self._by_user.get(rec.user_id)
+        if owned is not None:
+            owned.discard(rec.id)
+            if not owned:
+                del self._by_user[rec.user_id]
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        while self._nbytes > self.max_bytes and len(self._threads) > 1:
+            oldest_id = next(iter(self._threads))
+            if oldest_id == keep:
+                # The thread being written is the only hot one; rotate it past
+                self._threads.move_to_end(oldest_id)
+                oldest_id = next(iter(self._threads))
+            self._drop(self._threads[oldest_id])
+            self._evicted_threads += 1
+
+    # -----------------------------
+    # ThreadStorage
+    # -----------------------------
+    def create_thread(self, data: Dict) -> Dict:
+        created_at = data.get("created_at") or _now_iso()
+        rec = _ThreadRecord(
+            thread_id=data["id"],
+            user_id=data.get("user_id"),
+            title=data.get("title") or "New Chat",
+            created_at=created_at,
+        )
+        rec.archived_at = data.get("archived_at")
+        with self._lock:
+            existing = self._threads.get(rec.id)
+            if existing is not None:
+                self._drop(existing)
+            self._threads[rec.id] = rec
+            self._by_user.setdefault(rec.user_id, set()).add(rec.id)
+            self._nbytes += rec.nbytes
+            self._evict(keep=rec.id)
+            return rec.as_row()
+
+    def get_thread(self, thread_id: str) -> Optional[Dict]:
+        with self._lock:
+            rec = self._touch(thread_id)
+            return rec.as_row() if rec is not None else None
+
+    def list_threads(self, user_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            if user_id:
+                recs = [self._threads[tid] for tid in self._by_user.get(user_id, ())]
+            else:
+                recs = list(self._threads.values())
+            recs = [r for r in recs if r.archived_at is None]
+            recs.sort(key=lambda r: r.updated_at, reverse=True)
+            return [r.as_row() for r in recs[:limit]]
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            rec = self._threads.get(thread_id)
+            if rec is not None:
+                self._drop(rec)
+
+    def get_threads(self, thread_ids: List[str]) -> List[Dict]:
+        with self._lock:
+            return [self._threads[tid].as_row() for tid in thread_ids if tid in self._threads]
+
+    def delete_threads(self, thread_ids: List[str]) -> None:
+        with self._lock:
+            for tid in thread_ids:
+                rec = self._threads.get(tid)
+                if rec is not None:
+                    self._drop(rec)
+
+    def archive_threads(self, thread_ids: List[str], archived_at: str) -> None:
+        with self._lock:
+            for tid in thread_ids:
+                rec = self._threads.get(tid)
+                if rec is not None:
+                    rec.archived_at = archived_at
+
+    def update_titles(self, rows: List[Dict]) -> None:
+        with self._lock:
+            for row in rows:
+                rec = self._threads.get(row["id"])
+                if rec is None or rec.user_id != row.get("user_id"):
+                    continue
+                title = row.get("title") or "New Chat"
+                delta = _size(title) - _size(rec.title)
+                rec.title = title
+                rec.nbytes += delta
+                self._nbytes += delta
+
+    def add_message(self, msg_data: Dict, emb_data: Optional[Dict] = None) -> Dict:
+        thread_id = msg_data["thread_id"]
+        record = _MessageRecord(
+            id=msg_data["id"],
+            role=sys.intern(msg_data["role"]),
+            content=msg_data.get("content") or "",
+            command=msg_data.get("command"),
+            command_output=msg_data.get("command_output"),
+            user_id=msg_data.get("user_id"),
+            created_at=msg_data.get("created_at") or _now_iso(),
+        )
+        size = record.nbytes()
+
+        with self._lock:
+            rec = self._touch(thread_id)
+            if rec is None:
+                # Mirror Supabase, where messages may reference a thread row
+                # created elsewhere; adopt it with the message's owner
+                rec = _ThreadRecord(thread_id, record.user_id, "New Chat", record.created_at)
+                self._threads[thread_id] = rec
+                self._by_user.setdefault(rec.user_id, set()).add(thread_id)
+                self._nbytes += rec.nbytes
+
+            rec.messages.append(record)
+            rec.nbytes += size
+            rec.updated_at = record.created_at
+            self._nbytes += size
+
+            overflow = len(rec.messages) - self.max_messages_per_thread
+            if overflow > 0:
+                dropped = rec.messages[:overflow]
+                del rec.messages[:overflow]
+                freed = sum(m.nbytes() for m in dropped)
+                rec.nbytes -= freed
+                self._nbytes -= freed
+
+            self._evict(keep=thread_id)
+            return _message_row(thread_id, record)
+
+    def get_messages(self, thread_id: str, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            rec = self._touch(thread_id)
+            if rec is None:
+                return []
+            return [_message_row(thread_id, m) for m in rec.messages[:limit]]
+
+    def get_recent_messages(self, thread_id: str, limit: int) -> List[Dict]:
+        with self._lock:
+            rec = self._touch(thread_id)
+            if rec is None or limit <= 0:
+                return []
+            return [_message_row(thread_id, m) for m in rec.messages[-limit:]]
+
+    def get_threads_page(self, user_id: str, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        with self._lock:
+            recs = [self._threads[tid] for tid in self._by_user.get(user_id, ())]
+        keyed = sorted(((r.created_at, r.id), r) for r in recs)
+        return [r.as_row() for key, r in keyed if after is None or key > after][:limit]
+
+    def get_messages_page(self, thread_id: str, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        with self._lock:
+            rec = self._threads.get(thread_id)
+            messages = list(rec.messages) if rec is not None else []
+        keyed = sorted(((m.created_at, m.id), m) for m in messages)
+        return [_message_row(thread_id, m) for key, m in keyed if after is None or key > after][:limit]
+
+    def insert_threads(self, rows: List[Dict]) -> None:
+        for row in rows:
+            self.create_thread(row)
+
+    def insert_messages(self, rows: List[Dict]) -> None:
+        for row in rows:
+            self.add_message(row)
+
+    def get_summary(self, thread_id: str) -> Optional[Dict]:
+        with self._lock:
+            rec = self._threads.get(thread_id)
+            return dict(rec.summary) if rec is not None and rec.summary is not None else None
+
+    def upsert_summary(self, data: Dict) -> None:
+        with self._lock:
+            rec = self._threads.get(data["thread_id"])
+            if rec is None:
+                # Thread was evicted or deleted; nothing left to summarise
+                return
+            size = _size(data.get("summary"))
+            old = _size(rec.summary.get("summary")) if rec.summary is not None else 0
+            rec.summary = dict(data)
+            rec.nbytes += size - old
+            self._nbytes += size - old
+            self._evict(keep=rec.id)
+
+    # -----------------------------
+    # introspection
+    # -----------------------------
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "threads": len(self._threads),
+                "messages": sum(len(r.messages) for r in self._threads.values()),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "evicted_threads": self._evicted_threads,
+            }
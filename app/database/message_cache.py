@@ -0,0 +1,234 @@
+"""
+Process-local write-through cache of recently active threads' parsed history.
+
+An active troubleshooting session re-reads its thread every few seconds;
+this keeps the parsed `HistoryEntry` list in memory so those reads skip the
+Supabase round trip and the `created_at` parsing. Writes go through
+`ThreadService.add_message`, which appends to a cached thread, and
+`delete_thread` drops it. A write opens a per-thread write (`begin_write`)
+before the storage insert; if a fill lands while it is in flight, that fill
+may already contain the new row, so the write drops the entry instead of
+appending a duplicate. The cache is bounded by total entries and
+estimated bytes (LRU threads are evicted) and entries expire after a TTL so
+writes from other instances are picked up eventually.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from app.agent.schema import HistoryEntry
+from app.config.config import (
+    MESSAGE_CACHE_MAX_BYTES,
+    MESSAGE_CACHE_MAX_ENTRIES,
+    MESSAGE_CACHE_TTL_SECONDS,
+)
+
+_ENTRY_OVERHEAD = 200
+
+
+def _entry_bytes(entry: HistoryEntry) -> int:
+    return (
+        _ENTRY_OVERHEAD
+        + len(entry.message)
+        + (len(entry.command) if entry.command else 0)
+        + (len(entry.command_output) if entry.command_output else 0)
+    )
+
+
+class _CachedThread:
+    __slots__ = ("entries", "complete", "nbytes", "expires_at")
+
+    def __init__(self, entries: List[HistoryEntry], complete: bool, expires_at: float):
+        self.entries = entries
+        # False when the fill hit its limit, i.e. only a prefix is cached
+        self.complete = complete
+        self.nbytes = sum(_entry_bytes(e) for e in entries)
+        self.expires_at = expires_at
+
+
+class _Write:
+    __slots__ = ("filled",)
+
+    def __init__(self):
+        # Set when a fill lands while the storage write is in flight
+        self.filled = False
+
+
+class HotThreadCache:
+    """LRU cache of thread_id -> oldest-first HistoryEntry list."""
+
+    def __init__(
+        self,
+        max_entries: int = MESSAGE_CACHE_MAX_ENTRIES,
+        max_bytes: int = MESSAGE_CACHE_MAX_BYTES,
+        ttl_seconds: float = MESSAGE_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._threads: "OrderedDict[str, _CachedThread]" = OrderedDict()
+        # Fill tokens: a write between a miss and its fill voids the fill
+        self._pending: Dict[str, object] = {}
+        # Storage writes in flight per thread (see `begin_write`)
+        self._writes: Dict[str, List[_Write]] = {}
+        self._entries = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # internal helpers (lock held)
+    # -----------------------------
+    def _remove(self, thread_id: str) -> None:
+        cached = self._threads.pop(thread_id, None)
+        if cached is not None:
+            self._entries -= len(cached.entries)
+            self._bytes -= cached.nbytes
+
+    def _evict(self) -> None:
+        while self._threads and (self._entries > self.max_entries or self._bytes > self.max_bytes):
+            oldest_id = next(iter(self._threads))
+            self._remove(oldest_id)
+            self._evictions += 1
+
+    # -----------------------------
+    # reads
+    # -----------------------------
+    def get(self, thread_id: str, limit: int) -> Optional[List[HistoryEntry]]:
+        """Return up to `limit` oldest-first entries, or None on a miss."""
+        with self._lock:
+            cached = self._threads.get(thread_id)
+            if cached is not None and cached.expires_at < time.monotonic():
+                self._remove(thread_id)
+                cached = None
+            if cached is None or (not cached.complete and len(cached.entries) < limit):
+                self._misses += 1
+                return None
+            self._threads.move_to_end(thread_id)
+            self._hits += 1
+            return cached.entries[:limit]
+
+    def get_tail(self, thread_id: str, limit: int) -> Optional[List[HistoryEntry]]:
+        """Return the newest `limit` entries (oldest-first); only a complete thread can answer."""
+        with self._lock:
+            cached = self._threads.get(thread_id)
+            if cached is not None and cached.expires_at < time.monotonic():
+                self._remove(thread_id)
+                cached = None
+            if cached is None or not cached.complete:
+                self._misses += 1
+                return None
+            self._threads.move_to_end(thread_id)
+            self._hits += 1
+            return cached.entries[-limit:] if limit > 0 else []
+
+    def begin_fill(self, thread_id: str) -> object:
+        """Call before reading from storage after a miss; pass the token to `fill`."""
+        token = object()
+        with self._lock:
+            self._pending[thread_id] = token
+        return token
+
+    def fill(self, thread_id: str, token: object, entries: List[HistoryEntry], complete: bool) -> None:
+        with self._lock:
+            if self._pending.get(thread_id) is not token:
+                return
+            del self._pending[thread_id]
+            for write in self._writes.get(thread_id, ()):
+                write.filled = True
+            self._remove(thread_id)
+            cached = _CachedThread(list(entries), complete, time.monotonic() + self.ttl_seconds)
+            self._threads[thread_id] = cached
+            self._entries += len(cached.entries)
+            self._bytes += cached.nbytes
+            self._evict()
+
+    def abandon_fill(self, thread_id: str, token: object) -> None:
+        """Drop a fill token whose read turned out not to be cacheable."""
+        with self._lock:
+            if self._pending.get(thread_id) is token:
+                del self._pending[thread_id]
+
+    # -----------------------------
+    # writes
+    # -----------------------------
+    def _end_write(self, thread_id: str, write: _Write) -> None:
+        writes = self._writes.get(thread_id)
+        if writes is not None and write in writes:
+            writes.remove(write)
+            if not writes:
+                del self._writes[thread_id]
+
+    def begin_write(self, thread_id: str) -> _Write:
+        """Call before the storage insert; pass the result to `append` or `abandon_write`."""
+        write = _Write()
+        with self._lock:
+            self._writes.setdefault(thread_id, []).append(write)
+        return write
+
+    def abandon_write(self, thread_id: str, write: _Write) -> None:
+        """The storage write failed (or may have): drop the thread."""
+        with self._lock:
+            self._end_write(thread_id, write)
+            self._pending.pop(thread_id, None)
+            self._remove(thread_id)
+
+    def append(self, thread_id: str, write: _Write, entry: HistoryEntry) -> None:
+        """Write-through for a newly stored message."""
+        with self._lock:
+            self._end_write(thread_id, write)
+            self._pending.pop(thread_id, None)
+            if write.filled:
+                # The fill read storage after (or during) the insert and may hold this row already
+                self._remove(thread_id)
+                return
+            cached = self._threads.get(thread_id)
+            if cached is None or not cached.complete:
+                # A partial prefix stays valid as-is; nothing to extend
+                return
+            cached.entries.append(entry)
+            size = _entry_bytes(entry)
+            cached.nbytes += size
+            self._entries += 1
+            self._bytes += size
+            self._threads.move_to_end(thread_id)
+            self._evict()
+
+    def invalidate(self, thread_id: str) -> None:
+        with self._lock:
+            self._pending.pop(thread_id, None)
+            self._remove(thread_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._threads.clear()
+            self._pending.clear()
+            for writes in self._writes.values():
+                for write in writes:
+                    write.filled = True
+            self._entries = 0
+            self._bytes = 0
+
+    # -----------------------------
+    # introspection
+    # -----------------------------
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "threads": len(self._threads),
+                "entries": self._entries,
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+            }
+
+
+message_cache = HotThreadCache()
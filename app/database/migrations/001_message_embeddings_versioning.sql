@@ -0,0 +1,25 @@
+-- Versioned embedding rows (app/services/embeddings.py, app/services/vector_codec.py).
+--
+-- model             EMBEDDING_MODEL_VERSION that wrote the row. The backfill
+--                   (app/scripts/backfill_embeddings.py) re-embeds rows where it
+--                   differs or is null.
+-- embedding_format  VectorCodec.version, e.g. "int8+pca128-1a2b3c4d". Null means
+--                   the original float32 JSON list; the default EMBEDDING_FORMAT
+--                   leaves it null.
+-- embedding_packed  base64 payload for EMBEDDING_FORMAT=float16 / int8, which
+--                   store no `embedding`.
+--
+-- Safe to re-run. Two settings also change the `embedding` column itself,
+-- left out here because they rewrite the table:
+-- - EMBEDDING_FORMAT=halfvec:
+--     alter table message_embeddings alter column embedding type halfvec(384);
+-- - EMBEDDING_PCA_PATH with float32 or halfvec stores projected vectors, so the
+--   column must take the PCA dimension instead of 384, e.g. for 128 components
+--     alter table message_embeddings alter column embedding type vector(128) using null;
+--   (halfvec(128) with halfvec). Re-run app/scripts/backfill_embeddings.py after
+--   either change: every row must be re-encoded in the new dimension.
+
+alter table message_embeddings add column if not exists model text;
+alter table message_embeddings add column if not exists embedding_format text;
+alter table message_embeddings add column if not exists embedding_packed text;
+alter table message_embeddings alter column embedding drop not null;
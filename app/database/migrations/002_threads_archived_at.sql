@@ -0,0 +1,14 @@
+-- Archived threads (POST /threads/bulk/archive, app/routes/threads.py).
+--
+-- archived_at  When the thread was archived; null for live threads.
+--              SupabaseStorage.list_threads filters on `archived_at is null`,
+--              so GET /threads returns nothing until this column exists.
+--
+-- Safe to re-run.
+
+alter table threads add column if not exists archived_at timestamptz;
+
+-- GET /threads: a user's live threads, newest first
+create index if not exists threads_user_live_updated_idx
+    on threads (user_id, updated_at desc)
+    where archived_at is null;
@@ -0,0 +1,19 @@
+-- Rolling per-thread summaries (app/agent/summarizer.py).
+--
+-- thread_id         One row per thread; upserted on conflict(thread_id).
+-- summary           Text shown to prompts in place of the folded messages.
+-- covered_until     created_at of the last folded message; newer messages
+--                   are still shown verbatim.
+-- covered_messages  How many messages the summary covers.
+-- updated_at        Time of the last fold.
+--
+-- DELETE /threads/{id} and /threads/bulk/delete remove the thread's row first,
+-- so both fail until this table exists. Safe to re-run.
+
+create table if not exists thread_summaries (
+    thread_id uuid primary key references threads (id) on delete cascade,
+    summary text not null default '',
+    covered_until timestamptz,
+    covered_messages integer not null default 0,
+    updated_at timestamptz not null default now()
+);
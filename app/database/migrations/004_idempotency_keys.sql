@@ -0,0 +1,25 @@
+-- Stored diagnose responses for Idempotency-Key replays (app/services/idempotency.py).
+--
+-- (user_id, key)  One row per key and user; upserted on conflict(user_id, key).
+-- fingerprint     Hash of the route and request body, to reject a reused key.
+-- status_code     HTTP status of the stored response.
+-- body            JSON body of the stored response.
+-- expires_at      created_at + IDEMPOTENCY_TTL_SECONDS; expired rows are never
+--                 replayed and are purged in batches.
+--
+-- Without this table every keyed request logs a read and a write error, and
+-- retries landing on another instance are not replayed. Safe to re-run.
+
+create table if not exists idempotency_keys (
+    user_id text not null,
+    key text not null,
+    fingerprint text not null,
+    status_code integer not null,
+    body text not null,
+    created_at timestamptz not null default now(),
+    expires_at timestamptz not null,
+    primary key (user_id, key)
+);
+
+-- delete_expired_idempotency_records: delete ... where expires_at < now
+create index if not exists idempotency_keys_expires_at_idx on idempotency_keys (expires_at);
@@ -0,0 +1,181 @@
+"""
+Pluggable storage backends for threads and messages.
+
+`ThreadService` talks to whatever `get_storage()` returns:
+
+- `SupabaseStorage` — the production backend (threads, messages, message_embeddings,
+  thread_summaries, idempotency_keys); archived threads have `threads.archived_at` set.
+  Schema changes beyond the original tables are in app/database/migrations/
+- `InMemoryStorage` — bounded process-local backend for dev/tests and as a fast local tier
+
+Operations only some backends support are separate capability ABCs
+(`EmbeddingMaintenance`, `IdempotencyRecords`); callers check for them with isinstance.
+
+Select with STORAGE_BACKEND=auto|supabase|memory (auto picks Supabase when configured).
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from app.config.config import STORAGE_BACKEND
+from app.utils.log import get_logger
+
+logger = get_logger("storage")
+
+
+class ThreadStorage(ABC):
+    """
+    Interface every storage backend implements.
+
+    Rows are plain dicts shaped like the Supabase tables so callers do not
+    care which backend is active. Backends raise on failure; ThreadService
+    decides how to degrade.
+    """
+
+    # Whether message embeddings are persisted (skip encoding when they are not)
+    stores_embeddings: bool = False
+
+    # Whether reads are already process-local (no point caching in front of it)
+    is_local: bool = False
+
+    @abstractmethod
+    def create_thread(self, data: Dict) -> Dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_thread(self, thread_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_threads(self, user_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_thread(self, thread_id: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_threads(self, thread_ids: List[str]) -> List[Dict]:
+        """Rows for whichever of `thread_ids` exist, in one lookup."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_threads(self, thread_ids: List[str]) -> None:
+        """Delete threads with their messages, embeddings and summaries, batched per table."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def archive_threads(self, thread_ids: List[str], archived_at: str) -> None:
+        """Hide threads from list_threads without deleting anything."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_titles(self, rows: List[Dict]) -> None:
+        """Set titles of existing threads owned by user_id; rows carry id, user_id, title. Never inserts."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_message(self, msg_data: Dict, emb_data: Optional[Dict] = None) -> Dict:
+        """Store a message (and its embedding row, if any); return the stored message row."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_messages(self, thread_id: str, limit: int = 100) -> List[Dict]:
+        """Oldest-first message rows for a thread, at most `limit`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_recent_messages(self, thread_id: str, limit: int) -> List[Dict]:
+        """The newest `limit` message rows of a thread, oldest-first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_threads_page(self, user_id: str, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        """
+        A user's threads ordered by (created_at, id), archived ones included,
+        starting after the `after` key. Keyset paging: cost does not grow with depth.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_messages_page(self, thread_id: str, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        """A thread's messages ordered by (created_at, id), starting after the `after` key."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_threads(self, rows: List[Dict]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_messages(self, rows: List[Dict]) -> None:
+        """Bulk insert message rows without embeddings."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_summary(self, thread_id: str) -> Optional[Dict]:
+        """Rolling summary row for a thread (thread_id, summary, covered_until, covered_messages)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_summary(self, data: Dict) -> None:
+        raise NotImplementedError
+
+
+class EmbeddingMaintenance(ABC):
+    """Bulk access to stored embeddings, for the backfill and PCA fitting scripts."""
+
+    @abstractmethod
+    def get_all_messages_page(self, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        """Messages of every thread ordered by (created_at, id), starting after the `after` key."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_embedding_rows(self, message_ids: List[str]) -> List[Dict]:
+        """id, message_id, model and embedding_format of the embedding rows for these messages."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_embeddings(self, rows: List[Dict]) -> None:
+        raise NotImplementedError
+
+
+class IdempotencyRecords(ABC):
+    """Diagnose responses stored per Idempotency-Key, shared by every instance."""
+
+    @abstractmethod
+    def get_idempotency_record(self, user_id: str, key: str) -> Optional[Dict]:
+        """Stored diagnose response for (user_id, key): fingerprint, status_code, body, expires_at."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_idempotency_record(self, row: Dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_expired_idempotency_records(self, now: str) -> None:
+        raise NotImplementedError
+
+
+_storage: Optional[ThreadStorage] = None
+
+
+def get_storage() -> ThreadStorage:
+    """Return the active backend, choosing it on first use."""
+    global _storage
+    if _storage is None:
+        from app.database.supabase_client import is_supabase_available
+
+        backend = (STORAGE_BACKEND or "auto").strip().lower()
+        if backend == "supabase" or (backend == "auto" and is_supabase_available()):
+            from app.database.supabase_storage import SupabaseStorage
+            _storage = SupabaseStorage()
+        else:
+            from app.database.memory_storage import InMemoryStorage
+            _storage = InMemoryStorage()
+        logger.info("storage backend selected", extra={"fields": {"backend": type(_storage).__name__}})
+    return _storage
+
+
+def set_storage(storage: Optional[ThreadStorage]) -> None:
+    """Install a specific backend (None re-runs auto selection on next use)."""
+    global _storage
+    _storage = storage
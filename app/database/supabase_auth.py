@@ -2,6 +2,10 @@ from typing import Optional, Dict
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app.database.supabase_client import supabase, is_supabase_available
+from app.services.metrics import supabase_timer
+from app.utils.log import get_logger
+
+logger = get_logger("auth")
 
 
 def get_user_by_email(email: str) -> Optional[Dict]:
@@ -10,13 +14,14 @@ def get_user_by_email(email: str) -> Optional[Dict]:
         return None
 
     try:
-        result = supabase.table("users").select("*").eq("email", email).limit(1).execute()
+        with supabase_timer("users", "select"):
+            result = supabase.table("users").select("*").eq("email", email).limit(1).execute()
         data = result.data or []
         if len(data) == 0:
             return None
         return data[0]
     except Exception as e:
-        print(f"[SUPABASE_AUTH] Failed to get user: {e}")
+        logger.error("Failed to get user", extra={"fields": {"error": str(e)}})
         return None
 
 
@@ -28,13 +33,14 @@ def create_user(email: str, password: str, name: Optional[str] = None) -> Option
     try:
         password_hash = generate_password_hash(password)
         user_data = {"email": email, "password_hash": password_hash, "name": name}
-        result = supabase.table("users").insert(user_data).execute()
+        with supabase_timer("users", "insert"):
+            result = supabase.table("users").insert(user_data).execute()
         inserted = result.data or []
         if len(inserted) == 0:
             return None
         return inserted[0]
     except Exception as e:
-        print(f"[SUPABASE_AUTH] Failed to create user: {e}")
+        logger.error("Failed to create user", extra={"fields": {"error": str(e)}})
         return None
 
 
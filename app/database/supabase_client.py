@@ -4,9 +4,12 @@ Supabase client configuration
 import os
 from typing import Optional
 from dotenv import load_dotenv
+from app.utils.log import get_logger
 
 load_dotenv()
 
+logger = get_logger("supabase")
+
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 
@@ -16,13 +19,14 @@ try:
     if SUPABASE_URL and SUPABASE_KEY:
         from supabase import create_client, Client
         supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("[SUPABASE] Connected successfully")
+        logger.info("Supabase client initialised")
     else:
-        print("[WARNING] SUPABASE_URL and/or SUPABASE_KEY not set. Thread persistence disabled.")
-        print("[INFO] To enable threads, set SUPABASE_URL and SUPABASE_KEY in .env file")
+        logger.warning(
+            "SUPABASE_URL and/or SUPABASE_KEY not set; using in-memory storage. "
+            "Set them in .env to persist threads"
+        )
 except Exception as e:
-    print(f"[WARNING] Failed to initialize Supabase: {e}")
-    print("[INFO] App will continue with in-memory storage only")
+    logger.warning("Failed to initialize Supabase; continuing with in-memory storage", exc_info=True)
     supabase = None
 
 def is_supabase_available() -> bool:
@@ -0,0 +1,191 @@
+"""
+Supabase-backed thread storage
+"""
+from typing import Dict, List, Optional, Tuple
+
+from app.database import supabase_client
+from app.database.storage import EmbeddingMaintenance, IdempotencyRecords, ThreadStorage
+from app.services.metrics import supabase_timer
+
+
+# Ids per `in` filter; keeps PostgREST request URLs well under proxy limits
+_IN_CHUNK = 200
+
+
+def _chunks(ids: List[str]):
+    for i in range(0, len(ids), _IN_CHUNK):
+        yield ids[i:i + _IN_CHUNK]
+
+
+def _after(query, after: Optional[Tuple[str, str]]):
+    """Keyset seek past (created_at, id); values are quoted for PostgREST's or= syntax."""
+    if after is None:
+        return query
+    created_at, row_id = after
+    return query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{row_id}")')
+
+
+def _db():
+    # Looked up per call so a client swapped in after import (e.g. by the
+    # load-test fakes) is picked up
+    return supabase_client.supabase
+
+
+class SupabaseStorage(ThreadStorage, EmbeddingMaintenance, IdempotencyRecords):
+    """Threads, messages and embeddings in the Supabase tables."""
+
+    stores_embeddings = True
+
+    def create_thread(self, data: Dict) -> Dict:
+        with supabase_timer("threads", "insert"):
+            result = _db().table("threads").insert(data).execute()
+        return (result.data or [data])[0]
+
+    def get_thread(self, thread_id: str) -> Optional[Dict]:
+        with supabase_timer("threads", "select"):
+            result = _db().table("threads").select("*").eq("id", thread_id).execute()
+        if result.data:
+            return result.data[0]
+        return None
+
+    def list_threads(self, user_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query = _db().table("threads").select("*").is_("archived_at", "null") \
+            .order("updated_at", desc=True).limit(limit)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        with supabase_timer("threads", "list"):
+            result = query.execute()
+        return result.data or []
+
+    def delete_thread(self, thread_id: str) -> None:
+        with supabase_timer("thread_summaries", "delete"):
+            _db().table("thread_summaries").delete().eq("thread_id", thread_id).execute()
+        with supabase_timer("messages", "delete"):
+            _db().table("messages").delete().eq("thread_id", thread_id).execute()
+        with supabase_timer("threads", "delete"):
+            _db().table("threads").delete().eq("id", thread_id).execute()
+
+    def get_threads(self, thread_ids: List[str]) -> List[Dict]:
+        rows: List[Dict] = []
+        for chunk in _chunks(thread_ids):
+            with supabase_timer("threads", "select_many"):
+                rows += _db().table("threads").select("*").in_("id", chunk).execute().data or []
+        return rows
+
+    def delete_threads(self, thread_ids: List[str]) -> None:
+        # Children first so a failure part-way never leaves orphaned messages
+        for chunk in _chunks(thread_ids):
+            for table, column in (
+                ("thread_summaries", "thread_id"),
+                ("message_embeddings", "thread_id"),
+                ("messages", "thread_id"),
+                ("threads", "id"),
+            ):
+                with supabase_timer(table, "delete_many"):
+                    _db().table(table).delete().in_(column, chunk).execute()
+
+    def archive_threads(self, thread_ids: List[str], archived_at: str) -> None:
+        for chunk in _chunks(thread_ids):
+            with supabase_timer("threads", "archive_many"):
+                _db().table("threads").update({"archived_at": archived_at}).in_("id", chunk).execute()
+
+    def update_titles(self, rows: List[Dict]) -> None:
+        # One UPDATE per row, not an upsert: an upsert would re-create a thread
+        # deleted since the ownership check. Titles differ per row, so they cannot share a statement
+        for row in rows:
+            with supabase_timer("threads", "update_title"):
+                _db().table("threads").update({"title": row["title"]}) \
+                    .eq("id", row["id"]).eq("user_id", row["user_id"]).execute()
+
+    def add_message(self, msg_data: Dict, emb_data: Optional[Dict] = None) -> Dict:
+        with supabase_timer("messages", "insert"):
+            result = _db().table("messages").insert(msg_data).execute()
+        if emb_data is not None:
+            with supabase_timer("message_embeddings", "insert"):
+                _db().table("message_embeddings").insert(emb_data).execute()
+        return (result.data or [msg_data])[0]
+
+    def get_messages(self, thread_id: str, limit: int = 100) -> List[Dict]:
+        with supabase_timer("messages", "select"):
+            res = _db().table("messages") \
+                .select("*") \
+                .eq("thread_id", thread_id) \
+                .order("created_at", desc=False) \
+                .limit(limit).execute()
+        return res.data or []
+
+    def get_recent_messages(self, thread_id: str, limit: int) -> List[Dict]:
+        with supabase_timer("messages", "select_recent"):
+            res = _db().table("messages") \
+                .select("*") \
+                .eq("thread_id", thread_id) \
+                .order("created_at", desc=True) \
+                .limit(limit).execute()
+        return list(reversed(res.data or []))
+
+    def get_threads_page(self, user_id: str, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        query = _db().table("threads").select("*").eq("user_id", user_id)
+        query = _after(query, after).order("created_at").order("id").limit(limit)
+        with supabase_timer("threads", "select_page"):
+            return query.execute().data or []
+
+    def get_messages_page(self, thread_id: str, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        query = _db().table("messages").select("*").eq("thread_id", thread_id)
+        query = _after(query, after).order("created_at").order("id").limit(limit)
+        with supabase_timer("messages", "select_page"):
+            return query.execute().data or []
+
+    def insert_threads(self, rows: List[Dict]) -> None:
+        if rows:
+            with supabase_timer("threads", "insert_many"):
+                _db().table("threads").insert(rows).execute()
+
+    def insert_messages(self, rows: List[Dict]) -> None:
+        if rows:
+            with supabase_timer("messages", "insert_many"):
+                _db().table("messages").insert(rows).execute()
+
+    def get_all_messages_page(self, after: Optional[Tuple[str, str]], limit: int) -> List[Dict]:
+        query = _db().table("messages").select("id,thread_id,content,command,command_output,created_at")
+        query = _after(query, after).order("created_at").order("id").limit(limit)
+        with supabase_timer("messages", "select_page"):
+            return query.execute().data or []
+
+    def get_embedding_rows(self, message_ids: List[str]) -> List[Dict]:
+        rows: List[Dict] = []
+        for chunk in _chunks(message_ids):
+            with supabase_timer("message_embeddings", "select_many"):
+                rows += _db().table("message_embeddings").select("id,message_id,model,embedding_format") \
+                    .in_("message_id", chunk).execute().data or []
+        return rows
+
+    def upsert_embeddings(self, rows: List[Dict]) -> None:
+        if rows:
+            with supabase_timer("message_embeddings", "upsert_many"):
+                _db().table("message_embeddings").upsert(rows, on_conflict="id").execute()
+
+    def get_summary(self, thread_id: str) -> Optional[Dict]:
+        with supabase_timer("thread_summaries", "select"):
+            result = _db().table("thread_summaries").select("*").eq("thread_id", thread_id).execute()
+        if result.data:
+            return result.data[0]
+        return None
+
+    def upsert_summary(self, data: Dict) -> None:
+        with supabase_timer("thread_summaries", "upsert"):
+            _db().table("thread_summaries").upsert(data, on_conflict="thread_id").execute()
+
+    def get_idempotency_record(self, user_id: str, key: str) -> Optional[Dict]:
+        with supabase_timer("idempotency_keys", "select"):
+            result = _db().table("idempotency_keys").select("*").eq("user_id", user_id).eq("key", key).execute()
+        if result.data:
+            return result.data[0]
+        return None
+
+    def upsert_idempotency_record(self, row: Dict) -> None:
+        with supabase_timer("idempotency_keys", "upsert"):
+            _db().table("idempotency_keys").upsert(row, on_conflict="user_id,key").execute()
+
+    def delete_expired_idempotency_records(self, now: str) -> None:
+        with supabase_timer("idempotency_keys", "delete_expired"):
+            _db().table("idempotency_keys").delete().lt("expires_at", now).execute()
@@ -1,14 +1,41 @@
 """
-Thread and message management service using Supabase
+Thread and message management service (Supabase or in-memory storage)
 """
-from typing import List, Optional, Dict
-from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from datetime import datetime, timezone
 from uuid import uuid4
-import json
 
-from app.database.supabase_client import supabase, is_supabase_available
-from app.services.embeddings import generate_embedding
+from app.config.config import MESSAGE_CACHE_ENABLED
+from app.database.message_cache import message_cache
+from app.database.storage import IdempotencyRecords, get_storage
+from app.services.embeddings import EMBEDDING_MODEL_VERSION, generate_message_embedding
+from app.services.vector_codec import get_vector_codec
 from app.agent.schema import HistoryEntry
+from app.utils.log import get_logger
+
+logger = get_logger("threads")
+
+
+def _use_cache(storage) -> bool:
+    return MESSAGE_CACHE_ENABLED and not storage.is_local
+
+
+def _row_to_entry(msg: Dict) -> HistoryEntry:
+    try:
+        timestamp = datetime.fromisoformat(msg["created_at"].replace("Z", "+00:00"))
+    except Exception:
+        timestamp = datetime.utcnow()
+
+    prefix = "User" if msg["role"] == "user" else "Assistant"
+    full_msg = f"{prefix}: {msg['content']}"
+
+    # Built from our own rows, whose types are known: validation here only costs CPU
+    return HistoryEntry.model_construct(
+        timestamp=timestamp,
+        message=full_msg,
+        command=msg.get("command"),
+        command_output=msg.get("command_output"),
+    )
 
 
 class ThreadService:
@@ -24,65 +51,147 @@ class ThreadService:
             "title": title or "New Chat",
         }
 
-        if not is_supabase_available():
-            print(f"[THREAD] Created thread (in-memory): {thread_id}")
-            return thread_id
-
         try:
-            supabase.table("threads").insert(data).execute()
+            get_storage().create_thread(data)
             return thread_id
         except Exception as e:
-            print(f"[ERROR] Failed to create thread: {e}")
+            logger.error("Failed to create thread", extra={"fields": {"error": str(e)}})
             return thread_id
 
     @staticmethod
     def get_thread(thread_id: str) -> Optional[Dict]:
-        if not is_supabase_available():
-            return {
-                "id": thread_id,
-                "title": "Thread",
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat(),
-            }
-
         try:
-            result = supabase.table("threads").select("*").eq("id", thread_id).execute()
-            if result.data:
-                return result.data[0]
-            return None
+            return get_storage().get_thread(thread_id)
         except Exception as e:
-            print(f"[ERROR] Failed to get thread: {e}")
+            logger.error("Failed to get thread", extra={"fields": {"error": str(e)}})
             return None
 
     @staticmethod
     def list_threads(user_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
-        if not is_supabase_available():
-            return []
-
         try:
-            query = supabase.table("threads").select("*").order("updated_at", desc=True).limit(limit)
-            if user_id:
-                query = query.eq("user_id", user_id)
-            result = query.execute()
-            return result.data or []
+            return get_storage().list_threads(user_id=user_id, limit=limit)
         except Exception as e:
-            print(f"[ERROR] Failed to list threads: {e}")
+            logger.error("Failed to list threads", extra={"fields": {"error": str(e)}})
             return []
 
     @staticmethod
     def delete_thread(thread_id: str) -> bool:
         """Delete a thread and its messages"""
-        if not is_supabase_available():
-            print(f"[THREAD] Deleted thread (in-memory): {thread_id}")
+        storage = get_storage()
+        message_cache.invalidate(thread_id)
+        try:
+            storage.delete_thread(thread_id)
+            logger.info("Deleted thread", extra={"fields": {"thread_id": thread_id}})
             return True
+        except Exception as e:
+            logger.error("Failed to delete thread", extra={"fields": {"error": str(e)}})
+            return False
+        finally:
+            # Again afterwards: a read during the delete may have re-filled the old history
+            message_cache.invalidate(thread_id)
 
+    @staticmethod
+    def check_ownership(thread_ids: List[str], user_id: Optional[str]) -> Dict[str, str]:
+        """
+        Status of each id for this user in one lookup: "ok", "not_found",
+        "forbidden", or "error" for every id when the lookup itself fails.
+        """
         try:
-            supabase.table("messages").delete().eq("thread_id", thread_id).execute()
-            supabase.table("threads").delete().eq("id", thread_id).execute()
-            print(f"[THREAD] Deleted thread: {thread_id}")
+            rows = get_storage().get_threads(thread_ids)
+        except Exception as e:
+            logger.error("Failed to look up threads", extra={"fields": {"error": str(e), "count": len(thread_ids)}})
+            return {tid: "error" for tid in thread_ids}
+
+        owners = {row["id"]: row.get("user_id") for row in rows}
+        return {
+            tid: "not_found" if tid not in owners else ("ok" if owners[tid] == user_id else "forbidden")
+            for tid in thread_ids
+        }
+
+    @staticmethod
+    def delete_threads(thread_ids: List[str]) -> bool:
+        """Delete several threads with batched statements"""
+        if not thread_ids:
+            return True
+        for thread_id in thread_ids:
+            message_cache.invalidate(thread_id)
+        try:
+            get_storage().delete_threads(thread_ids)
+            logger.info("Deleted threads", extra={"fields": {"count": len(thread_ids)}})
             return True
         except Exception as e:
-            print(f"[ERROR] Failed to delete thread: {e}")
+            logger.error("Failed to delete threads", extra={"fields": {"error": str(e), "count": len(thread_ids)}})
+            return False
+        finally:
+            # Again afterwards: a read during the delete may have re-filled the old history
+            for thread_id in thread_ids:
+                message_cache.invalidate(thread_id)
+
+    @staticmethod
+    def archive_threads(thread_ids: List[str]) -> bool:
+        if not thread_ids:
+            return True
+        try:
+            get_storage().archive_threads(thread_ids, datetime.now(timezone.utc).isoformat())
+            logger.info("Archived threads", extra={"fields": {"count": len(thread_ids)}})
+            return True
+        except Exception as e:
+            logger.error("Failed to archive threads", extra={"fields": {"error": str(e), "count": len(thread_ids)}})
+            return False
+
+    @staticmethod
+    def update_titles(titles: Dict[str, str], user_id: Optional[str]) -> bool:
+        """Set several thread titles; callers check ownership first, and deleted threads stay deleted"""
+        if not titles:
+            return True
+        rows = [{"id": tid, "user_id": user_id, "title": title} for tid, title in titles.items()]
+        try:
+            get_storage().update_titles(rows)
+            return True
+        except Exception as e:
+            logger.error("Failed to update thread titles", extra={"fields": {"error": str(e), "count": len(rows)}})
+            return False
+
+    @staticmethod
+    def iter_user_threads(user_id: str, page_size: int) -> Iterator[Dict]:
+        """Every thread of a user, archived included, read in keyset pages"""
+        storage = get_storage()
+        after = None
+        while True:
+            page = storage.get_threads_page(user_id, after, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["created_at"], page[-1]["id"])
+
+    @staticmethod
+    def iter_thread_messages(thread_id: str, page_size: int) -> Iterator[Dict]:
+        """Every message row of a thread, oldest first, read in keyset pages"""
+        storage = get_storage()
+        after = None
+        while True:
+            page = storage.get_messages_page(thread_id, after, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["created_at"], page[-1]["id"])
+
+    @staticmethod
+    def import_rows(threads: List[Dict], messages: List[Dict]) -> bool:
+        """
+        Insert imported thread and message rows in two batched statements.
+        No embeddings are written for imported messages.
+        """
+        storage = get_storage()
+        try:
+            storage.insert_threads(threads)
+            storage.insert_messages(messages)
+            return True
+        except Exception as e:
+            logger.error(
+                "Failed to import rows",
+                extra={"fields": {"error": str(e), "threads": len(threads), "messages": len(messages)}},
+            )
             return False
 
     @staticmethod
@@ -93,16 +202,10 @@ class ThreadService:
         command: Optional[str] = None,
         command_output: Optional[str] = None,
         user_id: Optional[str] = None,
+        created_at: Optional[str] = None,
     ) -> str:
         message_id = str(uuid4())
-
-        embed_text = message
-        if command:
-            embed_text += f" {command}"
-        if command_output:
-            embed_text += f" {command_output}"
-
-        embedding = generate_embedding(embed_text)
+        storage = get_storage()
 
         msg_data = {
             "id": message_id,
@@ -113,58 +216,155 @@ class ThreadService:
             "command": command,
             "command_output": command_output,
         }
+        if created_at:
+            # Callers that write behind (WebSocket sessions) keep the time the turn happened
+            msg_data["created_at"] = created_at
 
-        emb_data = {
-            "id": str(uuid4()),
-            "message_id": message_id,
-            "thread_id": thread_id,
-            "embedding": embedding,
-        }
-
-        if not is_supabase_available():
-            print(f"[MESSAGE] Added message (in-memory): {message_id} to thread {thread_id}")
-            return message_id
+        emb_data = None
+        if storage.stores_embeddings:
+            emb_data = {
+                "id": str(uuid4()),
+                "message_id": message_id,
+                "thread_id": thread_id,
+                "model": EMBEDDING_MODEL_VERSION,
+                **get_vector_codec().encode(generate_message_embedding(message, command, command_output)),
+            }
 
+        use_cache = _use_cache(storage)
+        if use_cache:
+            write = message_cache.begin_write(thread_id)
         try:
-            supabase.table("messages").insert(msg_data).execute()
-            supabase.table("message_embeddings").insert(emb_data).execute()
-            return message_id
+            row = storage.add_message(msg_data, emb_data)
         except Exception as e:
-            print(f"[ERROR] Failed to add message: {e}")
+            logger.error("Failed to add message", extra={"fields": {"error": str(e)}})
+            if use_cache:
+                message_cache.abandon_write(thread_id, write)
             return message_id
 
+        if use_cache:
+            message_cache.append(thread_id, write, _row_to_entry(row))
+        return message_id
+
     @staticmethod
     def get_messages(thread_id: str, limit: int = 100) -> List[HistoryEntry]:
-        if not is_supabase_available():
-            return []
+        storage = get_storage()
+        use_cache = _use_cache(storage)
+
+        if use_cache:
+            cached = message_cache.get(thread_id, limit)
+            if cached is not None:
+                return cached
+            token = message_cache.begin_fill(thread_id)
 
         try:
-            res = supabase.table("messages") \
-                .select("*") \
-                .eq("thread_id", thread_id) \
-                .order("created_at", desc=False) \
-                .limit(limit).execute()
+            rows = storage.get_messages(thread_id, limit=limit)
+        except Exception as e:
+            logger.error("Failed to get messages", extra={"fields": {"error": str(e)}})
+            if use_cache:
+                message_cache.abandon_fill(thread_id, token)
+            return []
+
+        entries = [_row_to_entry(msg) for msg in rows]
 
-            entries = []
-            for msg in res.data or []:
-                try:
-                    timestamp = datetime.fromisoformat(msg["created_at"].replace("Z", "+00:00"))
-                except Exception:
-                    timestamp = datetime.utcnow()
+        if use_cache:
+            message_cache.fill(thread_id, token, entries, complete=len(rows) < limit)
+        return entries
 
-                prefix = "User" if msg["role"] == "user" else "Assistant"
-                full_msg = f"{prefix}: {msg['content']}"
+    @staticmethod
+    def get_recent_messages(thread_id: str, limit: int = 10) -> List[HistoryEntry]:
+        """The newest `limit` messages, oldest-first (what prompts should see)."""
+        storage = get_storage()
+        use_cache = _use_cache(storage)
 
-                entries.append(
-                    HistoryEntry(
-                        timestamp=timestamp,
-                        message=full_msg,
-                        command=msg.get("command"),
-                        command_output=msg.get("command_output"),
-                    )
-                )
+        if use_cache:
+            cached = message_cache.get_tail(thread_id, limit)
+            if cached is not None:
+                return cached
+            token = message_cache.begin_fill(thread_id)
 
-            return entries
+        try:
+            rows = storage.get_recent_messages(thread_id, limit=limit)
         except Exception as e:
-            print(f"[ERROR] Failed to get messages: {e}")
+            logger.error("Failed to get recent messages", extra={"fields": {"error": str(e)}})
+            if use_cache:
+                message_cache.abandon_fill(thread_id, token)
             return []
+
+        entries = [_row_to_entry(msg) for msg in rows]
+
+        if use_cache:
+            # Only a short thread's tail is the whole thread, which is what the cache holds
+            if len(rows) < limit:
+                message_cache.fill(thread_id, token, entries, complete=True)
+            else:
+                message_cache.abandon_fill(thread_id, token)
+        return entries
+
+    @staticmethod
+    def get_summary(thread_id: str) -> Optional[Dict]:
+        try:
+            return get_storage().get_summary(thread_id)
+        except Exception as e:
+            logger.error("Failed to get thread summary", extra={"fields": {"error": str(e)}})
+            return None
+
+    @staticmethod
+    def save_summary(
+        thread_id: str,
+        summary: str,
+        covered_until: str,
+        covered_messages: int,
+    ) -> bool:
+        data = {
+            "thread_id": thread_id,
+            "summary": summary,
+            "covered_until": covered_until,
+            "covered_messages": covered_messages,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            get_storage().upsert_summary(data)
+            return True
+        except Exception as e:
+            logger.error("Failed to save thread summary", extra={"fields": {"error": str(e)}})
+            return False
+
+    # Idempotency records only go to backends that keep them (IdempotencyRecords);
+    # otherwise the idempotency store's own LRU is all there is
+    @staticmethod
+    def get_idempotency_record(user_id: str, key: str) -> Optional[Dict]:
+        storage = get_storage()
+        if not isinstance(storage, IdempotencyRecords):
+            return None
+        try:
+            return storage.get_idempotency_record(user_id, key)
+        except Exception as e:
+            logger.error("Failed to get idempotency record", extra={"fields": {"error": str(e)}})
+            return None
+
+    @staticmethod
+    def save_idempotency_record(row: Dict) -> bool:
+        storage = get_storage()
+        if not isinstance(storage, IdempotencyRecords):
+            return True
+        try:
+            storage.upsert_idempotency_record(row)
+            return True
+        except Exception as e:
+            logger.error("Failed to save idempotency record", extra={"fields": {"error": str(e)}})
+            return False
+
+    @staticmethod
+    def purge_idempotency_records(now: str) -> None:
+        storage = get_storage()
+        if not isinstance(storage, IdempotencyRecords):
+            return
+        try:
+            storage.delete_expired_idempotency_records(now)
+        except Exception as e:
+            logger.error("Failed to purge idempotency records", extra={"fields": {"error": str(e)}})
+
+    @staticmethod
+    def cache_stats() -> Dict:
+        """Hit ratio and size of the hot-thread message cache"""
+        return message_cache.stats()
@@ -0,0 +1,67 @@
+"""
+Operational introspection routes
+
+Only accounts listed in ADMIN_USERS may read them; everyone else gets a 403.
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from typing import Dict
+
+from app.agent.admission import upstream_admission
+from app.agent.routing import model_router
+from app.agent.scheduler import diagnose_scheduler
+from app.config.config import ADMIN_USERS
+from app.agent.singleflight import llm_flights
+from app.database.storage import get_storage
+from app.database.thread_service import ThreadService
+from app.services.embeddings import get_embedding_batcher, get_embedding_pool
+from app.services.idempotency import idempotent_requests
+from app.routes.auth import get_current_user
+
+router = APIRouter()
+
+
+def get_operator(current_user: Dict = Depends(get_current_user)) -> Dict:
+    """The signed-in user, if ADMIN_USERS lists their email or id."""
+    if current_user.get("email") in ADMIN_USERS or current_user.get("id") in ADMIN_USERS:
+        return current_user
+    raise HTTPException(403, "Operator access required")
+
+
+@router.get("/cache")
+def cache_stats(current_user: Dict = Depends(get_operator)) -> Dict:
+    """Hot-thread message cache hit ratio and size, stored idempotent responses, plus local storage usage"""
+    storage = get_storage()
+    stats = {
+        "storage_backend": type(storage).__name__,
+        "message_cache": ThreadService.cache_stats(),
+        "idempotency": idempotent_requests.snapshot(),
+    }
+    if hasattr(storage, "stats"):
+        stats["storage"] = storage.stats()
+    return stats
+
+
+@router.get("/routing")
+def routing_table(current_user: Dict = Depends(get_operator)) -> Dict:
+    """Current LLM attempt order and per-model health / circuit state"""
+    return model_router.snapshot()
+
+
+@router.get("/scheduler")
+def scheduler_stats(current_user: Dict = Depends(get_operator)) -> Dict:
+    """Fair-scheduler queues per priority class, upstream admission and coalescing state"""
+    return {
+        "scheduler": diagnose_scheduler.snapshot(),
+        "admission": upstream_admission.snapshot(),
+        "coalescing": llm_flights.snapshot(),
+    }
+
+
+@router.get("/embeddings")
+def embedding_stats(current_user: Dict = Depends(get_operator)) -> Dict:
+    """Embedding micro-batcher queue, batch sizes and queueing delays, plus worker processes"""
+    pool = get_embedding_pool()
+    return {
+        "batcher": get_embedding_batcher().snapshot(),
+        "workers": pool.snapshot() if pool is not None else None,
+    }
@@ -1,5 +1,6 @@
+import time
 from datetime import datetime, timedelta
-from typing import Annotated, Dict
+from typing import Annotated, Dict, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -7,6 +8,7 @@ from jose import JWTError, jwt
 from ..database.supabase_auth import get_user_by_email, verify_user_credentials
 from ..models import Token, TokenData, UserResponse, LoginRequest, LoginResponse
 from ..config.config import JWT_SECRET
+from ..services.metrics import AUTH_SECONDS
 
 router = APIRouter()
 
@@ -26,6 +28,23 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+def user_from_token(token: Optional[str]) -> Optional[Dict]:
+    """Decode a bearer token and load its user; None if either step fails."""
+    if not SECRET_KEY or not token:
+        return None
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        email: str = payload.get("email")
+        if email is None:
+            return None
+        token_data = TokenData(email=email)
+    except JWTError:
+        return None
+
+    return get_user_by_email(token_data.email)
+
+
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
 ) -> Dict:
@@ -35,23 +54,15 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    if not SECRET_KEY:
-        raise credentials_exception
-
+    start = time.perf_counter()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("email")
-        if email is None:
+        user = user_from_token(token)
+        if user is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
-        raise credentials_exception
-
-    user = get_user_by_email(token_data.email)
-    if user is None:
-        raise credentials_exception
 
-    return user
+        return user
+    finally:
+        AUTH_SECONDS.observe(time.perf_counter() - start)
 
 
 @router.post("/login", response_model=LoginResponse)
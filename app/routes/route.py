@@ -1,13 +1,43 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
 from fastapi import status
-from typing import Optional, Dict, List
+from typing import Any, Callable, Optional, Dict, List, Tuple
+from pydantic import BaseModel
 from datetime import datetime
+import time
 
 from app.agent.prompts import sys_info_prompt
-from app.agent.schema import DiagnoseRequest, DiagnoseContinueRequest, DiagnoseResponse, DiagnosisOutput
+from app.agent.schema import (
+    CommandResult,
+    DiagnoseContinueBatchRequest,
+    DiagnoseContinueRequest,
+    DiagnoseRequest,
+    DiagnoseResponse,
+    DiagnosisOutput,
+    HistoryEntry,
+)
+from app.agent.admission import estimate_tokens
 from app.agent.agents import custom_agent
+from app.agent.scheduler import SchedulerBusyError, diagnose_scheduler, priority_for
+from app.agent.summarizer import thread_summarizer
+from app.config.config import DIAGNOSE_MAX_COMMANDS, FAST_JSON_ENABLED
 from app.database.thread_service import ThreadService
 from app.routes.auth import get_current_user
+from app.services.compaction import compact
+from app.services.idempotency import (
+    MAX_KEY_LENGTH,
+    IdempotencyError,
+    NonCacheable,
+    idempotent_requests,
+    request_fingerprint,
+)
+from app.services.serialization import FastJSONResponse, diagnose_payload
+from app.services.metrics import (
+    DIAGNOSE_IN_FLIGHT,
+    PROMPT_HISTORY_TOKENS,
+    server_timing_header,
+    stage_timer,
+    start_request_timings,
+)
 
 
 router = APIRouter()
@@ -24,46 +54,183 @@ def health() -> dict:
 # -----------------------------
 # HISTORY HELPERS
 # -----------------------------
-def _render_history_section(thread_id: Optional[str] = None) -> str:
-    """Format the last 5 messages of the thread for use in prompts."""
-    history = ThreadService.get_messages(thread_id, limit=10) if thread_id else []
+def _render_history_section(thread_id: Optional[str] = None, user_id: Optional[str] = None) -> str:
+    """Format the thread for use in prompts: rolling summary plus the newest messages."""
+    if not thread_id:
+        return "No previous steps."
+    summary, recent = thread_summarizer.context(thread_id, user_id)
+    return _format_history(recent, summary)
+
 
-    if not history:
+def _format_history(history: List[HistoryEntry], summary: Optional[str] = None) -> str:
+    if not history and not summary:
         return "No previous steps."
 
     lines = []
-    for entry in history[-5:]:
-        line = f"[{entry.timestamp.isoformat()}] message: {entry.message}"
+    if summary:
+        lines.append(f"Summary of earlier steps: {summary}")
+
+    # No timestamps: they made every rendered prompt unique, which defeats
+    # coalescing of identical requests (app/agent/singleflight.py)
+    for entry in history:
+        line = f"message: {entry.message}"
         if entry.command:
             line += f" | command: {entry.command}"
         if entry.command_output:
             line += f" | output: {entry.command_output}"
         lines.append(line)
 
-    return "\n".join(lines)
+    section = "\n".join(lines)
+    PROMPT_HISTORY_TOKENS.observe(estimate_tokens(section))
+    return section
 
 
 def _previous_commands(thread_id: Optional[str] = None) -> List[str]:
     """Get previous commands sent by the AI."""
-    history = ThreadService.get_messages(thread_id, limit=20) if thread_id else []
+    history = ThreadService.get_recent_messages(thread_id, limit=20) if thread_id else []
     cmds = [msg.command for msg in history if msg.command]
     return cmds[-10:]
 
 
 def _last_command(thread_id: Optional[str] = None) -> Optional[str]:
     """Get the last command that was stored in the thread."""
-    history = ThreadService.get_messages(thread_id, limit=20) if thread_id else []
+    history = ThreadService.get_recent_messages(thread_id, limit=20) if thread_id else []
     for entry in reversed(history):
         if entry.command:
             return entry.command
     return None
 
 
+def _turn_commands(ai_output: DiagnosisOutput) -> List[str]:
+    """`command` plus any independent `commands`, deduplicated and capped."""
+    commands: List[str] = []
+    for cmd in [ai_output.command, *ai_output.commands]:
+        cmd = (cmd or "").strip()
+        if cmd and cmd not in commands:
+            commands.append(cmd)
+    return commands[:DIAGNOSE_MAX_COMMANDS]
+
+
+def _assistant_rows(message: str, commands: List[str]) -> List[Tuple[str, str]]:
+    """
+    (message, command) per assistant row to store for one turn: the reply
+    with the primary command, then one row per extra command, so every
+    stored `command` is a single runnable command.
+    """
+    rows = [(message, commands[0] if commands else "")]
+    rows += [(f"Also running: {cmd}", cmd) for cmd in commands[1:]]
+    return rows
+
+
+def _compact_results(results: List[CommandResult]) -> List[CommandResult]:
+    """Compacted copies of the results; stored, embedded and prompted from here on."""
+    return [
+        CommandResult(command=result.command, command_output=compact(result.command_output))
+        for result in results
+    ]
+
+
+def _command_output_prompt(results: List[CommandResult]) -> Tuple[str, str]:
+    """(command_output_section, user_query) for one turn's command results."""
+    if len(results) == 1:
+        return results[0].command_output or "No output", f"Command output:\n{results[0].command_output}"
+    section = "\n\n".join(
+        f"$ {result.command}\n{result.command_output or 'No output'}" for result in results
+    )
+    return section, f"Command outputs:\n{section}"
+
+
+def _diagnose_response(
+    response: Response,
+    thread_id: str,
+    ai_output: DiagnosisOutput,
+    commands: List[str],
+    history: List[HistoryEntry],
+):
+    """The turn's reply: pre-encoded on the fast path, else a model FastAPI validates and encodes."""
+    next_step = "command" if commands else ai_output.next_step
+    if FAST_JSON_ENABLED:
+        # A returned Response skips the injected one, so carry its headers over
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        payload = diagnose_payload(ai_output.message, next_step, thread_id, history, commands)
+        return FastJSONResponse(payload, headers=headers)
+    return DiagnoseResponse(
+        message=ai_output.message,
+        command=commands[0] if commands else None,
+        next_step=next_step,
+        commands=commands or None,
+        session_id=thread_id,
+        thread_id=thread_id,
+        history=history,
+    )
+
+
+def _idempotent(
+    route: str,
+    current_user: Dict,
+    key: Optional[str],
+    payload: BaseModel,
+    run: Callable[[Optional[Dict]], Any],
+):
+    """
+    Run one diagnose turn at most once per Idempotency-Key; repeats get the stored reply.
+    `run(resume)` gets what a transient earlier attempt of this key already stored.
+    """
+    if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise HTTPException(400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    fingerprint = request_fingerprint(route, payload) if key else ""
+    try:
+        return idempotent_requests.run(current_user.get("id"), key, fingerprint, run)
+    except IdempotencyError as e:
+        raise HTTPException(422 if e.reason == "conflict" else 409, str(e))
+
+
+def _error_output(message: str) -> DiagnosisOutput:
+    """
+    A "please try again" reply; transient, so it is not stored in the thread and
+    an Idempotency-Key retry runs the turn again (without re-storing the user rows).
+    """
+    output = DiagnosisOutput(message=message, command="", next_step="message")
+    output._transient = True
+    return output
+
+
+def _busy_output(error: SchedulerBusyError) -> DiagnosisOutput:
+    """Reply used when the scheduler could not give this user a slot."""
+    if error.reason == "queue_full":
+        return _error_output("You already have several diagnoses in progress. Please wait for them to finish and try again.")
+    return _error_output("The assistant is handling a lot of requests right now. Please try again in a moment.")
+
+
 # ============================================================
 # ROUTE 1 — FIRST DIAGNOSE (NO EXECUTION)
 # ============================================================
 @router.post("/diagnose", response_model=DiagnoseResponse, status_code=status.HTTP_200_OK)
-def diagnose(payload: DiagnoseRequest, current_user: Dict = Depends(get_current_user)) -> DiagnoseResponse:
+@DIAGNOSE_IN_FLIGHT.labels(route="diagnose").track_inprogress()
+def diagnose(
+    payload: DiagnoseRequest,
+    response: Response,
+    current_user: Dict = Depends(get_current_user),
+    x_glitch_priority: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    return _idempotent(
+        "diagnose", current_user, idempotency_key, payload,
+        lambda resume: _first_diagnosis(payload, response, current_user, x_glitch_priority, resume),
+    )
+
+
+def _first_diagnosis(
+    payload: DiagnoseRequest,
+    response: Response,
+    current_user: Dict,
+    x_glitch_priority: Optional[str],
+    resume: Optional[Dict] = None,
+):
+    """Open (or reuse) the thread, store the problem and ask the AI for the first step."""
+    route = "diagnose"
+    started = time.perf_counter()
+    timings = start_request_timings()
 
     user_id = current_user.get("id")
     thread_id = payload.thread_id
@@ -71,99 +238,159 @@ def diagnose(payload: DiagnoseRequest, current_user: Dict = Depends(get_current_
     # -------------------------
     # THREAD RESOLUTION
     # -------------------------
-    if thread_id:
-        thread = ThreadService.get_thread(thread_id)
+    if resume is not None:
+        # a transient earlier attempt of this Idempotency-Key already opened
+        # the thread and stored the problem
+        thread_id = resume["thread_id"]
+    elif thread_id:
+        with stage_timer(route, "get_thread"):
+            thread = ThreadService.get_thread(thread_id)
         if not thread:
-            thread_id = ThreadService.create_thread(
-                user_id=user_id,
-                title=payload.problem[:50]
-            )
+            with stage_timer(route, "create_thread"):
+                thread_id = ThreadService.create_thread(
+                    user_id=user_id,
+                    title=payload.problem[:50]
+                )
         else:
             if thread.get("user_id") != user_id:
                 raise HTTPException(403, "Not authorized to access this thread")
     else:
-        thread_id = ThreadService.create_thread(
-            user_id=user_id,
-            title=payload.problem[:50]
-        )
+        with stage_timer(route, "create_thread"):
+            thread_id = ThreadService.create_thread(
+                user_id=user_id,
+                title=payload.problem[:50]
+            )
 
     # -------------------------
     # STORE USER MESSAGE
     # -------------------------
-    ThreadService.add_message(
-        thread_id=thread_id,
-        role="user",
-        message=payload.problem,
-        user_id=user_id,
-    )
+    if resume is None:
+        with stage_timer(route, "store_user_message"):
+            ThreadService.add_message(
+                thread_id=thread_id,
+                role="user",
+                message=payload.problem,
+                user_id=user_id,
+            )
 
     # -------------------------
     # PREPARE SYSTEM PROMPT
     # -------------------------
-    history_section = _render_history_section(thread_id)
-    command_output_section = "No command executed yet."
-
-    system_prompt = sys_info_prompt.format(
-        problem=payload.problem,
-        history_section=history_section,
-        command_output_section=command_output_section,
-    )
+    with stage_timer(route, "build_prompt"):
+        history_section = _render_history_section(thread_id, user_id)
+        command_output_section = "No command executed yet."
+
+        system_prompt = sys_info_prompt.format(
+            problem=payload.problem,
+            history_section=history_section,
+            command_output_section=command_output_section,
+        )
 
-    prev_cmds = _previous_commands(thread_id)
+        prev_cmds = _previous_commands(thread_id)
 
     # -------------------------
     # CALL AI
     # -------------------------
+    priority = priority_for(current_user, x_glitch_priority)
     try:
-        ai_output: DiagnosisOutput = custom_agent(
-            system_prompt=system_prompt,
-            user_query=payload.problem,
-            response_model=DiagnosisOutput,
-        )
+        with diagnose_scheduler.slot(user_id, priority), stage_timer(route, "llm", timing="llm"):
+            ai_output: DiagnosisOutput = custom_agent(
+                system_prompt=system_prompt,
+                user_query=payload.problem,
+                response_model=DiagnosisOutput,
+            )
+    except SchedulerBusyError as e:
+        ai_output = _busy_output(e)
     except Exception as e:
-        ai_output = DiagnosisOutput(
-            message=f"Internal error while processing your request: {str(e)}",
-            command="",
-            next_step="message",
-        )
+        ai_output = _error_output(f"Internal error while processing your request: {str(e)}")
+    commands = _turn_commands(ai_output)
 
     # -------------------------
     # STORE AI RESPONSE (NO EXECUTION)
     # -------------------------
-    ThreadService.add_message(
-        thread_id=thread_id,
-        role="assistant",
-        message=ai_output.message,
-        command=ai_output.command,
-        command_output=None,
-        user_id=user_id,
-    )
+    if not ai_output._transient:
+        with stage_timer(route, "store_assistant_message"):
+            for message, command in _assistant_rows(ai_output.message, commands):
+                ThreadService.add_message(
+                    thread_id=thread_id,
+                    role="assistant",
+                    message=message,
+                    command=command,
+                    command_output=None,
+                    user_id=user_id,
+                )
 
-    history = ThreadService.get_messages(thread_id)
+    with stage_timer(route, "load_history"):
+        history = ThreadService.get_recent_messages(thread_id, limit=100)
 
-    return DiagnoseResponse(
-        message=ai_output.message,
-        command=ai_output.command or None,
-        next_step=ai_output.next_step,
-        session_id=thread_id,
-        thread_id=thread_id,
-        history=history,
-    )
+    response.headers["Server-Timing"] = server_timing_header(timings, total=time.perf_counter() - started)
+
+    result = _diagnose_response(response, thread_id, ai_output, commands, history)
+    return NonCacheable(result, resume={"thread_id": thread_id}) if ai_output._transient else result
 
 
 # ============================================================
 # ROUTE 2 — CONTINUE AFTER COMMAND EXECUTION
 # ============================================================
 @router.post("/diagnose/continue", response_model=DiagnoseResponse)
-def diagnose_continue(payload: DiagnoseContinueRequest, current_user: Dict = Depends(get_current_user)):
+@DIAGNOSE_IN_FLIGHT.labels(route="diagnose_continue").track_inprogress()
+def diagnose_continue(
+    payload: DiagnoseContinueRequest,
+    response: Response,
+    current_user: Dict = Depends(get_current_user),
+    x_glitch_priority: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    results = [CommandResult(command=payload.command, command_output=payload.command_output)]
+    return _idempotent(
+        "diagnose_continue", current_user, idempotency_key, payload,
+        lambda resume: _continue_diagnosis(
+            "diagnose_continue", payload.thread_id, results, response, current_user, x_glitch_priority, resume
+        ),
+    )
+
+
+# ============================================================
+# ROUTE 3 — CONTINUE AFTER SEVERAL COMMANDS RAN IN PARALLEL
+# ============================================================
+@router.post("/diagnose/continue/batch", response_model=DiagnoseResponse)
+@DIAGNOSE_IN_FLIGHT.labels(route="diagnose_continue_batch").track_inprogress()
+def diagnose_continue_batch(
+    payload: DiagnoseContinueBatchRequest,
+    response: Response,
+    current_user: Dict = Depends(get_current_user),
+    x_glitch_priority: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    return _idempotent(
+        "diagnose_continue_batch", current_user, idempotency_key, payload,
+        lambda resume: _continue_diagnosis(
+            "diagnose_continue_batch", payload.thread_id, payload.results, response, current_user,
+            x_glitch_priority, resume,
+        ),
+    )
+
+
+def _continue_diagnosis(
+    route: str,
+    thread_id: Optional[str],
+    results: List[CommandResult],
+    response: Response,
+    current_user: Dict,
+    x_glitch_priority: Optional[str],
+    resume: Optional[Dict] = None,
+):
+    """Store the outputs of one turn's commands and ask the AI for the next step."""
+    started = time.perf_counter()
+    timings = start_request_timings()
 
     user_id = current_user.get("id")
-    thread_id = payload.thread_id
 
     if not thread_id:
         raise HTTPException(400, "Missing thread_id for continuation")
 
-    thread = ThreadService.get_thread(thread_id)
+    with stage_timer(route, "get_thread"):
+        thread = ThreadService.get_thread(thread_id)
     if not thread:
         raise HTTPException(404, "Thread not found")
 
@@ -171,64 +398,73 @@ def diagnose_continue(payload: DiagnoseContinueRequest, current_user: Dict = Dep
         raise HTTPException(403, "Not authorized for this thread")
 
     # -------------------------
-    # STORE USER'S COMMAND OUTPUT
+    # STORE USER'S COMMAND OUTPUT(S)
     # -------------------------
-    ThreadService.add_message(
-        thread_id=thread_id,
-        role="user",
-        message=f"Command output for: {payload.command}",
-        command=payload.command,
-        command_output=payload.command_output,
-        user_id=user_id,
-    )
+    with stage_timer(route, "compact_output"):
+        results = _compact_results(results)
+
+    # a transient earlier attempt of this Idempotency-Key already stored them
+    if resume is None:
+        with stage_timer(route, "store_user_message"):
+            for result in results:
+                ThreadService.add_message(
+                    thread_id=thread_id,
+                    role="user",
+                    message=f"Command output for: {result.command}",
+                    command=result.command,
+                    command_output=result.command_output,
+                    user_id=user_id,
+                )
 
     # -------------------------
     # PREPARE RE-PROMPT FOR GEMINI
     # -------------------------
-    history_section = _render_history_section(thread_id)
-    command_output_section = payload.command_output or "No output"
-
-    system_prompt = sys_info_prompt.format(
-        problem="Continuing troubleshooting...",
-        history_section=history_section,
-        command_output_section=command_output_section,
-    )
+    with stage_timer(route, "build_prompt"):
+        history_section = _render_history_section(thread_id, user_id)
+        command_output_section, user_query = _command_output_prompt(results)
+
+        system_prompt = sys_info_prompt.format(
+            problem="Continuing troubleshooting...",
+            history_section=history_section,
+            command_output_section=command_output_section,
+        )
 
     # -------------------------
     # CALL AI AGAIN
     # -------------------------
+    priority = priority_for(current_user, x_glitch_priority)
     try:
-        ai_output: DiagnosisOutput = custom_agent(
-            system_prompt=system_prompt,
-            user_query=f"Command output:\n{payload.command_output}",
-            response_model=DiagnosisOutput,
-        )
+        with diagnose_scheduler.slot(user_id, priority), stage_timer(route, "llm", timing="llm"):
+            ai_output: DiagnosisOutput = custom_agent(
+                system_prompt=system_prompt,
+                user_query=user_query,
+                response_model=DiagnosisOutput,
+            )
+    except SchedulerBusyError as e:
+        ai_output = _busy_output(e)
     except Exception as e:
-        ai_output = DiagnosisOutput(
-            message=f"Error interpreting command output: {str(e)}",
-            command="",
-            next_step="message",
-        )
+        ai_output = _error_output(f"Error interpreting command output: {str(e)}")
+    commands = _turn_commands(ai_output)
 
     # -------------------------
     # STORE AI RESPONSE
     # -------------------------
-    ThreadService.add_message(
-        thread_id=thread_id,
-        role="assistant",
-        message=ai_output.message,
-        command=ai_output.command,
-        command_output=None,
-        user_id=user_id,
-    )
-
-    history = ThreadService.get_messages(thread_id)
-
-    return DiagnoseResponse(
-        message=ai_output.message,
-        command=ai_output.command or None,
-        next_step=ai_output.next_step,
-        session_id=thread_id,
-        thread_id=thread_id,
-        history=history,
-    )
+    if not ai_output._transient:
+        with stage_timer(route, "store_assistant_message"):
+            for message, command in _assistant_rows(ai_output.message, commands):
+                ThreadService.add_message(
+                    thread_id=thread_id,
+                    role="assistant",
+                    message=message,
+                    command=command,
+                    command_output=None,
+                    user_id=user_id,
+                )
+
+    with stage_timer(route, "load_history"):
+        history = ThreadService.get_recent_messages(thread_id, limit=100)
+
+    response.headers["Server-Timing"] = server_timing_header(timings, total=time.perf_counter() - started)
+
+    result = _diagnose_response(response, thread_id, ai_output, commands, history)
+    return NonCacheable(result, resume={"thread_id": thread_id}) if ai_output._transient else result
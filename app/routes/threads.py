@@ -1,148 +1,458 @@
-"""
-Thread management routes
-"""
-from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List, Optional, Dict
-from pydantic import BaseModel
-from datetime import datetime
-
-from app.database.thread_service import ThreadService
-from app.agent.schema import HistoryEntry
-from app.routes.auth import get_current_user
-
-router = APIRouter()
-
-
-class ThreadCreate(BaseModel):
-    title: Optional[str] = None
-
-
-class ThreadResponse(BaseModel):
-    id: str
-    user_id: Optional[str] = None
-    title: str
-    created_at: str
-    updated_at: str
-
-
-class ThreadListResponse(BaseModel):
-    threads: List[ThreadResponse]
-
-
-class MessageResponse(BaseModel):
-    id: str
-    thread_id: str
-    role: str
-    content: str
-    command: Optional[str] = None
-    command_output: Optional[str] = None
-    created_at: str
-
-
-@router.post("/threads", response_model=ThreadResponse, status_code=status.HTTP_201_CREATED)
-def create_thread(thread_data: ThreadCreate, current_user: Dict = Depends(get_current_user)) -> ThreadResponse:
-    """Create a new thread for the authenticated user"""
-    try:
-        user_id = current_user.get("id")
-        thread_id = ThreadService.create_thread(
-            user_id=user_id,
-            title=thread_data.title,
-        )
-        
-        thread = ThreadService.get_thread(thread_id)
-        if not thread:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to create thread"
-            )
-        
-        return ThreadResponse(
-            id=thread["id"],
-            user_id=thread.get("user_id"),
-            title=thread.get("title", "New Chat"),
-            created_at=thread["created_at"],
-            updated_at=thread["updated_at"],
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to create thread: {str(e)}"
-        )
-
-
-@router.get("/threads", response_model=ThreadListResponse)
-def list_threads(current_user: Dict = Depends(get_current_user), limit: int = 50) -> ThreadListResponse:
-    """List threads for the authenticated user"""
-    try:
-        user_id = current_user.get("id")
-        threads = ThreadService.list_threads(user_id=user_id, limit=limit)
-        return ThreadListResponse(
-            threads=[
-                ThreadResponse(
-                    id=t["id"],
-                    user_id=t.get("user_id"),
-                    title=t.get("title", "New Chat"),
-                    created_at=t["created_at"],
-                    updated_at=t["updated_at"],
-                )
-                for t in threads
-            ]
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to list threads: {str(e)}"
-        )
-
-
-@router.get("/threads/{thread_id}", response_model=ThreadResponse)
-def get_thread(thread_id: str, current_user: Dict = Depends(get_current_user)) -> ThreadResponse:
-    """Get a specific thread owned by the authenticated user"""
-    thread = ThreadService.get_thread(thread_id)
-    if not thread:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Thread not found"
-        )
-    # Enforce ownership
-    if thread.get("user_id") != current_user.get("id"):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this thread")
-
-    return ThreadResponse(
-        id=thread["id"],
-        user_id=thread.get("user_id"),
-        title=thread.get("title", "New Chat"),
-        created_at=thread["created_at"],
-        updated_at=thread["updated_at"],
-    )
-
-
-@router.delete("/threads/{thread_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_thread(thread_id: str, current_user: Dict = Depends(get_current_user)):
-    """Delete a thread and all its messages if owned by the authenticated user"""
-    thread = ThreadService.get_thread(thread_id)
-    if not thread:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thread not found")
-    if thread.get("user_id") != current_user.get("id"):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this thread")
-
-    success = ThreadService.delete_thread(thread_id)
-    if not success:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to delete thread"
-        )
-
-
-@router.get("/threads/{thread_id}/messages", response_model=List[HistoryEntry])
-def get_thread_messages(thread_id: str, current_user: Dict = Depends(get_current_user), limit: int = 100) -> List[HistoryEntry]:
-    """Get all messages for a thread (only if owned by authenticated user)"""
-    thread = ThreadService.get_thread(thread_id)
-    if not thread:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thread not found")
-    if thread.get("user_id") != current_user.get("id"):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view messages for this thread")
-
-    messages = ThreadService.get_messages(thread_id, limit=limit)
-    return messages
-
+"""
+Thread management routes
+"""
+from fastapi import APIRouter, HTTPException, Request, status, Depends
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Iterator, List, Literal, Optional, Dict
+from pydantic import BaseModel, Field, ValidationError
+from datetime import datetime
+from uuid import uuid4
+import asyncio
+import json
+import zlib
+
+from app.agent.summarizer import thread_summarizer
+from app.config.config import (
+    EXPORT_PAGE_SIZE,
+    FAST_JSON_ENABLED,
+    IMPORT_BATCH_SIZE,
+    IMPORT_MAX_LINE_BYTES,
+    THREADS_BULK_MAX_IDS,
+)
+from app.database.thread_service import ThreadService
+from app.agent.schema import HistoryEntry
+from app.routes.auth import get_current_user
+from app.services.serialization import FastJSONResponse, history_items
+from app.utils.log import get_logger
+
+router = APIRouter()
+logger = get_logger("threads")
+
+
+class ThreadCreate(BaseModel):
+    title: Optional[str] = None
+
+
+class ThreadResponse(BaseModel):
+    id: str
+    user_id: Optional[str] = None
+    title: str
+    created_at: str
+    updated_at: str
+
+
+class ThreadListResponse(BaseModel):
+    threads: List[ThreadResponse]
+
+
+class MessageResponse(BaseModel):
+    id: str
+    thread_id: str
+    role: str
+    content: str
+    command: Optional[str] = None
+    command_output: Optional[str] = None
+    created_at: str
+
+
+class BulkThreadIds(BaseModel):
+    thread_ids: List[str] = Field(..., min_length=1, max_length=THREADS_BULK_MAX_IDS)
+
+
+class ThreadTitleUpdate(BaseModel):
+    id: str
+    title: str = Field(..., min_length=1)
+
+
+class BulkTitleUpdate(BaseModel):
+    updates: List[ThreadTitleUpdate] = Field(..., min_length=1, max_length=THREADS_BULK_MAX_IDS)
+
+
+class BulkThreadResult(BaseModel):
+    id: str
+    # deleted | archived | updated | not_found | forbidden | error
+    status: str
+
+
+class BulkThreadResponse(BaseModel):
+    results: List[BulkThreadResult]
+
+
+def _bulk_results(statuses: Dict[str, str], done: str, succeeded: bool) -> BulkThreadResponse:
+    """Owned ids get `done` (or "error" if the batch failed); the rest keep their lookup status."""
+    return BulkThreadResponse(results=[
+        BulkThreadResult(id=tid, status=(done if succeeded else "error") if state == "ok" else state)
+        for tid, state in statuses.items()
+    ])
+
+
+@router.post("/threads", response_model=ThreadResponse, status_code=status.HTTP_201_CREATED)
+def create_thread(thread_data: ThreadCreate, current_user: Dict = Depends(get_current_user)) -> ThreadResponse:
+    """Create a new thread for the authenticated user"""
+    try:
+        user_id = current_user.get("id")
+        thread_id = ThreadService.create_thread(
+            user_id=user_id,
+            title=thread_data.title,
+        )
+        
+        thread = ThreadService.get_thread(thread_id)
+        if not thread:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to create thread"
+            )
+        
+        return ThreadResponse(
+            id=thread["id"],
+            user_id=thread.get("user_id"),
+            title=thread.get("title", "New Chat"),
+            created_at=thread["created_at"],
+            updated_at=thread["updated_at"],
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create thread: {str(e)}"
+        )
+
+
+@router.get("/threads", response_model=ThreadListResponse)
+def list_threads(current_user: Dict = Depends(get_current_user), limit: int = 50) -> ThreadListResponse:
+    """List threads for the authenticated user"""
+    try:
+        user_id = current_user.get("id")
+        threads = ThreadService.list_threads(user_id=user_id, limit=limit)
+        return ThreadListResponse(
+            threads=[
+                ThreadResponse(
+                    id=t["id"],
+                    user_id=t.get("user_id"),
+                    title=t.get("title", "New Chat"),
+                    created_at=t["created_at"],
+                    updated_at=t["updated_at"],
+                )
+                for t in threads
+            ]
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to list threads: {str(e)}"
+        )
+
+
+# -----------------------------
+# BULK OPERATIONS
+# -----------------------------
+@router.post("/threads/bulk/delete", response_model=BulkThreadResponse)
+def bulk_delete_threads(payload: BulkThreadIds, current_user: Dict = Depends(get_current_user)) -> BulkThreadResponse:
+    """Delete several threads owned by the authenticated user; reports a status per id"""
+    statuses = ThreadService.check_ownership(list(dict.fromkeys(payload.thread_ids)), current_user.get("id"))
+    owned = [tid for tid, state in statuses.items() if state == "ok"]
+    deleted = ThreadService.delete_threads(owned)
+    for thread_id in owned:
+        thread_summarizer.forget(thread_id)
+    return _bulk_results(statuses, "deleted", deleted)
+
+
+@router.post("/threads/bulk/archive", response_model=BulkThreadResponse)
+def bulk_archive_threads(payload: BulkThreadIds, current_user: Dict = Depends(get_current_user)) -> BulkThreadResponse:
+    """Hide several threads from the thread list without deleting their messages"""
+    statuses = ThreadService.check_ownership(list(dict.fromkeys(payload.thread_ids)), current_user.get("id"))
+    owned = [tid for tid, state in statuses.items() if state == "ok"]
+    return _bulk_results(statuses, "archived", ThreadService.archive_threads(owned))
+
+
+@router.patch("/threads/bulk/titles", response_model=BulkThreadResponse)
+def bulk_update_titles(payload: BulkTitleUpdate, current_user: Dict = Depends(get_current_user)) -> BulkThreadResponse:
+    """Rename several threads at once; the last title given for an id wins"""
+    user_id = current_user.get("id")
+    titles = {update.id: update.title for update in payload.updates}
+    statuses = ThreadService.check_ownership(list(titles), user_id)
+    owned = {tid: title for tid, title in titles.items() if statuses[tid] == "ok"}
+    return _bulk_results(statuses, "updated", ThreadService.update_titles(owned, user_id))
+
+
+# -----------------------------
+# NDJSON EXPORT / IMPORT
+# -----------------------------
+# One JSON object per line: a {"type": "thread"} line, then that thread's
+# {"type": "message"} lines oldest first. Both directions stream, so memory
+# stays flat however many messages a user has.
+_EXPORT_THREAD_FIELDS = ("id", "title", "created_at", "updated_at", "archived_at")
+_EXPORT_MESSAGE_FIELDS = ("id", "thread_id", "role", "content", "command", "command_output", "created_at")
+# NDJSON gathered before a chunk is (compressed and) written
+_EXPORT_CHUNK_BYTES = 64 * 1024
+_IMPORT_MAX_ERRORS = 20
+# Most decompressed bytes produced per inflate step, so a gzip bomb is never expanded at once
+_IMPORT_INFLATE_BYTES = 64 * 1024
+
+
+class ImportThread(BaseModel):
+    type: Literal["thread"]
+    id: str
+    title: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    archived_at: Optional[str] = None
+
+
+class ImportMessage(BaseModel):
+    type: Literal["message"]
+    thread_id: str
+    role: Literal["user", "assistant"]
+    content: str
+    command: Optional[str] = None
+    command_output: Optional[str] = None
+    created_at: Optional[str] = None
+
+
+class ImportResponse(BaseModel):
+    threads: int
+    messages: int
+    skipped: int
+    failed: int
+    errors: List[str]
+
+
+def _ndjson(kind: str, row: Dict, fields) -> bytes:
+    record = {"type": kind, **{field: row.get(field) for field in fields}}
+    return json.dumps(record, separators=(",", ":"), default=str).encode() + b"\n"
+
+
+def _export_lines(user_id: str) -> Iterator[bytes]:
+    for thread in ThreadService.iter_user_threads(user_id, EXPORT_PAGE_SIZE):
+        yield _ndjson("thread", thread, _EXPORT_THREAD_FIELDS)
+        for message in ThreadService.iter_thread_messages(thread["id"], EXPORT_PAGE_SIZE):
+            yield _ndjson("message", message, _EXPORT_MESSAGE_FIELDS)
+
+
+def _export_chunks(user_id: str, compress: bool) -> Iterator[bytes]:
+    """Export as ~64 KiB chunks, gzip-framed when `compress` is set."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer: List[bytes] = []
+    size = 0
+    try:
+        for line in _export_lines(user_id):
+            buffer.append(line)
+            size += len(line)
+            if size >= _EXPORT_CHUNK_BYTES:
+                data = b"".join(buffer)
+                buffer, size = [], 0
+                data = compressor.compress(data) if compressor else data
+                if data:
+                    yield data
+    except Exception as e:
+        # Headers are already sent; dropping the connection tells the client the export is incomplete
+        logger.error("Export failed", extra={"fields": {"user_id": user_id, "error": str(e)}})
+        raise
+    data = b"".join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+class _Importer:
+    """Parses NDJSON lines into rows for the importing user and inserts them in batches."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        # Exported thread id -> id of the newly created thread
+        self.thread_ids: Dict[str, str] = {}
+        self.threads: List[Dict] = []
+        self.messages: List[Dict] = []
+        self.result = ImportResponse(threads=0, messages=0, skipped=0, failed=0, errors=[])
+
+    def _error(self, line_no: int, detail: str) -> None:
+        self.result.skipped += 1
+        if len(self.result.errors) < _IMPORT_MAX_ERRORS:
+            self.result.errors.append(f"line {line_no}: {detail}")
+
+    def add(self, line_no: int, raw: bytes) -> None:
+        if not raw.strip():
+            return
+        try:
+            record = json.loads(raw)
+            kind = record.get("type") if isinstance(record, dict) else None
+            if kind == "thread":
+                self._add_thread(ImportThread.model_validate(record))
+            elif kind == "message":
+                self._add_message(line_no, ImportMessage.model_validate(record))
+            else:
+                self._error(line_no, f"unknown record type {kind!r}")
+        except ValidationError as e:
+            error = e.errors()[0]
+            self._error(line_no, f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}")
+        except ValueError as e:
+            self._error(line_no, f"invalid JSON: {e}")
+
+    def _add_thread(self, thread: ImportThread) -> None:
+        # Always a fresh id, so an export can be imported twice or by another account
+        new_id = str(uuid4())
+        self.thread_ids[thread.id] = new_id
+        row = {"id": new_id, "user_id": self.user_id, "title": thread.title or "New Chat"}
+        for field in ("created_at", "updated_at", "archived_at"):
+            if getattr(thread, field):
+                row[field] = getattr(thread, field)
+        self.threads.append(row)
+
+    def _add_message(self, line_no: int, message: ImportMessage) -> None:
+        thread_id = self.thread_ids.get(message.thread_id)
+        if thread_id is None:
+            self._error(line_no, "message before its thread record")
+            return
+        row = message.model_dump(exclude={"type"}, exclude_none=True)
+        row.update(id=str(uuid4()), thread_id=thread_id, user_id=self.user_id)
+        self.messages.append(row)
+
+    @property
+    def pending(self) -> int:
+        return len(self.threads) + len(self.messages)
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        if ThreadService.import_rows(self.threads, self.messages):
+            self.result.threads += len(self.threads)
+            self.result.messages += len(self.messages)
+        else:
+            self.result.failed += self.pending
+        self.threads, self.messages = [], []
+
+
+@router.get("/threads/export")
+def export_threads(current_user: Dict = Depends(get_current_user), gzip: bool = False) -> StreamingResponse:
+    """Stream every thread and message of the authenticated user as NDJSON"""
+    user_id = current_user.get("id")
+    if gzip:
+        return StreamingResponse(
+            _export_chunks(user_id, compress=True),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="threads.ndjson.gz"'},
+        )
+    return StreamingResponse(
+        _export_chunks(user_id, compress=False),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="threads.ndjson"'},
+    )
+
+
+async def _import_body(request: Request, compressed: bool) -> AsyncIterator[bytes]:
+    """The request body as it streams in, inflated in bounded steps when `compressed`."""
+    if not compressed:
+        async for chunk in request.stream():
+            yield chunk
+        return
+    decompressor = zlib.decompressobj(wbits=47)
+    async for chunk in request.stream():
+        while chunk:
+            yield decompressor.decompress(chunk, _IMPORT_INFLATE_BYTES)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _line_too_long() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Import lines must be at most {IMPORT_MAX_LINE_BYTES} bytes",
+    )
+
+
+@router.post("/threads/import", response_model=ImportResponse)
+async def import_threads(
+    request: Request,
+    current_user: Dict = Depends(get_current_user),
+    gzip: bool = False,
+) -> ImportResponse:
+    """
+    Import an NDJSON export into new threads owned by the authenticated user.
+    The body is read as a stream and inserted in batches of IMPORT_BATCH_SIZE rows.
+    Gzip bodies are accepted with ?gzip=true or Content-Encoding: gzip.
+    A line longer than IMPORT_MAX_LINE_BYTES ends the import with 413.
+    """
+    importer = _Importer(current_user.get("id"))
+    compressed = gzip or request.headers.get("content-encoding", "").lower() == "gzip"
+    pending = b""
+    line_no = 0
+
+    try:
+        async for chunk in _import_body(request, compressed):
+            *lines, pending = (pending + chunk).split(b"\n")
+            if len(pending) > IMPORT_MAX_LINE_BYTES:
+                raise _line_too_long()
+            for line in lines:
+                if len(line) > IMPORT_MAX_LINE_BYTES:
+                    raise _line_too_long()
+                line_no += 1
+                importer.add(line_no, line)
+                if importer.pending >= IMPORT_BATCH_SIZE:
+                    await asyncio.to_thread(importer.flush)
+    except zlib.error as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid gzip body: {e}")
+
+    line_no += 1
+    importer.add(line_no, pending)
+    await asyncio.to_thread(importer.flush)
+    logger.info(
+        "Imported threads",
+        extra={"fields": {"user_id": importer.user_id, **importer.result.model_dump(exclude={"errors"})}},
+    )
+    return importer.result
+
+
+@router.get("/threads/{thread_id}", response_model=ThreadResponse)
+def get_thread(thread_id: str, current_user: Dict = Depends(get_current_user)) -> ThreadResponse:
+    """Get a specific thread owned by the authenticated user"""
+    thread = ThreadService.get_thread(thread_id)
+    if not thread:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Thread not found"
+        )
+    # Enforce ownership
+    if thread.get("user_id") != current_user.get("id"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this thread")
+
+    return ThreadResponse(
+        id=thread["id"],
+        user_id=thread.get("user_id"),
+        title=thread.get("title", "New Chat"),
+        created_at=thread["created_at"],
+        updated_at=thread["updated_at"],
+    )
+
+
+@router.delete("/threads/{thread_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_thread(thread_id: str, current_user: Dict = Depends(get_current_user)):
+    """Delete a thread and all its messages if owned by the authenticated user"""
+    thread = ThreadService.get_thread(thread_id)
+    if not thread:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thread not found")
+    if thread.get("user_id") != current_user.get("id"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this thread")
+
+    success = ThreadService.delete_thread(thread_id)
+    thread_summarizer.forget(thread_id)
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete thread"
+        )
+
+
+@router.get("/threads/{thread_id}/messages", response_model=List[HistoryEntry])
+def get_thread_messages(thread_id: str, current_user: Dict = Depends(get_current_user), limit: int = 100):
+    """Get all messages for a thread (only if owned by authenticated user)"""
+    thread = ThreadService.get_thread(thread_id)
+    if not thread:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thread not found")
+    if thread.get("user_id") != current_user.get("id"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view messages for this thread")
+
+    messages = ThreadService.get_messages(thread_id, limit=limit)
+    if FAST_JSON_ENABLED:
+        return FastJSONResponse(history_items(messages))
+    return messages
+
@@ -0,0 +1,279 @@
+"""
+Persistent WebSocket diagnose session.
+
+    /ws/diagnose?token=<jwt>[&thread_id=<id>]
+
+The token may also be sent as an `Authorization: Bearer` header. The user
+and thread are resolved once at connect time. History and previous commands
+then live in memory for the life of the connection, so a turn costs one LLM
+call. Messages are written to storage in order by a background task that
+runs behind the conversation; it is drained before the handler returns.
+
+Client -> server:
+    {"type": "problem", "problem": "..."}
+    {"type": "results", "results": [{"command": "...", "command_output": "..."}]}
+
+Server -> client:
+    {"type": "ready", "thread_id": ..., "history": [...]}
+    {"type": "turn", "message", "command", "commands", "next_step", "thread_id"}
+    {"type": "error", "detail": "..."}
+
+Frames must be text; a binary frame closes the connection with 1003.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from pydantic import TypeAdapter, ValidationError
+
+from app.agent.agents import custom_agent
+from app.agent.prompts import sys_info_prompt
+from app.agent.scheduler import SchedulerBusyError, diagnose_scheduler, priority_for
+from app.agent.schema import CommandResult, DiagnosisOutput, HistoryEntry
+from app.agent.summarizer import thread_summarizer
+from app.database.thread_service import ThreadService
+from app.routes.auth import user_from_token
+from app.routes.route import (
+    _assistant_rows,
+    _busy_output,
+    _command_output_prompt,
+    _compact_results,
+    _error_output,
+    _format_history,
+    _turn_commands,
+)
+from app.services.metrics import AUTH_SECONDS, DIAGNOSE_IN_FLIGHT, WS_PERSIST_BACKLOG, WS_SESSIONS, stage_timer
+from app.utils.log import get_logger
+
+router = APIRouter()
+logger = get_logger("ws")
+
+ROUTE = "ws_diagnose"
+# In-memory history kept per connection; prompts only use the tail
+_SESSION_HISTORY_LIMIT = 50
+
+_results_adapter = TypeAdapter(List[CommandResult])
+
+
+class _Session:
+    """State of one connection: the resolved user and thread plus a write-behind queue."""
+
+    def __init__(self, user: Dict, priority: str):
+        self.user = user
+        self.user_id = user.get("id")
+        self.priority = priority
+        self.thread_id: Optional[str] = None
+        self.history: List[HistoryEntry] = []
+        self._pending: "asyncio.Queue[Optional[Dict]]" = asyncio.Queue()
+        self._writer = asyncio.create_task(self._persist())
+
+    def record(self, role: str, message: str, command: Optional[str] = None, command_output: Optional[str] = None) -> None:
+        """Append to the in-memory history now and queue the storage write."""
+        prefix = "User" if role == "user" else "Assistant"
+        now = datetime.now(timezone.utc)
+        self.history.append(HistoryEntry(
+            timestamp=now,
+            message=f"{prefix}: {message}",
+            command=command or None,
+            command_output=command_output,
+        ))
+        del self.history[:-_SESSION_HISTORY_LIMIT]
+
+        self._pending.put_nowait({
+            "thread_id": self.thread_id,
+            "role": role,
+            "message": message,
+            "command": command,
+            "command_output": command_output,
+            "user_id": self.user_id,
+            "created_at": now.isoformat(),
+        })
+        WS_PERSIST_BACKLOG.inc()
+
+    async def _persist(self) -> None:
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                return
+            try:
+                await asyncio.to_thread(ThreadService.add_message, **item)
+            except Exception as e:
+                logger.error("Failed to persist WebSocket message", extra={"fields": {"error": str(e)}})
+            finally:
+                WS_PERSIST_BACKLOG.dec()
+
+    async def close(self) -> None:
+        """Flush every queued write, even when the client has gone away."""
+        self._pending.put_nowait(None)
+        # Shielded: a cancelled handler must not cancel the pending writes
+        await asyncio.shield(self._writer)
+
+    def ask(self, system_prompt: str, user_query: str) -> DiagnosisOutput:
+        """Blocking LLM turn under the fair scheduler; run via asyncio.to_thread."""
+        try:
+            with diagnose_scheduler.slot(self.user_id, self.priority), stage_timer(ROUTE, "llm"):
+                return custom_agent(
+                    system_prompt=system_prompt,
+                    user_query=user_query,
+                    response_model=DiagnosisOutput,
+                )
+        except SchedulerBusyError as e:
+            return _busy_output(e)
+        except Exception as e:
+            return _error_output(f"Internal error while processing your request: {str(e)}")
+
+
+async def _receive_text(websocket: WebSocket) -> Optional[str]:
+    """The next text frame, or None for a binary one (receive_text raises KeyError on those)."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE), message.get("reason"))
+    return message.get("text")
+
+
+def _bearer_token(websocket: WebSocket, token: Optional[str]) -> Optional[str]:
+    if token:
+        return token
+    authorization = websocket.headers.get("authorization", "")
+    scheme, _, value = authorization.partition(" ")
+    return value if scheme.lower() == "bearer" and value else None
+
+
+async def _authenticate(websocket: WebSocket, token: Optional[str]) -> Optional[Dict]:
+    start = time.perf_counter()
+    try:
+        return await asyncio.to_thread(user_from_token, _bearer_token(websocket, token))
+    finally:
+        AUTH_SECONDS.observe(time.perf_counter() - start)
+
+
+async def _turn(session: _Session, data: Dict) -> Dict:
+    """Handle one client message and return the agent's reply."""
+    kind = data.get("type")
+
+    if kind == "problem":
+        problem = str(data.get("problem") or "").strip()
+        if not problem:
+            return {"type": "error", "detail": "problem must not be empty"}
+        if session.thread_id is None:
+            session.thread_id = await asyncio.to_thread(
+                ThreadService.create_thread, user_id=session.user_id, title=problem[:50]
+            )
+        session.record("user", problem)
+        command_output_section = "No command executed yet."
+        user_query = problem
+
+    elif kind == "results":
+        if session.thread_id is None:
+            return {"type": "error", "detail": "send a problem before command results"}
+        try:
+            results = _results_adapter.validate_python(data.get("results"))
+        except ValidationError as e:
+            return {"type": "error", "detail": f"invalid results: {e.errors()[0]['msg']}"}
+        if not results:
+            return {"type": "error", "detail": "results must not be empty"}
+        results = await asyncio.to_thread(_compact_results, results)
+        for result in results:
+            session.record(
+                "user",
+                f"Command output for: {result.command}",
+                command=result.command,
+                command_output=result.command_output,
+            )
+        problem = "Continuing troubleshooting..."
+        command_output_section, user_query = _command_output_prompt(results)
+
+    else:
+        return {"type": "error", "detail": f"unknown message type: {kind!r}"}
+
+    with DIAGNOSE_IN_FLIGHT.labels(route=ROUTE).track_inprogress():
+        # The user message was just recorded, so history already includes it
+        # just like the HTTP routes, which store it before building the prompt
+        summary, recent = await asyncio.to_thread(
+            thread_summarizer.context, session.thread_id, session.user_id, session.history
+        )
+        system_prompt = sys_info_prompt.format(
+            problem=problem,
+            history_section=_format_history(recent, summary),
+            command_output_section=command_output_section,
+        )
+        ai_output = await asyncio.to_thread(session.ask, system_prompt, user_query)
+
+    commands = _turn_commands(ai_output)
+    for message, command in _assistant_rows(ai_output.message, commands):
+        session.record("assistant", message, command=command)
+
+    return {
+        "type": "turn",
+        "message": ai_output.message,
+        "command": commands[0] if commands else None,
+        "commands": commands or None,
+        "next_step": "command" if commands else ai_output.next_step,
+        "thread_id": session.thread_id,
+    }
+
+
+# ============================================================
+# WEBSOCKET — PERSISTENT DIAGNOSE SESSION
+# ============================================================
+@router.websocket("/ws/diagnose")
+async def ws_diagnose(
+    websocket: WebSocket,
+    token: Optional[str] = None,
+    thread_id: Optional[str] = None,
+    priority: Optional[str] = None,
+):
+    # The server switch middleware only handles HTTP, so check it here
+    if not websocket.app.state.server_enabled:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="server is currently disabled")
+        return
+
+    user = await _authenticate(websocket, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+
+    history: List[HistoryEntry] = []
+    if thread_id:
+        thread = await asyncio.to_thread(ThreadService.get_thread, thread_id)
+        if not thread:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Thread not found")
+            return
+        if thread.get("user_id") != user.get("id"):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not authorized for this thread")
+            return
+        history = await asyncio.to_thread(ThreadService.get_recent_messages, thread_id, _SESSION_HISTORY_LIMIT)
+
+    await websocket.accept()
+    WS_SESSIONS.inc()
+    session = _Session(user, priority_for(user, priority))
+    session.thread_id = thread_id
+    session.history = history[-_SESSION_HISTORY_LIMIT:]
+
+    try:
+        await websocket.send_json({
+            "type": "ready",
+            "thread_id": session.thread_id,
+            "history": [entry.model_dump(mode="json") for entry in session.history],
+        })
+        while True:
+            text = await _receive_text(websocket)
+            if text is None:
+                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Only text frames are accepted")
+                break
+            try:
+                data = json.loads(text)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                await websocket.send_json({"type": "error", "detail": "messages must be JSON objects"})
+                continue
+            await websocket.send_json(await _turn(session, data))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        WS_SESSIONS.dec()
+        await session.close()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Backfill / re-embed `message_embeddings`.
+
+Walks every row of `messages` in (created_at, id) keyset order and
+re-encodes the ones whose embedding is missing, was made by another model
+version than EMBEDDING_MODEL_VERSION, or is stored in another format than the current
+vector codec's (e.g. after changing the model or EMBEDDING_FORMAT, or for
+messages written while embedding failed). Encoding runs in a process pool
+over `generate_message_embeddings`. The next page is read while the current
+one encodes. Results are bulk-upserted, reusing the existing row id where
+there is one.
+
+After every page the position is written to a checkpoint file. A re-run
+resumes from it, unless the model or format changed or --restart is given. Every
+database call takes a token from a --db-rps bucket so a backfill cannot
+crowd out the live service. Progress and throughput are logged per page.
+Needs the `model` / `embedding_format` columns from
+app/database/migrations/001_message_embeddings_versioning.sql.
+
+Usage:
+  python -m app.scripts.backfill_embeddings [--workers 4] [--batch-size 256]
+      [--page-size 2000] [--db-rps 10] [--checkpoint backfill_embeddings.json]
+      [--restart] [--limit N] [--dry-run]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from app.agent.admission import TokenBucket
+from app.database.storage import EmbeddingMaintenance, get_storage
+from app.services.embeddings import EMBEDDING_MODEL_VERSION, encode_in_process, generate_message_embeddings
+from app.services.vector_codec import LEGACY_FORMAT, get_vector_codec
+from app.utils.log import get_logger
+
+logger = get_logger("backfill")
+
+# Rows per upsert request; each row carries a full vector as JSON
+_UPSERT_CHUNK = 100
+
+
+# -----------------------------
+# encode workers
+# -----------------------------
+def _init_worker(torch_threads: int) -> None:
+    # This process is the encode worker; do not start an EMBEDDING_WORKERS pool under it
+    encode_in_process()
+    if torch_threads > 0:
+        import torch
+        torch.set_num_threads(torch_threads)
+    # Load the model once per process, not on the first batch
+    generate_message_embeddings([("warm up", None, None)])
+
+
+def _encode(items: List[Tuple[str, Optional[str], Optional[str]]]) -> List[List[float]]:
+    return generate_message_embeddings(items)
+
+
+class _InlineExecutor(Executor):
+    """--workers 0: encode in this process (debugging, tiny tables)."""
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+# -----------------------------
+# database access
+# -----------------------------
+class _RateLimitedDb:
+    def __init__(self, storage: EmbeddingMaintenance, rps: float):
+        self.storage = storage
+        self.format = get_vector_codec().version
+        # At most one second of burst, so a resumed backfill cannot fire a minute's worth at once
+        self.bucket = TokenBucket(rps * 60.0, capacity=max(rps, 1.0))
+        self.calls = 0
+
+    def _acquire(self) -> None:
+        delay = self.bucket.wait_time(1, time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+            self.bucket.wait_time(1, time.monotonic())
+        self.bucket.take(1)
+        self.calls += 1
+
+    def read_page(self, after: Optional[Tuple[str, str]], page_size: int) -> Tuple[List[Dict], List[Dict]]:
+        """(page of messages, the ones needing a new embedding, each with the embedding row id to reuse)."""
+        self._acquire()
+        page = self.storage.get_all_messages_page(after, page_size)
+        if not page:
+            return page, []
+        self._acquire()
+        existing = {row["message_id"]: row for row in self.storage.get_embedding_rows([m["id"] for m in page])}
+        stale = []
+        for message in page:
+            row = existing.get(message["id"])
+            if (
+                row is not None
+                and row.get("model") == EMBEDDING_MODEL_VERSION
+                and (row.get("embedding_format") or LEGACY_FORMAT) == self.format
+            ):
+                continue
+            stale.append({**message, "embedding_id": row["id"] if row is not None else str(uuid4())})
+        return page, stale
+
+    def upsert(self, rows: List[Dict]) -> None:
+        for i in range(0, len(rows), _UPSERT_CHUNK):
+            self._acquire()
+            self.storage.upsert_embeddings(rows[i:i + _UPSERT_CHUNK])
+
+
+# -----------------------------
+# checkpoints
+# -----------------------------
+def _load_checkpoint(path: str) -> Dict:
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if state.get("model") != EMBEDDING_MODEL_VERSION or state.get("format") != get_vector_codec().version:
+        logger.info(
+            "Checkpoint is for another model or format; starting over",
+            extra={"fields": {"model": state.get("model"), "format": state.get("format")}},
+        )
+        return {}
+    return state
+
+
+def _save_checkpoint(path: str, state: Dict) -> None:
+    state = {
+        **state,
+        "model": EMBEDDING_MODEL_VERSION,
+        "format": get_vector_codec().version,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    # Atomic, so a crash mid-write never leaves a truncated checkpoint
+    os.replace(tmp, path)
+
+
+# -----------------------------
+# main loop
+# -----------------------------
+def backfill(args: argparse.Namespace) -> Dict:
+    storage = get_storage()
+    if not isinstance(storage, EmbeddingMaintenance):
+        raise SystemExit(f"{type(storage).__name__} does not store embeddings; nothing to backfill")
+
+    state = {} if args.restart else _load_checkpoint(args.checkpoint)
+    after = tuple(state["after"]) if state.get("after") else None
+    scanned = int(state.get("scanned", 0))
+    embedded = int(state.get("embedded", 0))
+    if after:
+        logger.info("Resuming backfill", extra={"fields": {"after": list(after), "scanned": scanned, "embedded": embedded}})
+
+    db = _RateLimitedDb(storage, args.db_rps)
+    if args.workers > 0:
+        pool: Executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            # spawn: the parent holds HTTP clients and threads that must not be forked
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(args.torch_threads,),
+        )
+    else:
+        pool = _InlineExecutor()
+
+    started = time.perf_counter()
+    run_embedded = 0
+    try:
+        page, stale = db.read_page(after, args.page_size)
+        while page:
+            if args.limit and run_embedded + len(stale) >= args.limit:
+                # Stop right after the last message embedded, so a re-run picks up the rest
+                stale = stale[:args.limit - run_embedded]
+                last = stale[-1]["id"] if stale else None
+                page = page[:next((i + 1 for i, m in enumerate(page) if m["id"] == last), 0)]
+                if not page:
+                    break
+            items = [(m.get("content") or "", m.get("command"), m.get("command_output")) for m in stale]
+            futures = [] if args.dry_run else [
+                pool.submit(_encode, items[i:i + args.batch_size]) for i in range(0, len(items), args.batch_size)
+            ]
+
+            # Read ahead while the pool encodes this page
+            page_after = (page[-1]["created_at"], page[-1]["id"])
+            done = len(page) < args.page_size or bool(args.limit and run_embedded + len(stale) >= args.limit)
+            next_page, next_stale = ([], []) if done else db.read_page(page_after, args.page_size)
+
+            if futures:
+                vectors = [vector for future in futures for vector in future.result()]
+                codec = get_vector_codec()
+                db.upsert([
+                    {
+                        "id": m["embedding_id"],
+                        "message_id": m["id"],
+                        "thread_id": m["thread_id"],
+                        "model": EMBEDDING_MODEL_VERSION,
+                        # Upserts merge: clear what another format left behind (float32 omits both)
+                        "embedding_format": None,
+                        "embedding_packed": None,
+                        **codec.encode(vector),
+                    }
+                    for m, vector in zip(stale, vectors)
+                ])
+
+            scanned += len(page)
+            embedded += len(stale)
+            run_embedded += len(stale)
+            after = page_after
+            if not args.dry_run:
+                _save_checkpoint(args.checkpoint, {"after": list(after), "scanned": scanned, "embedded": embedded})
+
+            elapsed = time.perf_counter() - started
+            logger.info("Backfill progress", extra={"fields": {
+                "scanned": scanned,
+                "embedded": embedded,
+                "page_stale": len(stale),
+                "embedded_per_second": round(run_embedded / elapsed, 1) if elapsed else None,
+                "db_calls": db.calls,
+                "position": after[0],
+            }})
+            page, stale = next_page, next_stale
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    summary = {
+        "scanned": scanned,
+        "embedded": embedded,
+        "embedded_this_run": run_embedded,
+        "seconds": round(time.perf_counter() - started, 1),
+        "db_calls": db.calls,
+        "dry_run": args.dry_run,
+    }
+    logger.info("Backfill finished", extra={"fields": summary})
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1),
+                        help="encode processes (0 = encode in this process)")
+    parser.add_argument("--torch-threads", type=int, default=1, help="torch threads per worker (0 = torch default)")
+    parser.add_argument("--batch-size", type=int, default=256, help="messages per generate_message_embeddings call")
+    parser.add_argument("--page-size", type=int, default=2000, help="messages read per keyset page")
+    parser.add_argument("--db-rps", type=float, default=10.0, help="database requests per second")
+    parser.add_argument("--checkpoint", default="backfill_embeddings.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and rescan from the start")
+    parser.add_argument("--limit", type=int, default=0, help="stop after embedding this many messages")
+    parser.add_argument("--dry-run", action="store_true", help="count stale messages without encoding or writing")
+    args = parser.parse_args()
+    print(json.dumps(backfill(args)))
+
+
+if __name__ == "__main__":
+    main()
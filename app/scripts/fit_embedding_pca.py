@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Fit the PCA basis used by EMBEDDING_PCA_PATH (app/services/vector_codec.py).
+
+Encodes up to --sample stored messages at full precision with the current
+embedding model, fits the top --dim principal components and writes them
+to an .npz file. Prints the share of variance the kept components explain.
+
+Changing the basis changes the stored format version, so existing rows are
+re-encoded by the next `python -m app.scripts.backfill_embeddings` run.
+
+Usage:
+  python -m app.scripts.fit_embedding_pca [--dim 128] [--sample 20000]
+      [--output embedding_pca.npz]
+"""
+import argparse
+import json
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.database.storage import EmbeddingMaintenance, get_storage
+from app.services.embeddings import generate_message_embeddings
+from app.services.vector_codec import Projection
+from app.utils.log import get_logger
+
+logger = get_logger("embeddings")
+
+_PAGE_SIZE = 2000
+_BATCH_SIZE = 256
+
+
+def sample_messages(limit: int) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    storage = get_storage()
+    if not isinstance(storage, EmbeddingMaintenance):
+        raise SystemExit(f"{type(storage).__name__} does not store embeddings; nothing to sample")
+    items: List[Tuple[str, Optional[str], Optional[str]]] = []
+    after = None
+    while len(items) < limit:
+        page = storage.get_all_messages_page(after, _PAGE_SIZE)
+        items += [(m.get("content") or "", m.get("command"), m.get("command_output")) for m in page]
+        if len(page) < _PAGE_SIZE:
+            break
+        after = (page[-1]["created_at"], page[-1]["id"])
+    return items[:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--sample", type=int, default=20000)
+    parser.add_argument("--output", default="embedding_pca.npz")
+    args = parser.parse_args()
+
+    items = sample_messages(args.sample)
+    if len(items) <= args.dim:
+        raise SystemExit(f"Need more than {args.dim} messages to fit {args.dim} components, found {len(items)}")
+
+    vectors = np.asarray(
+        [v for i in range(0, len(items), _BATCH_SIZE) for v in generate_message_embeddings(items[i:i + _BATCH_SIZE])],
+        dtype=np.float32,
+    )
+    projection = Projection.fit(vectors, args.dim)
+    projection.save(args.output)
+
+    centred = vectors - vectors.mean(axis=0)
+    kept = float(np.square(centred @ projection.components.T).sum() / np.square(centred).sum())
+    summary = {"output": args.output, "id": projection.id, "samples": len(items), "explained_variance": round(kept, 4)}
+    logger.info("Fitted embedding PCA", extra={"fields": summary})
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Command-output compaction.
+
+Outputs posted back by the client are mostly noise for the model: ANSI
+colour codes, progress bars redrawn with carriage returns, PowerShell
+column padding, thousands of near-identical event-log lines. `compact`
+runs a pipeline of filters over an output once, when it arrives; the
+compacted text is what gets prompted, embedded and stored.
+
+Each filter takes and returns the list of lines. Format detectors
+(PowerShell tables and lists, pip/npm logs, stack traces) are ordinary
+filters that leave lines they do not recognise untouched. Extra filters
+can be plugged in with `output_compactor.register(name, fn)`.
+"""
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+
+from app.config.config import COMPACTION_ENABLED, COMPACTION_MAX_CHARS, COMPACTION_MIN_CHARS
+from app.services.metrics import COMPACTION_BYTES, COMPACTION_RATIO, COMPACTION_SECONDS
+from app.utils.log import get_logger
+
+logger = get_logger("compaction")
+
+LineFilter = Callable[[List[str]], List[str]]
+
+# CSI (colours, cursor moves), OSC (window titles, hyperlinks) and two-byte escapes
+_ANSI = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]")
+# Control characters other than tab and newline (\r is handled separately)
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_INNER_SPACES = re.compile(r"(?<=\S)[ \t]{3,}(?=\S)")
+# Masks the parts of log lines that change from one repeat to the next
+_VOLATILE = re.compile(r"0x[0-9a-fA-F]+|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}|\d+")
+# Only log lines (leading date or time) are folded when merely similar
+_LOG_LINE = re.compile(
+    r"^\s*\[?(?:\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|\d{1,2}:\d{2}:\d{2}"
+    r"|(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +\d{1,2} )"
+)
+# Addresses and ports are the facts network diagnoses need; never fold those lines
+_ADDRESS = re.compile(
+    r"\b\d{1,3}(?:\.\d{1,3}){3}\b|[0-9a-fA-F]::|::[0-9a-fA-F]|\b(?:[0-9a-fA-F]{1,4}:){7}|\[[0-9a-fA-F:]+\]|\*:\d+"
+)
+# Shorter runs of similar log lines are kept
+_SIMILAR_RUN = 5
+
+
+# -----------------------------
+# FILTERS
+# -----------------------------
+def collapse_whitespace(lines: List[str]) -> List[str]:
+    """Trim line ends, shrink column padding to two spaces and squeeze blank runs."""
+    out: List[str] = []
+    for line in lines:
+        line = _INNER_SPACES.sub("  ", line.rstrip())
+        if not line and (not out or not out[-1]):
+            continue
+        out.append(line)
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+_PS_RULE = re.compile(r"^\s*-{2,}(?:\s+-{2,})*\s*$")
+_PS_LIST_ITEM = re.compile(r"^(\S[^:]*?)\s{2,}: ")
+
+
+def powershell_tables(lines: List[str]) -> List[str]:
+    """
+    Format-Table: shorten the dashed rule under the header.
+    Format-List: drop the padding before the colon ("Name      : x").
+    """
+    out = []
+    for line in lines:
+        if _PS_RULE.match(line):
+            out.append("---")
+            continue
+        out.append(_PS_LIST_ITEM.sub(r"\1: ", line))
+    return out
+
+
+_BAR = re.compile(r"[━═█▉▊▋▌▍▎▏░▒▓#=]{3,}")
+_BAR_START = re.compile(r"^\s*[━█░▒▓]{5,}")
+_PERCENT = re.compile(r"\d%")
+_SPINNER = re.compile(r"^\s*[⠁-⣿|/\\-]\s*$")
+# package_logs only touches outputs that look like a pip or npm run
+_PACKAGE_TOOL = re.compile(
+    r"^(?:npm (?:ERR!|WARN|notice|timing|http|sill|verb)\b|Collecting |Requirement already satisfied:"
+    r"|Successfully installed |Installing collected packages:|added \d+ packages?)"
+)
+_PACKAGE_NOISE = re.compile(r"^npm (?:timing|http fetch|sill|verb)\b|^\s*(?:idealTree|reify):")
+# pip lines worth one example and a count, not one line per package
+_PIP_REPEATS = ("Requirement already satisfied:", "Collecting ", "Downloading ", "Using cached ", "  Downloading ")
+_PIP_KEEP = 2
+
+
+def _is_progress(line: str) -> bool:
+    if _BAR_START.match(line):
+        # rich / tqdm bars
+        return True
+    if _BAR.search(line) is not None:
+        # "[#####.....] 45%" style bars; "=== Section ===" headings have no percentage
+        return _PERCENT.search(line) is not None
+    return _SPINNER.match(line) is not None
+
+
+def package_logs(lines: List[str]) -> List[str]:
+    """pip / npm install logs: drop progress bars and verbose npm lines, count pip repeats."""
+    if not any(_PACKAGE_TOOL.match(line) for line in lines):
+        return lines
+    out: List[str] = []
+    counts = {}
+    for line in lines:
+        if _is_progress(line) or _PACKAGE_NOISE.match(line):
+            continue
+        prefix = next((p for p in _PIP_REPEATS if line.startswith(p)), None)
+        if prefix is None:
+            out.append(line)
+            continue
+        counts[prefix] = counts.get(prefix, 0) + 1
+        if counts[prefix] <= _PIP_KEEP:
+            out.append(line)
+        elif counts[prefix] == _PIP_KEEP + 1:
+            # Placeholder, filled in with the final count below
+            out.append(prefix)
+    for prefix, count in counts.items():
+        if count > _PIP_KEEP:
+            out[out.index(prefix)] = f"... {count - _PIP_KEEP} more '{prefix.strip()}' lines"
+    return out
+
+
+# .NET / PowerShell / Java "at ..." frames and Python "File ..." frame pairs
+_AT_FRAME = re.compile(r"^\s+at\s")
+_PY_FRAME = re.compile(r'^\s+File "')
+_FRAMES_HEAD = 3
+_FRAMES_TAIL = 3
+
+
+def stack_traces(lines: List[str]) -> List[str]:
+    """Keep the outermost and innermost frames of long stack traces."""
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        frames = _frame_run(lines, i)
+        if len(frames) <= _FRAMES_HEAD + _FRAMES_TAIL + 1:
+            if frames:
+                out.extend(sum(frames, []))
+                i += sum(len(f) for f in frames)
+            else:
+                out.append(lines[i])
+                i += 1
+            continue
+        omitted = len(frames) - _FRAMES_HEAD - _FRAMES_TAIL
+        out.extend(sum(frames[:_FRAMES_HEAD], []))
+        indent = frames[0][0][: len(frames[0][0]) - len(frames[0][0].lstrip())]
+        out.append(f"{indent}... {omitted} frames omitted ...")
+        out.extend(sum(frames[-_FRAMES_TAIL:], []))
+        i += sum(len(f) for f in frames)
+    return out
+
+
+def _frame_run(lines: List[str], start: int) -> List[List[str]]:
+    """Consecutive frames starting at `start`; a Python frame includes its source line."""
+    frames = []
+    i = start
+    while i < len(lines):
+        if _AT_FRAME.match(lines[i]):
+            frames.append([lines[i]])
+            i += 1
+        elif _PY_FRAME.match(lines[i]):
+            frame = [lines[i]]
+            if i + 1 < len(lines) and lines[i + 1].startswith("    ") and not _PY_FRAME.match(lines[i + 1]):
+                frame.append(lines[i + 1])
+            frames.append(frame)
+            i += len(frame)
+        else:
+            break
+    return frames
+
+
+def dedupe_lines(lines: List[str]) -> List[str]:
+    """
+    Collapse runs of repeated lines. Exact repeats become the line plus a
+    count. Long runs of timestamped log lines that differ only in numbers
+    (times, record ids) keep their first and last line. Anything else,
+    e.g. `ipconfig` address lists or `netstat` rows, is only folded when
+    identical, since every address, port and PID in it matters.
+    """
+    out: List[str] = []
+    run: List[str] = []
+    run_key: Optional[str] = None
+    for line in lines:
+        key = _dedupe_key(line)
+        if key is not None and key == run_key:
+            run.append(line)
+            continue
+        _flush_run(out, run)
+        run, run_key = [line], key
+    _flush_run(out, run)
+    return out
+
+
+def _dedupe_key(line: str) -> Optional[str]:
+    if not line.strip():
+        return None
+    if _LOG_LINE.match(line) and not _ADDRESS.search(line):
+        return _VOLATILE.sub("#", line)
+    return line
+
+
+def _flush_run(out: List[str], run: List[str]) -> None:
+    if len(run) > 1 and all(line == run[0] for line in run):
+        out.append(f"{run[0]}  [x{len(run)}]")
+    elif len(run) >= _SIMILAR_RUN:
+        out.append(run[0])
+        out.append(f"... {len(run) - 2} similar lines ...")
+        out.append(run[-1])
+    else:
+        out.extend(run)
+
+
+# -----------------------------
+# PIPELINE
+# -----------------------------
+def _clean_text(text: str) -> List[str]:
+    """Strip escape sequences and resolve carriage-return redraws into lines."""
+    text = _ANSI.sub("", text.replace("\r\n", "\n"))
+    lines = []
+    for raw in text.split("\n"):
+        if "\r" in raw:
+            # A progress bar redraws the line; only the final state matters
+            raw = next((part for part in reversed(raw.split("\r")) if part.strip()), "")
+        lines.append(_CONTROL.sub("", raw).expandtabs(4))
+    return lines
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    # Errors tend to be at the end of an output, context at the start
+    head = max_chars // 3
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n... [{omitted} chars omitted] ...\n{text[-tail:]}"
+
+
+class OutputCompactor:
+    def __init__(
+        self,
+        enabled: bool = COMPACTION_ENABLED,
+        max_chars: int = COMPACTION_MAX_CHARS,
+        min_chars: int = COMPACTION_MIN_CHARS,
+    ):
+        self.enabled = enabled
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self._filters: List[Tuple[str, LineFilter]] = [
+            ("powershell_tables", powershell_tables),
+            ("package_logs", package_logs),
+            ("stack_traces", stack_traces),
+            ("collapse_whitespace", collapse_whitespace),
+            ("dedupe_lines", dedupe_lines),
+        ]
+
+    def register(self, name: str, fn: LineFilter, before: Optional[str] = None) -> None:
+        """Add a filter at the end of the pipeline, or ahead of the named one."""
+        self._filters = [(n, f) for n, f in self._filters if n != name]
+        names = [n for n, _ in self._filters]
+        index = names.index(before) if before in names else len(self._filters)
+        self._filters.insert(index, (name, fn))
+
+    @property
+    def filters(self) -> List[str]:
+        return [name for name, _ in self._filters]
+
+    def compact(self, text: Optional[str]) -> Optional[str]:
+        if not text or not self.enabled:
+            return text
+        if len(text) < self.min_chars and "\x1b" not in text and "\r" not in text:
+            return text
+
+        start = time.perf_counter()
+        lines = _clean_text(text)
+        for name, fn in self._filters:
+            try:
+                lines = fn(lines)
+            except Exception as e:
+                # A broken filter must not lose the output
+                logger.warning("Compaction filter failed", extra={"fields": {"filter": name, "error": str(e)[:300]}})
+        compacted = _truncate("\n".join(lines), self.max_chars)
+
+        COMPACTION_SECONDS.observe(time.perf_counter() - start)
+        COMPACTION_BYTES.labels(stage="input").inc(len(text))
+        COMPACTION_BYTES.labels(stage="output").inc(len(compacted))
+        ratio = len(compacted) / len(text)
+        COMPACTION_RATIO.observe(ratio)
+        logger.debug(
+            "Compacted command output",
+            extra={"fields": {"input_chars": len(text), "output_chars": len(compacted), "ratio": round(ratio, 3)}},
+        )
+        return compacted
+
+
+output_compactor = OutputCompactor()
+
+
+def compact(text: Optional[str]) -> Optional[str]:
+    """Compact one command output with the shared pipeline."""
+    return output_compactor.compact(text)
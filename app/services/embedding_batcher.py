@@ -0,0 +1,184 @@
+"""
+Dynamic micro-batching of embedding encodes.
+
+Concurrent requests used to call `model.encode` on one string each, from
+many threadpool threads at once: every call pays the fixed per-call cost,
+the matrix multiplies are too small to fill the CPU's vector units, and the
+torch thread pools of the callers fight over the same cores.
+
+Callers now `submit` texts and get one `concurrent.futures.Future` per
+text. A single worker thread takes the oldest request, keeps collecting
+until EMBEDDING_BATCH_MAX_ITEMS texts are waiting or EMBEDDING_BATCH_MAX_WAIT_MS
+has passed since that request arrived, encodes everything as one batch and
+resolves the futures. A request that is already larger than the batch limit
+(the backfill) is encoded on its own, in one call. With an out-of-process
+worker pool (app/services/embedding_pool.py) there is one such worker
+thread per process, each forming its own batches.
+
+Batch sizes and queueing delays are exported as histograms and, for the
+last few hundred batches, as percentiles on GET /admin/embeddings.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List, Sequence, Tuple
+
+from app.config.config import EMBEDDING_BATCH_ENABLED, EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_WAIT_MS
+from app.services.metrics import EMBEDDING_BATCH_REQUESTS, EMBEDDING_QUEUE_SECONDS, EMBEDDING_QUEUED
+from app.utils.log import get_logger
+
+logger = get_logger("embeddings")
+
+# Batches kept for the percentiles in `snapshot`
+_RECENT_BATCHES = 500
+
+
+class _Request:
+    __slots__ = ("texts", "futures", "enqueued_at")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.futures: List[Future] = [Future() for _ in texts]
+        self.enqueued_at = time.monotonic()
+
+
+def _percentiles(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        encode: Callable[[List[str]], List[List[float]]],
+        enabled: bool = EMBEDDING_BATCH_ENABLED,
+        max_items: int = EMBEDDING_BATCH_MAX_ITEMS,
+        max_wait_ms: float = EMBEDDING_BATCH_MAX_WAIT_MS,
+        concurrency: int = 1,
+    ):
+        self.encode = encode
+        self.enabled = enabled
+        self.max_items = max(max_items, 1)
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        # Batches encoded at once; more than 1 only helps when `encode` releases the GIL for long
+        self.concurrency = max(concurrency, 1)
+        self._queue: Deque[_Request] = deque()
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        # (texts, requests, oldest queueing delay in seconds) per recent batch
+        self._recent: Deque[Tuple[int, int, float]] = deque(maxlen=_RECENT_BATCHES)
+        self._batches = 0
+
+    # -----------------------------
+    # client side
+    # -----------------------------
+    def submit(self, texts: Sequence[str]) -> List[Future]:
+        """One future per text, resolved with its embedding (or the encode error)."""
+        request = _Request(list(texts))
+        if not request.texts:
+            return []
+        if not self.enabled:
+            self._run([request])
+            return request.futures
+
+        with self._cond:
+            self._start_workers()
+            self._queue.append(request)
+            self._queued += len(request.texts)
+            EMBEDDING_QUEUED.set(self._queued)
+            self._cond.notify()
+        return request.futures
+
+    def encode_many(self, texts: Sequence[str]) -> List[List[float]]:
+        """Blocking `submit`: embeddings in the order of `texts`."""
+        return [future.result() for future in self.submit(texts)]
+
+    # -----------------------------
+    # worker
+    # -----------------------------
+    def _start_workers(self) -> None:
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        while len(self._workers) < self.concurrency:
+            worker = threading.Thread(
+                target=self._loop, name=f"embedding-batcher-{len(self._workers)}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _next_batch(self) -> List[_Request]:
+        with self._cond:
+            while True:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = self._queue[0].enqueued_at + self.max_wait
+                # Linger for company until the batch is full or the oldest request has waited long enough
+                while self._queued < self.max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # Another worker thread may have taken everything while this one waited
+                if self._queue:
+                    break
+
+            batch = [self._queue.popleft()]
+            size = len(batch[0].texts)
+            while self._queue and size + len(self._queue[0].texts) <= self.max_items:
+                request = self._queue.popleft()
+                batch.append(request)
+                size += len(request.texts)
+            self._queued -= size
+            EMBEDDING_QUEUED.set(self._queued)
+            return batch
+
+    def _run(self, batch: List[_Request]) -> None:
+        started = time.monotonic()
+        delay = started - batch[0].enqueued_at
+        for request in batch:
+            EMBEDDING_QUEUE_SECONDS.observe(started - request.enqueued_at)
+        EMBEDDING_BATCH_REQUESTS.observe(len(batch))
+
+        texts = [text for request in batch for text in request.texts]
+        futures = [future for request in batch for future in request.futures]
+        try:
+            vectors = self.encode(texts)
+        except Exception as e:
+            logger.error("Embedding batch failed", extra={"fields": {"texts": len(texts), "error": str(e)}})
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+
+        with self._cond:
+            self._batches += 1
+            self._recent.append((len(texts), len(batch), delay))
+
+    def _loop(self) -> None:
+        while True:
+            self._run(self._next_batch())
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            recent = list(self._recent)
+            queued = self._queued
+        return {
+            "enabled": self.enabled,
+            "max_items": self.max_items,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "concurrency": self.concurrency,
+            "queued_texts": queued,
+            "batches": self._batches,
+            "recent_batches": len(recent),
+            "batch_size": _percentiles([r[0] for r in recent]),
+            "requests_per_batch": _percentiles([r[1] for r in recent]),
+            "queue_delay_ms": {k: round(v * 1000.0, 2) for k, v in _percentiles([r[2] for r in recent]).items()},
+        }
@@ -0,0 +1,217 @@
+"""
+Out-of-process embedding workers.
+
+With EMBEDDING_WORKERS > 0 the API process never runs MiniLM itself. The
+micro-batcher hands each batch to one of a pool of spawned worker processes
+that each hold their own copy of the model. The batcher runs one dispatch
+thread per worker, so all of them stay busy. Encoding then no longer
+competes with request handling, JSON serialization and Supabase I/O for the
+API's GIL, and each worker's torch pool is capped at
+EMBEDDING_WORKER_TORCH_THREADS so the workers do not oversubscribe the CPU.
+
+IPC is one duplex pipe per worker: a pickled list of texts in, a float32
+buffer out (about 1.5 KB per 384-d vector, no per-float objects).
+
+A worker that dies mid-batch is respawned and the batch is retried once on
+a fresh worker. One that does not answer within
+EMBEDDING_WORKER_TIMEOUT_SECONDS is killed and respawned, and its batch
+fails.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.config.config import EMBEDDING_WORKER_TIMEOUT_SECONDS, EMBEDDING_WORKER_TORCH_THREADS, EMBEDDING_WORKERS
+from app.services.metrics import EMBEDDING_WORKER_RESTARTS, EMBEDDING_WORKERS_BUSY
+from app.utils.log import get_logger
+
+logger = get_logger("embeddings")
+
+# Model load (and first-use download) in a fresh worker
+_START_TIMEOUT_SECONDS = 300.0
+
+
+class EmbeddingWorkerError(Exception):
+    """A batch could not be encoded by the worker pool."""
+
+
+# -----------------------------
+# worker process
+# -----------------------------
+def _worker_main(conn: Connection, torch_threads: int) -> None:
+    if torch_threads > 0:
+        import torch
+        torch.set_num_threads(torch_threads)
+    from app.services.embeddings import get_embedding_model
+
+    model = get_embedding_model()
+    conn.send(("ready", model.get_sentence_embedding_dimension()))
+    while True:
+        try:
+            texts = conn.recv()
+        except EOFError:
+            # The API process went away
+            return
+        try:
+            vectors = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+            conn.send(("ok", np.ascontiguousarray(vectors, dtype=np.float32).tobytes()))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# -----------------------------
+# pool (API side)
+# -----------------------------
+class _Worker:
+    __slots__ = ("index", "process", "conn", "batches")
+
+    def __init__(self, index: int, process: multiprocessing.Process, conn: Connection):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.batches = 0
+
+
+class EmbeddingWorkerPool:
+    def __init__(
+        self,
+        size: int = EMBEDDING_WORKERS,
+        torch_threads: int = EMBEDDING_WORKER_TORCH_THREADS,
+        timeout: float = EMBEDDING_WORKER_TIMEOUT_SECONDS,
+    ):
+        self.size = max(size, 1)
+        self.torch_threads = torch_threads
+        self.timeout = timeout
+        # spawn: the API process holds HTTP clients and threads that must not be forked
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: Dict[int, _Worker] = {}
+        self._dimension: Optional[int] = None
+        self._restarts = 0
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _spawn(self, index: int) -> _Worker:
+        parent, child = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(child, self.torch_threads), name=f"embedding-worker-{index}", daemon=True
+        )
+        process.start()
+        child.close()
+        if not parent.poll(_START_TIMEOUT_SECONDS):
+            process.kill()
+            raise EmbeddingWorkerError(f"embedding worker {index} did not load the model in time")
+        try:
+            _, dimension = parent.recv()
+        except EOFError:
+            raise EmbeddingWorkerError(f"embedding worker {index} exited while loading the model (code {process.exitcode})")
+        self._dimension = dimension
+        worker = _Worker(index, process, parent)
+        with self._lock:
+            self._workers[index] = worker
+        logger.info("Embedding worker started", extra={"fields": {"worker": index, "pid": process.pid}})
+        return worker
+
+    def _restart(self, worker: _Worker, reason: str) -> _Worker:
+        EMBEDDING_WORKER_RESTARTS.labels(reason=reason).inc()
+        with self._lock:
+            self._restarts += 1
+        logger.warning("Restarting embedding worker", extra={"fields": {
+            "worker": worker.index,
+            "pid": worker.process.pid,
+            "reason": reason,
+            "exitcode": worker.process.exitcode,
+        }})
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(timeout=5)
+        worker.conn.close()
+        return self._spawn(worker.index)
+
+    def start(self) -> None:
+        """Spawn every worker and wait until each has its model loaded."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        started = time.perf_counter()
+        for index in range(self.size):
+            self._idle.put(self._spawn(index))
+        logger.info("Embedding worker pool ready", extra={"fields": {
+            "workers": self.size,
+            "torch_threads": self.torch_threads,
+            "seconds": round(time.perf_counter() - started, 1),
+        }})
+
+    def dimension(self) -> int:
+        self.start()
+        return self._dimension
+
+    def _call(self, worker: _Worker, texts: List[str]) -> np.ndarray:
+        worker.conn.send(texts)
+        if not worker.conn.poll(self.timeout):
+            raise TimeoutError(f"embedding worker {worker.index} did not answer within {self.timeout:.0f}s")
+        status, payload = worker.conn.recv()
+        if status != "ok":
+            raise EmbeddingWorkerError(payload)
+        worker.batches += 1
+        return np.frombuffer(payload, dtype=np.float32).reshape(len(texts), -1)
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """(len(texts), dim) float32 embeddings, encoded by the next idle worker."""
+        self.start()
+        texts = list(texts)
+        worker = self._idle.get()
+        with self._lock:
+            self._busy += 1
+            EMBEDDING_WORKERS_BUSY.set(self._busy)
+        try:
+            for attempt in (1, 2):
+                try:
+                    return self._call(worker, texts)
+                except TimeoutError:
+                    # Before OSError: TimeoutError subclasses it, and a hung batch is not retried
+                    worker = self._restart(worker, "timeout")
+                    raise
+                except (EOFError, OSError):
+                    # Died mid-batch (OOM kill, segfault): replace it and retry once
+                    worker = self._restart(worker, "crash")
+                    if attempt == 2:
+                        raise EmbeddingWorkerError("embedding worker crashed twice on the same batch")
+        finally:
+            with self._lock:
+                self._busy -= 1
+                EMBEDDING_WORKERS_BUSY.set(self._busy)
+            self._idle.put(worker)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+            self._started = False
+        for worker in workers:
+            worker.conn.close()
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.size,
+                "torch_threads": self.torch_threads,
+                "busy": self._busy,
+                "restarts": self._restarts,
+                "processes": [
+                    {"worker": w.index, "pid": w.process.pid, "alive": w.process.is_alive(), "batches": w.batches}
+                    for w in sorted(self._workers.values(), key=lambda w: w.index)
+                ],
+            }
@@ -1,25 +1,105 @@
-from typing import List, Optional
+from typing import List, Optional, Sequence, Tuple
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import os
+import re
+import threading
+import time
+
+from app.config.config import EMBEDDING_CHUNK_CHARS, EMBEDDING_MAX_CHUNKS, EMBEDDING_WORKERS
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_pool import EmbeddingWorkerPool
+from app.services.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_INPUT_CHUNKS, EMBEDDING_SECONDS, record_timing
+from app.utils.log import get_logger
+
+logger = get_logger("embeddings")
 
 # Initialize the embedding model (using a lightweight model)
 # You can change this to a different model if needed
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"  # 384 dimensions, fast and lightweight
 
+# Stored with each embedding row (`model` column, added by
+# app/database/migrations/001_message_embeddings_versioning.sql). Bump the suffix
+# when the text fed to the model changes, so app/scripts/backfill_embeddings.py
+# re-embeds old rows.
+EMBEDDING_MODEL_VERSION = f"{EMBEDDING_MODEL_NAME}+chunks1"
+
+# Words that usually sit next to the part of an output worth embedding
+_ERROR_MARKERS = re.compile(
+    r"error|exception|traceback|fatal|fail(?:ed|ure)?|denied|not found|cannot|could not|unable to"
+    r"|refused|timed? ?out|0x8[0-9a-f]{7}|exit code [1-9]|(?-i:ERR!)",
+    re.IGNORECASE,
+)
+
+# Only the last this-many chunks' worth of a long output is searched for markers
+_MARKER_SCAN_CHUNKS = 16
+
 _model: Optional[SentenceTransformer] = None
+_batcher: Optional[EmbeddingBatcher] = None
+_pool: Optional[EmbeddingWorkerPool] = None
+_pool_size = EMBEDDING_WORKERS
+# Batcher threads and request threads race to create the singletons below
+_init_lock = threading.Lock()
 
 
 def get_embedding_model() -> SentenceTransformer:
     """Lazy load the embedding model"""
     global _model
     if _model is None:
-        print(f"[EMBEDDINGS] Loading model: {EMBEDDING_MODEL_NAME}")
+        logger.info("Loading embedding model", extra={"fields": {"model": EMBEDDING_MODEL_NAME}})
         _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        print(f"[EMBEDDINGS] Model loaded successfully")
+        logger.info("Embedding model loaded", extra={"fields": {"model": EMBEDDING_MODEL_NAME}})
     return _model
 
 
+def encode_in_process() -> None:
+    """Ignore EMBEDDING_WORKERS here: for processes that are encode workers themselves."""
+    global _pool_size
+    _pool_size = 0
+
+
+def get_embedding_pool() -> Optional[EmbeddingWorkerPool]:
+    """Out-of-process worker pool when EMBEDDING_WORKERS > 0, else None."""
+    global _pool
+    with _init_lock:
+        if _pool is None and _pool_size > 0:
+            _pool = EmbeddingWorkerPool(_pool_size)
+        return _pool
+
+
+def _encode_texts(texts: List[str]) -> List[List[float]]:
+    """One encode call, in a worker process or here; only the batcher calls this."""
+    pool = get_embedding_pool()
+    model = get_embedding_model() if pool is None else None
+    start = time.perf_counter()
+    if pool is not None:
+        embeddings = pool.encode(texts)
+    else:
+        embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+    EMBEDDING_SECONDS.observe(time.perf_counter() - start)
+    EMBEDDING_BATCH_SIZE.observe(len(texts))
+    return embeddings.tolist()
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Process-wide micro-batcher in front of the model, created on first use."""
+    global _batcher
+    pool = get_embedding_pool()
+    with _init_lock:
+        if _batcher is None:
+            # One batch in flight per worker process
+            _batcher = EmbeddingBatcher(_encode_texts, concurrency=pool.size if pool is not None else 1)
+        return _batcher
+
+
+def _embed(texts: List[str]) -> List[List[float]]:
+    start = time.perf_counter()
+    vectors = get_embedding_batcher().encode_many(texts)
+    # Recorded here: the batcher's worker thread is outside the request context
+    record_timing("embed", time.perf_counter() - start)
+    return vectors
+
+
 def generate_embedding(text: str) -> List[float]:
     """
     Generate embedding for a given text.
@@ -32,12 +112,8 @@ def generate_embedding(text: str) -> List[float]:
     """
     if not text or not text.strip():
         # Return zero vector if text is empty
-        model = get_embedding_model()
-        return [0.0] * model.get_sentence_embedding_dimension()
-    
-    model = get_embedding_model()
-    embedding = model.encode(text, convert_to_numpy=True)
-    return embedding.tolist()
+        return [0.0] * get_embedding_dimension()
+    return _embed([text])[0]
 
 
 def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
@@ -52,14 +128,109 @@ def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
     if not texts:
         return []
-    
-    model = get_embedding_model()
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
-    return embeddings.tolist()
+    return _embed(texts)
 
 
 def get_embedding_dimension() -> int:
     """Get the dimension of the embeddings"""
+    pool = get_embedding_pool()
+    if pool is not None:
+        return pool.dimension()
     model = get_embedding_model()
     return model.get_sentence_embedding_dimension()
 
+
+# -----------------------------
+# MESSAGE EMBEDDINGS
+# -----------------------------
+def _error_windows(output: str, covered: int, budget: int, count: int) -> List[Tuple[int, int]]:
+    """Up to `count` non-overlapping (start, end) windows of `output` around its last error markers."""
+    windows: List[Tuple[int, int]] = []
+    # Errors sit near the end of long logs; scanning all of a 200 KB output costs more than encoding it
+    scan_from = max(covered, len(output) - _MARKER_SCAN_CHUNKS * budget)
+    for match in reversed(list(_ERROR_MARKERS.finditer(output, scan_from))):
+        if len(windows) >= count:
+            break
+        # A quarter of the window before the marker, the rest after it
+        start = min(max(match.start() - budget // 4, covered), max(len(output) - budget, covered))
+        # Begin on a line boundary when one is close
+        newline = output.find("\n", start, start + budget // 8)
+        if newline != -1:
+            start = newline + 1
+        end = start + budget
+        if any(start < w_end and w_start < end for w_start, w_end in windows):
+            continue
+        windows.append((start, end))
+    if not windows:
+        windows.append((max(len(output) - budget, covered), len(output)))
+    return sorted(windows)
+
+
+def embedding_inputs(
+    message: str,
+    command: Optional[str] = None,
+    command_output: Optional[str] = None,
+    max_chunks: int = EMBEDDING_MAX_CHUNKS,
+) -> List[str]:
+    """
+    Texts to encode for one stored message.
+
+    MiniLM reads at most 256 tokens, so anything longer is cut before the
+    tokenizer ever sees it. A short message is one text: content, command,
+    output. A long output becomes the head (content, command, start of the
+    output) plus up to `max_chunks` - 1 windows around the last error
+    markers in it, or its tail when there are none, so the error at the end
+    of a long log still counts. Each chunk costs a full encode; with
+    `max_chunks` 1 the head and the last error window share a single chunk.
+    """
+    head = f"{message} {command}" if command else message
+    output = command_output or ""
+    budget = EMBEDDING_CHUNK_CHARS
+    text = f"{head} {output}" if output else head
+    if len(text) <= budget or not output:
+        return [text[:budget]]
+
+    covered = max(budget - len(head) - 1, 0)  # output chars already in the first chunk
+    if covered >= len(output):
+        return [text[:budget]]
+
+    if max_chunks <= 1:
+        first = text[:budget // 3]
+        # Place the window by the space it actually gets, or the marker can fall past its end
+        window = budget - len(first) - 5
+        start, end = _error_windows(output, max(len(first) - len(head) - 1, 0), window, 1)[0]
+        return [f"{first}\n...\n{output[start:end]}"]
+
+    windows = _error_windows(output, covered, budget, max_chunks - 1)
+    return [text[:budget]] + [output[start:end] for start, end in windows]
+
+
+def generate_message_embeddings(items: Sequence[Tuple[str, Optional[str], Optional[str]]]) -> List[List[float]]:
+    """
+    Embeddings for (message, command, command_output) items. The chunks of
+    every item are encoded in one batch and mean-pooled per item.
+    """
+    if not items:
+        return []
+    chunked = [embedding_inputs(*item) for item in items]
+    for chunks in chunked:
+        EMBEDDING_INPUT_CHUNKS.observe(len(chunks))
+    flat = [chunk for chunks in chunked for chunk in chunks]
+    vectors = np.asarray(generate_embeddings_batch(flat), dtype=np.float32)
+
+    pooled = []
+    offset = 0
+    for chunks in chunked:
+        vector = vectors[offset:offset + len(chunks)].mean(axis=0)
+        offset += len(chunks)
+        norm = np.linalg.norm(vector)
+        # The model emits unit vectors; keep the pooled one unit length too
+        pooled.append((vector / norm if norm > 0 else vector).tolist())
+    return pooled
+
+
+def generate_message_embedding(
+    message: str, command: Optional[str] = None, command_output: Optional[str] = None
+) -> List[float]:
+    """Embedding of one stored message (see embedding_inputs)."""
+    return generate_message_embeddings([(message, command, command_output)])[0]
@@ -0,0 +1,295 @@
+"""
+Idempotency keys for the diagnose routes.
+
+The desktop client retries on network timeouts. Without a key, every retry
+re-inserts the user's messages and pays for another LLM call. A client that
+sends `Idempotency-Key: <uuid>` gets exactly one execution per (user, key):
+
+- the first request runs and its finished response (status and JSON body)
+  is kept for IDEMPOTENCY_TTL_SECONDS
+- a repeat arriving while the first is still running waits for it (up to
+  IDEMPOTENCY_WAIT_SECONDS, then 409) instead of starting its own
+- a repeat arriving later gets the stored response replayed, marked with
+  `Idempotent-Replayed: true`, without touching the LLM or storage writes
+- reusing a key for a different request body is a 422
+
+A route wraps replies that are not real answers ("busy, try again", LLM
+error fallbacks) in `NonCacheable`: they are returned, and shared with
+repeats already waiting, but never stored, so the next retry runs afresh.
+What the failed run already wrote (e.g. the user's message rows) can be
+described in `NonCacheable.resume`; that is stored instead, as a partial
+record, and handed to the next run of the same key so it does not write
+those rows again.
+
+Finished responses live in a process-local LRU and, when the storage
+backend is remote, in its `idempotency_keys` table
+(app/database/migrations/004_idempotency_keys.sql), so a retry that lands
+on another instance is replayed too. Waiting for an in-flight request only
+works within one instance. A request that fails with an exception stores
+nothing: its waiters see the same error, and the next retry runs afresh.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from app.config.config import (
+    IDEMPOTENCY_ENABLED,
+    IDEMPOTENCY_MAX_ENTRIES,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS,
+)
+from app.database.thread_service import ThreadService
+from app.services.metrics import IDEMPOTENCY_REQUESTS
+from app.utils.log import get_logger
+
+logger = get_logger("idempotency")
+
+# Longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 255
+
+# Expired rows are purged from storage once per this many stored responses
+_PURGE_EVERY = 500
+
+# status_code of a partial record: the run did not finish, `body` is its resume state
+_PARTIAL = 0
+
+
+class IdempotencyError(Exception):
+    """Raised when a keyed request cannot be run or replayed."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        # "conflict" (key reused for another request) or "in_progress" (wait timed out)
+        self.reason = reason
+
+
+class NonCacheable:
+    """
+    A reply `IdempotencyStore.run` returns but does not keep for replays.
+    `resume` (JSON-serialisable) is kept instead and passed to the next run.
+    """
+
+    __slots__ = ("result", "resume")
+
+    def __init__(self, result: Any, resume: Optional[Dict] = None):
+        self.result = result
+        self.resume = resume
+
+
+def request_fingerprint(route: str, payload: BaseModel) -> str:
+    """Hash of what was asked, to tell a retry from a reused key."""
+    return hashlib.sha256(f"{route}\0{payload.model_dump_json()}".encode("utf-8")).hexdigest()
+
+
+class _Stored:
+    __slots__ = ("fingerprint", "status_code", "body", "expires_at")
+
+    def __init__(self, fingerprint: str, status_code: int, body: bytes, expires_at: float):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.body = body
+        # time.time(), so rows read back from storage compare on the same clock
+        self.expires_at = expires_at
+
+    @property
+    def partial(self) -> bool:
+        return self.status_code == _PARTIAL
+
+    def resume(self) -> Dict:
+        return json.loads(self.body)
+
+
+class _Flight:
+    __slots__ = ("fingerprint", "future")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future: Future = Future()
+
+
+def _response_bytes(result: Any) -> Tuple[int, bytes]:
+    if isinstance(result, Response):
+        return result.status_code, bytes(result.body)
+    return 200, result.model_dump_json().encode("utf-8")
+
+
+def _replay(stored: _Stored) -> Response:
+    return Response(
+        content=stored.body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        enabled: bool = IDEMPOTENCY_ENABLED,
+        ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+    ):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.wait_seconds = wait_seconds
+        self._done: "OrderedDict[Tuple[str, str], _Stored]" = OrderedDict()
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+        self._saved = 0
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # completed responses
+    # -----------------------------
+    def _local(self, slot: Tuple[str, str]) -> Optional[_Stored]:
+        stored = self._done.get(slot)
+        if stored is None:
+            return None
+        if stored.expires_at <= time.time():
+            del self._done[slot]
+            return None
+        self._done.move_to_end(slot)
+        return stored
+
+    def _remember(self, slot: Tuple[str, str], stored: _Stored) -> None:
+        self._done[slot] = stored
+        self._done.move_to_end(slot)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    def _load(self, user_id: str, key: str) -> Optional[_Stored]:
+        row = ThreadService.get_idempotency_record(user_id, key)
+        if row is None:
+            return None
+        expires_at = datetime.fromisoformat(row["expires_at"].replace("Z", "+00:00")).timestamp()
+        if expires_at <= time.time():
+            return None
+        return _Stored(row["fingerprint"], int(row["status_code"]), row["body"].encode("utf-8"), expires_at)
+
+    def _save(self, user_id: str, key: str, stored: _Stored) -> None:
+        now = datetime.now(timezone.utc)
+        ThreadService.save_idempotency_record({
+            "user_id": user_id,
+            "key": key,
+            "fingerprint": stored.fingerprint,
+            "status_code": stored.status_code,
+            "body": stored.body.decode("utf-8"),
+            "created_at": now.isoformat(),
+            "expires_at": (now + timedelta(seconds=self.ttl_seconds)).isoformat(),
+        })
+        with self._lock:
+            self._saved += 1
+            purge = self._saved % _PURGE_EVERY == 0
+        if purge:
+            ThreadService.purge_idempotency_records(now.isoformat())
+
+    # -----------------------------
+    # requests
+    # -----------------------------
+    def run(
+        self,
+        user_id: str,
+        key: Optional[str],
+        fingerprint: str,
+        fn: Callable[[Optional[Dict]], Any],
+    ) -> Any:
+        """
+        `fn(resume)` once per (user_id, key); repeats get its response replayed.
+        `resume` is None, or the state an earlier transient run of this key left.
+        Without a key (or when disabled) `fn(None)` simply runs.
+        """
+        if not self.enabled or not key:
+            result = fn(None)
+            return result.result if isinstance(result, NonCacheable) else result
+
+        slot = (user_id, key)
+        with self._lock:
+            stored = self._local(slot)
+            done = stored if stored is not None and not stored.partial else None
+            flight = self._flights.get(slot) if done is None else None
+            leader = done is None and flight is None
+            if leader:
+                flight = self._flights[slot] = _Flight(fingerprint)
+
+        if done is not None:
+            return self._replay_checked(done, fingerprint, "replayed")
+        if not leader:
+            return self._join(flight, fingerprint)
+
+        keep = None
+        try:
+            if stored is None:
+                stored = self._load(user_id, key)
+            if stored is not None and not stored.partial:
+                flight.future.set_result(stored)
+                with self._lock:
+                    self._remember(slot, stored)
+                return self._replay_checked(stored, fingerprint, "replayed")
+            if stored is not None and stored.fingerprint != fingerprint:
+                IDEMPOTENCY_REQUESTS.labels(outcome="conflict").inc()
+                raise IdempotencyError("Idempotency-Key was already used for a different request", "conflict")
+
+            result = fn(stored.resume() if stored is not None else None)
+            cacheable = not isinstance(result, NonCacheable)
+            expires_at = time.time() + self.ttl_seconds
+            if not cacheable:
+                if result.resume is not None:
+                    keep = _Stored(fingerprint, _PARTIAL, json.dumps(result.resume).encode("utf-8"), expires_at)
+                result = result.result
+            status_code, body = _response_bytes(result)
+            stored = _Stored(fingerprint, status_code, body, expires_at)
+            if cacheable:
+                keep = stored
+            if keep is not None:
+                with self._lock:
+                    self._remember(slot, keep)
+            flight.future.set_result(stored)
+            IDEMPOTENCY_REQUESTS.labels(outcome="executed" if cacheable else "transient").inc()
+        except BaseException as e:
+            if not flight.future.done():
+                flight.future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(slot, None)
+
+        if keep is not None:
+            self._save(user_id, key, keep)
+        return result
+
+    def _join(self, flight: _Flight, fingerprint: str) -> Response:
+        if flight.fingerprint != fingerprint:
+            IDEMPOTENCY_REQUESTS.labels(outcome="conflict").inc()
+            raise IdempotencyError("Idempotency-Key was already used for a different request", "conflict")
+        try:
+            stored = flight.future.result(timeout=self.wait_seconds)
+        except FutureTimeoutError:
+            IDEMPOTENCY_REQUESTS.labels(outcome="timeout").inc()
+            logger.warning("Gave up waiting for in-flight idempotent request", extra={"fields": {"waited_seconds": self.wait_seconds}})
+            raise IdempotencyError("A request with this Idempotency-Key is still in progress", "in_progress")
+        return self._replay_checked(stored, fingerprint, "joined")
+
+    def _replay_checked(self, stored: _Stored, fingerprint: str, outcome: str) -> Response:
+        if stored.fingerprint != fingerprint:
+            IDEMPOTENCY_REQUESTS.labels(outcome="conflict").inc()
+            raise IdempotencyError("Idempotency-Key was already used for a different request", "conflict")
+        IDEMPOTENCY_REQUESTS.labels(outcome=outcome).inc()
+        logger.info("Replayed idempotent response", extra={"fields": {"outcome": outcome, "status": stored.status_code}})
+        return _replay(stored)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"enabled": self.enabled, "stored": len(self._done), "in_flight": len(self._flights)}
+
+
+idempotent_requests = IdempotencyStore()
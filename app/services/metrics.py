@@ -0,0 +1,368 @@
+"""
+Prometheus metrics for the API process.
+
+Exposed at /metrics (see run.py). Everything is registered on the default
+registry; the Dockerfile runs a single uvicorn worker so no multiprocess
+collector is needed.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Buckets tuned for the mix of ~10ms Supabase calls and multi-second LLM calls
+_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0,
+)
+
+
+# -----------------------------
+# HTTP
+# -----------------------------
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "glitch_http_requests_in_flight",
+    "HTTP requests currently being served",
+)
+
+DIAGNOSE_IN_FLIGHT = Gauge(
+    "glitch_diagnose_in_flight",
+    "Diagnose requests currently being processed",
+    ["route"],
+)
+
+WS_SESSIONS = Gauge(
+    "glitch_ws_sessions",
+    "Open /ws/diagnose WebSocket sessions",
+)
+
+WS_PERSIST_BACKLOG = Gauge(
+    "glitch_ws_persist_backlog",
+    "Messages from WebSocket sessions waiting to be written to storage",
+)
+
+
+# -----------------------------
+# DIAGNOSE PIPELINE
+# -----------------------------
+DIAGNOSE_STAGE_SECONDS = Histogram(
+    "glitch_diagnose_stage_seconds",
+    "Latency of each stage of the diagnose pipeline",
+    ["route", "stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+AUTH_SECONDS = Histogram(
+    "glitch_auth_seconds",
+    "Time spent resolving the current user (JWT decode + user lookup)",
+    buckets=_LATENCY_BUCKETS,
+)
+
+
+# -----------------------------
+# LLM
+# -----------------------------
+LLM_ATTEMPTS = Counter(
+    "glitch_llm_attempts_total",
+    "LLM generate_content attempts",
+    ["model", "outcome"],
+)
+
+LLM_ATTEMPT_SECONDS = Histogram(
+    "glitch_llm_attempt_seconds",
+    "Latency of individual LLM attempts",
+    ["model", "outcome"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+LLM_FALLBACKS = Counter(
+    "glitch_llm_fallbacks_total",
+    "Times custom_agent moved past an attempt (next_model) or gave up (error_response)",
+    ["kind"],
+)
+
+LLM_JSON_PARSE_FAILURES = Counter(
+    "glitch_llm_json_parse_failures_total",
+    "LLM responses that could not be parsed as JSON",
+    ["model"],
+)
+
+LLM_HEDGES = Counter(
+    "glitch_llm_hedges_total",
+    "Hedged LLM requests by result (primary_won, hedge_won, both_failed, budget_exhausted)",
+    ["result"],
+)
+
+LLM_HEDGE_DELAY_SECONDS = Histogram(
+    "glitch_llm_hedge_delay_seconds",
+    "Delay after which a hedge request was fired",
+    buckets=_LATENCY_BUCKETS,
+)
+
+LLM_CIRCUIT_STATE = Gauge(
+    "glitch_llm_circuit_state",
+    "Per-model circuit breaker state (0=closed, 1=half_open, 2=open)",
+    ["model"],
+)
+
+LLM_ADMISSION_QUEUE_DEPTH = Gauge(
+    "glitch_llm_admission_queue_depth",
+    "LLM calls waiting for upstream admission",
+)
+
+LLM_ADMISSION_WAIT_SECONDS = Histogram(
+    "glitch_llm_admission_wait_seconds",
+    "Time LLM calls waited for upstream admission",
+    buckets=_LATENCY_BUCKETS,
+)
+
+LLM_ADMISSION_REJECTED = Counter(
+    "glitch_llm_admission_rejected_total",
+    "LLM calls refused by upstream admission",
+    ["reason"],
+)
+
+LLM_UPSTREAM_IN_FLIGHT = Gauge(
+    "glitch_llm_upstream_in_flight",
+    "LLM calls currently in flight to the provider",
+)
+
+LLM_RATE_LIMITED = Counter(
+    "glitch_llm_rate_limited_total",
+    "429 responses received from the LLM provider",
+)
+
+LLM_COALESCED_WAITERS = Counter(
+    "glitch_llm_coalesced_waiters_total",
+    "LLM calls that waited on an identical in-flight call instead of running",
+    ["mode"],
+)
+
+LLM_COALESCE_GROUP_SIZE = Histogram(
+    "glitch_llm_coalesce_group_size",
+    "Callers served by one LLM call (leader plus coalesced waiters)",
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+LLM_COALESCE_IN_FLIGHT = Gauge(
+    "glitch_llm_coalesce_in_flight",
+    "Distinct LLM prompts currently in flight",
+)
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "glitch_idempotency_requests_total",
+    "Diagnose requests carrying an Idempotency-Key, by outcome "
+    "(executed, transient, replayed, joined, conflict, timeout)",
+    ["outcome"],
+)
+
+
+# -----------------------------
+# FAIR SCHEDULER
+# -----------------------------
+SCHED_QUEUE_DEPTH = Gauge(
+    "glitch_sched_queue_depth",
+    "Diagnose requests waiting for a fair-scheduler slot",
+    ["priority"],
+)
+
+SCHED_ACTIVE = Gauge(
+    "glitch_sched_active",
+    "Diagnose requests holding a fair-scheduler slot",
+    ["priority"],
+)
+
+SCHED_WAIT_SECONDS = Histogram(
+    "glitch_sched_wait_seconds",
+    "Time diagnose requests waited for a fair-scheduler slot",
+    ["priority"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+SCHED_REJECTED = Counter(
+    "glitch_sched_rejected_total",
+    "Diagnose requests rejected by the fair scheduler",
+    ["priority", "reason"],
+)
+
+
+# -----------------------------
+# CONVERSATION SUMMARIES
+# -----------------------------
+SUMMARY_FOLDS = Counter(
+    "glitch_summary_folds_total",
+    "Background folds of older turns into the rolling thread summary",
+    ["outcome"],
+)
+
+SUMMARY_FOLD_SECONDS = Histogram(
+    "glitch_summary_fold_seconds",
+    "Time to fold older turns into a thread summary",
+    buckets=_LATENCY_BUCKETS,
+)
+
+PROMPT_HISTORY_TOKENS = Histogram(
+    "glitch_prompt_history_tokens",
+    "Estimated tokens of the history section (summary plus recent window) per prompt",
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+
+
+# -----------------------------
+# COMMAND-OUTPUT COMPACTION
+# -----------------------------
+COMPACTION_RATIO = Histogram(
+    "glitch_compaction_ratio",
+    "Compacted size over original size, per command output",
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1.0),
+)
+
+COMPACTION_BYTES = Counter(
+    "glitch_compaction_chars_total",
+    "Characters of command output before (input) and after (output) compaction",
+    ["stage"],
+)
+
+COMPACTION_SECONDS = Histogram(
+    "glitch_compaction_seconds",
+    "Time to compact one command output",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+
+
+# -----------------------------
+# EMBEDDINGS
+# -----------------------------
+EMBEDDING_BATCH_SIZE = Histogram(
+    "glitch_embedding_batch_size",
+    "Number of texts per embedding encode call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+EMBEDDING_BATCH_REQUESTS = Histogram(
+    "glitch_embedding_batch_requests",
+    "Caller requests coalesced into one micro-batched encode",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+EMBEDDING_QUEUE_SECONDS = Histogram(
+    "glitch_embedding_queue_seconds",
+    "Time an embedding request waited in the micro-batcher before its encode started",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+EMBEDDING_QUEUED = Gauge(
+    "glitch_embedding_queued_texts",
+    "Texts waiting in the embedding micro-batcher",
+)
+
+EMBEDDING_WORKERS_BUSY = Gauge(
+    "glitch_embedding_workers_busy",
+    "Out-of-process embedding workers currently encoding a batch",
+)
+
+EMBEDDING_WORKER_RESTARTS = Counter(
+    "glitch_embedding_worker_restarts_total",
+    "Embedding worker processes respawned, by reason (crash, timeout)",
+    ["reason"],
+)
+
+EMBEDDING_INPUT_CHUNKS = Histogram(
+    "glitch_embedding_input_chunks",
+    "Chunks encoded and mean-pooled per stored message",
+    buckets=(1, 2, 3, 4, 6, 8),
+)
+
+EMBEDDING_SECONDS = Histogram(
+    "glitch_embedding_seconds",
+    "Duration of embedding encode calls",
+    buckets=_LATENCY_BUCKETS,
+)
+
+
+# -----------------------------
+# SUPABASE
+# -----------------------------
+SUPABASE_CALL_SECONDS = Histogram(
+    "glitch_supabase_call_seconds",
+    "Latency of Supabase calls",
+    ["table", "operation", "outcome"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+
+# -----------------------------
+# PER-REQUEST TIMINGS (Server-Timing header)
+# -----------------------------
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Begin collecting db/embed/llm seconds for the current request context."""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_timing(category: str, seconds: float) -> None:
+    """Add to the current request's timing bucket (no-op outside a request)."""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[category] = timings.get(category, 0.0) + seconds
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Render e.g. `db;dur=12.3, embed;dur=4.0, llm;dur=812.5, total;dur=840.1`."""
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# -----------------------------
+# HELPERS
+# -----------------------------
+@contextmanager
+def stage_timer(route: str, stage: str, timing: Optional[str] = None) -> Iterator[None]:
+    """Observe the wall time of one diagnose pipeline stage (and optionally a Server-Timing bucket)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        DIAGNOSE_STAGE_SECONDS.labels(route=route, stage=stage).observe(elapsed)
+        if timing:
+            record_timing(timing, elapsed)
+
+
+@contextmanager
+def supabase_timer(table: str, operation: str) -> Iterator[None]:
+    """Observe one Supabase round trip, labelled ok/error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        SUPABASE_CALL_SECONDS.labels(table=table, operation=operation, outcome=outcome).observe(elapsed)
+        record_timing("db", elapsed)
+
+
+class InFlightMiddleware:
+    """Pure ASGI middleware tracking in-flight HTTP requests."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
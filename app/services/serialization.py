@@ -0,0 +1,63 @@
+"""
+Fast JSON responses for history-heavy endpoints.
+
+Returning a `DiagnoseResponse` (or a list of `HistoryEntry`) from a route
+makes FastAPI dump it to dicts, validate those again against
+`response_model`, and encode the result with the stdlib json module. With
+100 messages carrying large command outputs, that second validation and
+encode costs more CPU than the rest of the request.
+
+Routes on the fast path build plain dicts from the history entries (which
+`ThreadService` constructs from the raw storage rows without validation)
+and return a `FastJSONResponse`. FastAPI passes a returned Response through
+untouched, so the only work left is one orjson encode. `response_model`
+stays on the routes for the OpenAPI schema. The bytes match the validated
+path (UTC timestamps end in "Z", like pydantic's), so clients see no
+difference. FAST_JSON_ENABLED=false switches back to the validated path.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import orjson
+from fastapi.responses import Response
+
+from app.agent.schema import HistoryEntry
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        # OPT_UTC_Z: "...+00:00" -> "...Z", as pydantic serializes aware UTC datetimes
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+def history_items(entries: Sequence[HistoryEntry]) -> List[Dict]:
+    """`HistoryEntry` JSON objects, read straight off the attributes (no model_dump)."""
+    return [
+        {
+            "timestamp": entry.timestamp,
+            "message": entry.message,
+            "command": entry.command,
+            "command_output": entry.command_output,
+        }
+        for entry in entries
+    ]
+
+
+def diagnose_payload(
+    message: str,
+    next_step: str,
+    thread_id: str,
+    history: Sequence[HistoryEntry],
+    commands: Optional[List[str]] = None,
+) -> Dict:
+    """`DiagnoseResponse` as a plain dict, fields in declaration order."""
+    return {
+        "message": message,
+        "command": commands[0] if commands else None,
+        "next_step": next_step,
+        "commands": commands or None,
+        "session_id": thread_id,
+        "thread_id": thread_id,
+        "history": history_items(history),
+    }
@@ -0,0 +1,166 @@
+"""
+Compact serialization of message embeddings.
+
+A 384-d embedding sent as a JSON list of Python floats is ~8 KB of text per
+message. EMBEDDING_FORMAT picks what `message_embeddings` rows carry instead:
+
+- float32  JSON list in `embedding` (the original format)
+- halfvec  pgvector halfvec text literal in `embedding`, values rounded to
+           float16 precision (needs `embedding halfvec(N)`)
+- float16  base64 little-endian float16 in `embedding_packed`
+- int8     base64 of a float32 scale followed by int8 codes, in `embedding_packed`
+           (per-vector symmetric quantisation: x ~= code * scale)
+
+With EMBEDDING_PCA_PATH set, vectors are first projected onto a PCA basis
+fitted offline (app/scripts/fit_embedding_pca.py) and re-normalised, e.g.
+384 -> 128 dimensions. Queries must go through `project` the same way.
+
+Each row records `embedding_format`, e.g. "int8+pca128-1a2b3c4d". Null
+means float32: rows written before the column existed, and rows written
+with the default format, which leaves the column out so deployments that
+never change EMBEDDING_FORMAT need no schema change. The other formats need
+app/database/migrations/001_message_embeddings_versioning.sql. A PCA basis
+with float32 or halfvec stores the projected (e.g. 128-d) vector in
+`embedding`, so that column's dimension must be changed to match.
+See benchmarks/bench_vector_codec.py for recall@k of each option.
+"""
+import base64
+import hashlib
+import json
+import struct
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from app.config.config import EMBEDDING_FORMAT, EMBEDDING_PCA_PATH
+from app.utils.log import get_logger
+
+logger = get_logger("embeddings")
+
+FORMATS = ("float32", "halfvec", "float16", "int8")
+LEGACY_FORMAT = "float32"
+
+
+# -----------------------------
+# PCA PROJECTION
+# -----------------------------
+class Projection:
+    """Mean-centred linear projection onto the top principal components."""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = mean.astype(np.float32)
+        # (out_dim, in_dim)
+        self.components = components.astype(np.float32)
+        digest = hashlib.sha256(self.mean.tobytes() + self.components.tobytes()).hexdigest()
+        self.id = f"pca{self.components.shape[0]}-{digest[:8]}"
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        projected = (vectors - self.mean) @ self.components.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dim: int) -> "Projection":
+        vectors = np.asarray(vectors, dtype=np.float64)
+        mean = vectors.mean(axis=0)
+        # Rows of vt are the principal directions, largest variance first
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(mean, vt[:dim])
+
+    def save(self, path: str) -> None:
+        np.savez(path, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        with np.load(path) as data:
+            return cls(data["mean"], data["components"])
+
+
+# -----------------------------
+# ENCODINGS
+# -----------------------------
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _encode_int8(vector: np.ndarray) -> str:
+    peak = float(np.abs(vector).max())
+    scale = peak / 127.0 if peak > 0 else 1.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return _b64(struct.pack("<f", scale) + codes.tobytes())
+
+
+def _decode_int8(payload: str) -> np.ndarray:
+    raw = base64.b64decode(payload)
+    (scale,) = struct.unpack("<f", raw[:4])
+    return np.frombuffer(raw[4:], dtype=np.int8).astype(np.float32) * scale
+
+
+def _halfvec_literal(vector: np.ndarray) -> str:
+    # Rounding to float16 first keeps the shortest float reprs short
+    values = np.round(vector.astype(np.float16).astype(np.float64), 5)
+    return json.dumps(values.tolist(), separators=(",", ":"))
+
+
+class VectorCodec:
+    def __init__(self, fmt: str = LEGACY_FORMAT, projection: Optional[Projection] = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown embedding format {fmt!r}; expected one of {', '.join(FORMATS)}")
+        self.format = fmt
+        self.projection = projection
+
+    @property
+    def version(self) -> str:
+        """Stored per row so old and new encodings can coexist (and the backfill can find stale ones)."""
+        return f"{self.format}+{self.projection.id}" if self.projection is not None else self.format
+
+    def project(self, vector: Sequence[float]) -> np.ndarray:
+        """Vector in the stored space: projected when a PCA basis is configured."""
+        vector = np.asarray(vector, dtype=np.float32)
+        return self.projection.apply(vector) if self.projection is not None else vector
+
+    def encode(self, vector: Sequence[float]) -> Dict:
+        """`message_embeddings` columns for one embedding."""
+        vector = self.project(vector)
+        if self.format == "float32":
+            fields = {"embedding": vector.tolist()}
+        elif self.format == "halfvec":
+            fields = {"embedding": _halfvec_literal(vector)}
+        elif self.format == "float16":
+            fields = {"embedding": None, "embedding_packed": _b64(vector.astype("<f2").tobytes())}
+        else:
+            fields = {"embedding": None, "embedding_packed": _encode_int8(vector)}
+        if self.version != LEGACY_FORMAT:
+            fields["embedding_format"] = self.version
+        return fields
+
+
+def decode(row: Dict) -> np.ndarray:
+    """Float32 vector from a stored row, whatever format wrote it."""
+    fmt = (row.get("embedding_format") or LEGACY_FORMAT).split("+", 1)[0]
+    if fmt == "float16":
+        return np.frombuffer(base64.b64decode(row["embedding_packed"]), dtype="<f2").astype(np.float32)
+    if fmt == "int8":
+        return _decode_int8(row["embedding_packed"])
+    embedding = row["embedding"]
+    if isinstance(embedding, str):
+        # halfvec / vector columns come back as text literals
+        embedding = embedding.strip("[]").split(",")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+_codec: Optional[VectorCodec] = None
+
+
+def get_vector_codec() -> VectorCodec:
+    """Codec for EMBEDDING_FORMAT / EMBEDDING_PCA_PATH, built on first use."""
+    global _codec
+    if _codec is None:
+        projection = Projection.load(EMBEDDING_PCA_PATH) if EMBEDDING_PCA_PATH else None
+        _codec = VectorCodec(EMBEDDING_FORMAT, projection)
+        logger.info("Embedding codec selected", extra={"fields": {"format": _codec.version}})
+    return _codec
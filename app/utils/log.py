@@ -0,0 +1,99 @@
+"""
+Structured, non-blocking logging.
+
+Request threads only push records onto an in-memory queue (QueueHandler);
+a single background QueueListener thread formats them and writes to
+stdout. Cloud Run picks up the JSON lines as structured logs with the
+right severity.
+
+Verbose payloads (raw LLM responses, parsed model output) go through
+`log_payload`, which only emits at DEBUG, samples at LOG_PAYLOAD_SAMPLE_RATE
+and truncates to LOG_PAYLOAD_MAX_CHARS.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from app.config.config import LOG_FORMAT, LOG_LEVEL, LOG_PAYLOAD_MAX_CHARS, LOG_PAYLOAD_SAMPLE_RATE
+
+_ROOT = "glitch"
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, using Cloud Logging field names."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+def setup_logging() -> None:
+    """Install the queue handler on the `glitch` logger (idempotent)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        root = logging.getLogger(_ROOT)
+        root.setLevel(LOG_LEVEL.upper())
+        root.addHandler(QueueHandler(log_queue))
+        root.propagate = False
+
+        _listener = QueueListener(log_queue, stream, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the `glitch` namespace, e.g. get_logger("agent")."""
+    setup_logging()
+    return logging.getLogger(f"{_ROOT}.{name}")
+
+
+def log_payload(logger: logging.Logger, event: str, payload: Any, **fields: Any) -> None:
+    """Log a large payload at DEBUG, sampled and truncated."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if LOG_PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    fields["payload"] = text[:LOG_PAYLOAD_MAX_CHARS]
+    fields["payload_chars"] = len(text)
+    logger.debug(event, extra={"fields": fields})
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Size and time of command-output compaction (app/services/compaction.py) on
+synthetic outputs shaped like what clients post back: npm/pip installs,
+an event-log dump, PowerShell tables, stack traces.
+
+Usage:
+  python -m benchmarks.bench_compaction [--repeat 20]
+"""
+import argparse
+import time
+from typing import Dict
+
+from app.agent.admission import estimate_tokens
+from app.services.compaction import OutputCompactor
+
+
+def samples() -> Dict[str, str]:
+    npm = (
+        "\x1b[32mnpm\x1b[0m http fetch GET 200 https://registry.npmjs.org/pkg 12ms (cache hit)\n" * 400
+        + "".join(f"\r[{'#' * i}{'.' * (20 - i)}] \\ reify: timing {i * 5}%" for i in range(21))
+        + "\nnpm WARN deprecated inflight@1.0.6: This module is not supported\nadded 812 packages in 14s\n"
+    )
+    pip = (
+        "".join(f"Requirement already satisfied: pkg{i} in c:\\python312\\lib\\site-packages (1.{i})\n" for i in range(80))
+        + "".join(f"Collecting dep{i}\n  Downloading dep{i}-2.0-py3-none-any.whl (120 kB)\n"
+                  f"     ━━━━━━━━━━━━━━━━━━━━ 120.0/120.0 kB 3.2 MB/s eta 0:00:00\n" for i in range(40))
+        + "ERROR: Could not build wheels for lxml, which is required to install pyproject.toml-based projects\n"
+    )
+    eventlog = "".join(
+        f"Error        10/18/2026 3:{i % 60:02d}:11 PM  DCOM                   10016  "
+        f"The application-specific permission settings do not grant Local Activation permission {i}\n"
+        for i in range(3000)
+    )
+    table = "Name                           Status     DisplayName\n" \
+            "----                           ------     -----------\n" + "".join(
+                f"Svc{i:<27d} {'Running' if i % 3 else 'Stopped':10s} Some Windows Service {i}\n" for i in range(150)
+            )
+    traceback = "Traceback (most recent call last):\n" + "".join(
+        f'  File "c:\\app\\module{i}.py", line {i * 7}, in handler{i}\n    return next_handler{i}(request)\n'
+        for i in range(40)
+    ) + "ConnectionResetError: [WinError 10054] An existing connection was forcibly closed by the remote host\n"
+    return {"npm install": npm, "pip install": pip, "event log": eventlog, "Get-Service": table, "traceback": traceback}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    compactor = OutputCompactor(enabled=True)
+    print(f"{'output':12s} {'chars in':>9s} {'chars out':>10s} {'ratio':>7s} {'tokens in':>10s} {'tokens out':>11s} {'ms':>7s}")
+    for name, text in samples().items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out = compactor.compact(text)
+        ms = 1000 * (time.perf_counter() - start) / args.repeat
+        print(f"{name:12s} {len(text):9d} {len(out):10d} {len(out) / len(text):7.3f} "
+              f"{estimate_tokens(text):10d} {estimate_tokens(out):11d} {ms:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
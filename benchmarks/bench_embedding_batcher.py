@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Concurrent single-text embedding requests with and without the micro-batcher
+(app/services/embedding_batcher.py): throughput and per-request latency for
+1..N caller threads, as when many add_message calls run in the threadpool.
+
+Uses the real all-MiniLM-L6-v2 when it can be loaded, otherwise the
+MiniLM-shaped random model from bench_embedding_input.
+
+Usage:
+  python -m benchmarks.bench_embedding_batcher [--requests 256] [--max-wait-ms 5]
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from app.services import embeddings
+from app.services.embedding_batcher import EmbeddingBatcher
+from benchmarks.bench_embedding_input import _log, _offline_model
+
+
+def _run(batcher: EmbeddingBatcher, texts: List[str], threads: int) -> Tuple[float, float, float]:
+    """(requests/s, p50 ms, p95 ms)"""
+    latencies: List[float] = []
+
+    def one(text: str) -> None:
+        start = time.perf_counter()
+        batcher.encode_many([text])
+        latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, texts))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return (
+        len(texts) / elapsed,
+        1000 * statistics.median(latencies),
+        1000 * latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--max-items", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    try:
+        embeddings.get_embedding_model()
+        source = embeddings.EMBEDDING_MODEL_NAME
+    except Exception as e:
+        print(f"{embeddings.EMBEDDING_MODEL_NAME} unavailable ({type(e).__name__}); using a MiniLM-shaped random model")
+        embeddings._model = _offline_model()
+        source = "minilm-shaped"
+
+    texts = [_log(600, seed) for seed in range(args.requests)]
+    per_call = EmbeddingBatcher(embeddings._encode_texts, enabled=False)
+    batched = EmbeddingBatcher(embeddings._encode_texts, max_items=args.max_items, max_wait_ms=args.max_wait_ms)
+    per_call.encode_many(texts[:8])
+
+    print(f"model={source} requests={args.requests} max_items={args.max_items} max_wait_ms={args.max_wait_ms}")
+    print(f"{'threads':>7s} | {'per-call req/s':>14s} {'p50 ms':>8s} {'p95 ms':>8s} | "
+          f"{'batched req/s':>13s} {'p50 ms':>8s} {'p95 ms':>8s} {'batch p50':>9s}")
+    for threads in (1, 4, 16, 32, 64):
+        plain = _run(per_call, texts, threads)
+        batched._recent.clear()
+        coalesced = _run(batched, texts, threads)
+        size = batched.snapshot()["batch_size"].get("p50", 0)
+        print(f"{threads:7d} | {plain[0]:14.1f} {plain[1]:8.1f} {plain[2]:8.1f} | "
+              f"{coalesced[0]:13.1f} {coalesced[1]:8.1f} {coalesced[2]:8.1f} {size:9d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Embedding encode time against command-output length: the whole concatenated
+message passed to the model (what add_message used to do) vs the
+length-aware input builder (app/services/embeddings.py: text capped before
+tokenizing, chunks around error markers, one batch, mean-pooled) with 1, 2
+and 3 chunks per message.
+
+Uses the real all-MiniLM-L6-v2 when it can be loaded. Otherwise it uses a
+randomly initialised model of the same shape (6 layers, 384 hidden, 256
+max tokens) with a WordPiece vocabulary trained on the synthetic logs.
+Timings then match the real architecture; the vectors are meaningless.
+
+Usage:
+  python -m benchmarks.bench_embedding_input [--repeat 5]
+"""
+import argparse
+import random
+import tempfile
+import time
+from typing import Callable, List
+
+from app.services import embeddings
+
+
+def _log(chars: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines: List[str] = []
+    size = 0
+    while size < chars:
+        line = (f"{time.strftime('%H:%M:%S')} [{rng.randint(1000, 9999)}] Downloading package-{rng.randint(1, 500)} "
+                f"({rng.randint(10, 900)} kB) from https://registry.example.org/p/{rng.randint(1, 10 ** 6)}")
+        lines.append(line)
+        size += len(line) + 1
+    lines.append("npm ERR! code EACCES: permission denied, mkdir '/usr/lib/node_modules/pkg'")
+    return "\n".join(lines)[-chars:]
+
+
+def _offline_model():
+    from sentence_transformers import SentenceTransformer, models
+    from tokenizers import BertWordPieceTokenizer
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    directory = tempfile.mkdtemp(prefix="minilm-shaped-")
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator([_log(20000, seed) for seed in range(20)], vocab_size=8000)
+    BertTokenizerFast(tokenizer_object=wordpiece._tokenizer, model_max_length=256).save_pretrained(directory)
+    BertModel(BertConfig(
+        vocab_size=wordpiece.get_vocab_size(), hidden_size=384, num_hidden_layers=6,
+        num_attention_heads=12, intermediate_size=1536, max_position_embeddings=512,
+    )).save_pretrained(directory)
+    transformer = models.Transformer(directory, max_seq_length=256)
+    return SentenceTransformer(modules=[transformer, models.Pooling(384, "mean"), models.Normalize()])
+
+
+def _time(fn: Callable[[], object], repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        embeddings.get_embedding_model()
+        source = embeddings.EMBEDDING_MODEL_NAME
+    except Exception as e:
+        print(f"{embeddings.EMBEDDING_MODEL_NAME} unavailable ({type(e).__name__}); using a MiniLM-shaped random model")
+        embeddings._model = _offline_model()
+        source = "minilm-shaped"
+
+    model = embeddings.get_embedding_model()
+    message, command = "Command output for: npm install -g pkg", "npm install -g pkg"
+
+    def build(output: str, max_chunks: int):
+        chunks = embeddings.embedding_inputs(message, command, output, max_chunks=max_chunks)
+        return model.encode(chunks, convert_to_numpy=True).mean(axis=0)
+
+    print(f"model={source} chunk chars={embeddings.EMBEDDING_CHUNK_CHARS}")
+    print(f"{'output chars':>12s} {'whole text ms':>14s} {'1 chunk ms':>11s} {'2 chunks ms':>12s} {'3 chunks ms':>12s}")
+    for chars in (200, 1000, 5000, 20000, 100000, 200000):
+        output = _log(chars)
+        whole = _time(lambda: model.encode(f"{message} {command} {output}", convert_to_numpy=True), args.repeat)
+        built = [_time(lambda: build(output, k), args.repeat) for k in (1, 2, 3)]
+        print(f"{chars:12d} {whole:14.1f} {built[0]:11.1f} {built[1]:12.1f} {built[2]:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
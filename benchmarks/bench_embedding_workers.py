@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Latency of unrelated request work while embeddings are being encoded: the
+model inside the API process vs the EMBEDDING_WORKERS process pool
+(app/services/embedding_pool.py).
+
+A background thread keeps submitting bursts of add_message-sized texts.
+Meanwhile the main thread repeatedly does what a history endpoint does
+(build and JSON-encode 100 messages) and records how long each takes.
+
+The workers load the model by name, so all-MiniLM-L6-v2 must be loadable
+(cached, or a local directory of that name in the working directory).
+
+Usage:
+  python -m benchmarks.bench_embedding_workers [--seconds 10] [--workers 1 2]
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from typing import Dict, List
+
+from app.services import embeddings
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_pool import EmbeddingWorkerPool
+from benchmarks.bench_embedding_input import _log
+
+
+def _history_response() -> str:
+    rows = [
+        {"id": str(i), "role": "assistant" if i % 2 else "user", "message": f"step {i}", "command": "npm install",
+         "command_output": _log(2000, i), "timestamp": "2026-01-01T00:00:00+00:00"}
+        for i in range(100)
+    ]
+    return json.dumps({"thread_id": "t", "messages": rows})
+
+
+def _measure(seconds: float, encode=None, burst: int = 16) -> Dict[str, float]:
+    stop = threading.Event()
+    encoded = [0]
+    texts = [_log(1000, seed) for seed in range(burst)]
+
+    def load() -> None:
+        while not stop.is_set():
+            encode(texts)
+            encoded[0] += len(texts)
+
+    loader = threading.Thread(target=load, daemon=True) if encode is not None else None
+    if loader is not None:
+        loader.start()
+        time.sleep(0.5)
+
+    latencies: List[float] = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        _history_response()
+        latencies.append(1000 * (time.perf_counter() - start))
+    stop.set()
+    if loader is not None:
+        loader.join()
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(0.95 * len(latencies))],
+        "p99": latencies[int(0.99 * len(latencies))],
+        "embeds_per_s": encoded[0] / seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--torch-threads", type=int, default=1)
+    args = parser.parse_args()
+
+    modes = {"no embedding load": None}
+    in_process = EmbeddingBatcher(embeddings._encode_texts, enabled=False)
+    embeddings.get_embedding_model()
+    modes["in-process model"] = in_process.encode_many
+    pools = []
+    for size in args.workers:
+        pool = EmbeddingWorkerPool(size, args.torch_threads)
+        pool.start()
+        pools.append(pool)
+        batcher = EmbeddingBatcher(pool.encode, enabled=False)
+        modes[f"{size} worker process(es)"] = batcher.encode_many
+
+    print(f"{'mode':>24s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'embeds/s':>9s}")
+    try:
+        for name, encode in modes.items():
+            r = _measure(args.seconds, encode)
+            print(f"{name:>24s} {r['p50']:8.1f} {r['p95']:8.1f} {r['p99']:8.1f} {r['embeds_per_s']:9.1f}")
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+History-section size per turn on a long thread: rolling summary plus recent
+window (app/agent/summarizer.py) vs rendering the whole thread verbatim.
+
+Drives /diagnose/continue in-process against the load-test fakes. The fake
+LLM answers fold prompts with a fixed-size summary, so the numbers show
+prompt growth, not summary quality.
+
+Usage:
+  python -m benchmarks.bench_prompt_growth [--turns 40] [--output-chars 800]
+"""
+import argparse
+import json
+import os
+import time
+from typing import List, Tuple
+
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+os.environ.setdefault("GEMINI_API_KEY", "bench-fake-key")
+os.environ["SUPABASE_URL"] = ""
+os.environ["SUPABASE_KEY"] = ""
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import run  # noqa: E402
+from app.agent import agents  # noqa: E402
+from app.agent.admission import estimate_tokens  # noqa: E402
+from app.database.thread_service import ThreadService  # noqa: E402
+from app.routes import route  # noqa: E402
+from benchmarks.loadtest.fakes import FakeLLMConfig, install_fakes, seed_users  # noqa: E402
+
+
+class _Reply:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _install(summary_words: int) -> None:
+    db = install_fakes(
+        llm_config=FakeLLMConfig(latency_ms=5, latency_sigma=0.0, tail_rate=0.0, error_rate=0.0,
+                                 invalid_json_rate=0.0, command_rate=1.0, seed=1),
+        db_latency_ms=0.5,
+        embedding_latency_ms=0.0,
+        real_embeddings=False,
+    )
+    seed_users(db, 1, "pw")
+    generate = agents._client.models.generate_content
+
+    def with_summaries(model, contents, **kwargs):
+        if "running summary" in contents:
+            return _Reply(json.dumps({"summary": " ".join(["finding"] * summary_words)}))
+        return generate(model=model, contents=contents, **kwargs)
+
+    agents._client.models.generate_content = with_summaries
+
+
+def run_thread(client: TestClient, turns: int, output_chars: int) -> Tuple[List[int], List[int]]:
+    token = client.post("/auth/login", json={"email": "load0@example.com", "password": "pw"}).json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    thread_id = client.post("/diagnose", json={"problem": "VPN drops every few minutes"}, headers=headers).json()["thread_id"]
+
+    sizes = []
+    full = []
+    for turn in range(turns):
+        client.post(
+            "/diagnose/continue",
+            json={"thread_id": thread_id, "command": f"check-{turn}", "command_output": "o" * output_chars},
+            headers=headers,
+        )
+        # Let a scheduled fold land before measuring the next prompt
+        time.sleep(0.05)
+        sizes.append(estimate_tokens(route._render_history_section(thread_id)))
+        everything = ThreadService.get_recent_messages(thread_id, limit=10000)
+        full.append(estimate_tokens(route._format_history(everything)))
+    return sizes, full
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--output-chars", type=int, default=800)
+    parser.add_argument("--summary-words", type=int, default=150)
+    args = parser.parse_args()
+
+    _install(args.summary_words)
+    with TestClient(run.app) as client:
+        summarized, full = run_thread(client, args.turns, args.output_chars)
+
+    print(f"{'turn':>5s} {'summary+window':>15s} {'full thread':>12s}   (history-section tokens)")
+    for turn in range(0, args.turns, max(args.turns // 10, 1)):
+        print(f"{turn + 1:5d} {summarized[turn]:15d} {full[turn]:12d}")
+    print(f"last turn: {summarized[-1]} vs {full[-1]} tokens; max with summary {max(summarized)}")
+
+
+if __name__ == "__main__":
+    main()
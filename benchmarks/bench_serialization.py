@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Per-response CPU time of a diagnose reply by history size: the validated
+path (HistoryEntry models -> DiagnoseResponse -> FastAPI response_model
+re-validation -> stdlib json) vs the fast path (app/services/serialization.py:
+unvalidated entries -> dicts -> orjson).
+
+Both run through a real FastAPI route via TestClient. An empty route gives
+the fixed per-request overhead, which is subtracted. The script checks that
+both paths produce the same bytes before timing them.
+
+Usage:
+  python -m benchmarks.bench_serialization [--output-chars 4000] [--repeat 50]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from app.agent.schema import DiagnoseResponse, HistoryEntry
+from app.database.thread_service import _row_to_entry
+from app.services.serialization import FastJSONResponse, diagnose_payload
+
+
+def _rows(count: int, output_chars: int) -> List[Dict]:
+    rng = random.Random(count)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        user = i % 2 == 0
+        rows.append({
+            "role": "user" if user else "assistant",
+            "content": f"Command output for: step {i}" if user else f"Try the next check for step {i}.",
+            "command": f"Get-Service -Name svc{i}",
+            "command_output": "".join(rng.choice("abcdefghij \n") for _ in range(output_chars)) if user else None,
+            "created_at": (start + timedelta(seconds=i, microseconds=rng.randint(0, 999999))).isoformat(),
+        })
+    return rows
+
+
+def _validated_entry(row: Dict) -> HistoryEntry:
+    """_row_to_entry as it was before the fast path: a validating constructor."""
+    entry = _row_to_entry(row)
+    return HistoryEntry(**dict(entry))
+
+
+def _app(rows: List[Dict]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/empty")
+    def empty():
+        return Response(b"{}", media_type="application/json")
+
+    @app.get("/validated", response_model=DiagnoseResponse)
+    def validated():
+        history = [_validated_entry(row) for row in rows]
+        return DiagnoseResponse(
+            message="Run the next command", command="ipconfig /all", next_step="command",
+            commands=["ipconfig /all"], session_id="t", thread_id="t", history=history,
+        )
+
+    @app.get("/fast", response_model=DiagnoseResponse)
+    def fast():
+        history = [_row_to_entry(row) for row in rows]
+        return FastJSONResponse(diagnose_payload("Run the next command", "command", "t", history, ["ipconfig /all"]))
+
+    return app
+
+
+def _cpu_ms(client: TestClient, path: str, repeat: int) -> float:
+    client.get(path)
+    start = time.process_time()
+    for _ in range(repeat):
+        client.get(path)
+    return 1000 * (time.process_time() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output-chars", type=int, default=4000, help="command output size on user messages")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"command output chars={args.output_chars}, CPU ms per response (per-request overhead subtracted)")
+    print(f"{'messages':>8s} {'body KB':>8s} {'validated':>10s} {'fast':>8s} {'speedup':>8s}")
+    for count in (10, 25, 50, 100, 200):
+        client = TestClient(_app(_rows(count, args.output_chars)))
+        slow_body, fast_body = client.get("/validated").content, client.get("/fast").content
+        assert slow_body == fast_body, "fast path output differs from the validated path"
+        base = _cpu_ms(client, "/empty", args.repeat)
+        slow = _cpu_ms(client, "/validated", args.repeat) - base
+        fast = _cpu_ms(client, "/fast", args.repeat) - base
+        print(f"{count:8d} {len(fast_body) / 1024:8.0f} {slow:10.2f} {fast:8.2f} {slow / max(fast, 1e-6):7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
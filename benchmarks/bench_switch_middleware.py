@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: requests/second on /health through the server switch.
+
+Compares the old `@app.middleware("http")` switch (BaseHTTPMiddleware) with
+the pure ASGI `ServerSwitchMiddleware` from run.py. Requests are driven
+straight into the ASGI app (no sockets), so the numbers isolate framework
+and middleware overhead.
+
+Usage:
+  python benchmarks/bench_switch_middleware.py [--requests 20000] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from run import ServerSwitchMiddleware
+
+
+def _add_cors(app: FastAPI) -> None:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000"],
+        allow_origin_regex=r".*",
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+def _add_health(app: FastAPI) -> None:
+    @app.get("/health")
+    def health() -> dict:
+        return {"status": "healthy"}
+
+
+def build_legacy_app() -> FastAPI:
+    """The switch as it was before: a BaseHTTPMiddleware function."""
+    app = FastAPI()
+    app.state.server_enabled = True
+    _add_cors(app)
+
+    @app.middleware("http")
+    async def switch_middleware(request: Request, call_next):
+        if request.method == "OPTIONS":
+            return await call_next(request)
+        switch_param = request.query_params.get("switch")
+        if switch_param is not None:
+            value = switch_param.strip().lower()
+            if value in {"true", "false"}:
+                request.app.state.server_enabled = (value == "true")
+                return JSONResponse({
+                    "message": "server switch updated",
+                    "server_enabled": request.app.state.server_enabled
+                })
+            return JSONResponse(
+                {"error": "invalid switch value; use true or false"},
+                status_code=400
+            )
+        if not request.app.state.server_enabled:
+            return JSONResponse({"error": "server is currently disabled"}, status_code=503)
+        return await call_next(request)
+
+    _add_health(app)
+    return app
+
+
+def build_asgi_app() -> FastAPI:
+    app = FastAPI()
+    app.state.server_enabled = True
+    _add_cors(app)
+    app.add_middleware(ServerSwitchMiddleware)
+    _add_health(app)
+    return app
+
+
+async def _one_request(app) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/health",
+        "raw_path": b"/health",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+    sent_request = False
+    status = 0
+
+    async def receive():
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def _drive(app, total: int, concurrency: int) -> float:
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            status = await _one_request(app)
+            assert status == 200, status
+
+    # Warm up (route compilation, threadpool spin-up)
+    for _ in range(200):
+        await _one_request(app)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    results = {}
+    for name, builder in (("before (BaseHTTPMiddleware)", build_legacy_app), ("after (pure ASGI)", build_asgi_app)):
+        rps = asyncio.run(_drive(builder(), args.requests, args.concurrency))
+        results[name] = rps
+        print(f"{name:30s} {rps:10.0f} req/s")
+
+    before, after = results.values()
+    print(f"{'speedup':30s} {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
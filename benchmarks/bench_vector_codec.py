@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Recall@k and row size of the stored embedding formats
+(app/services/vector_codec.py) against full-precision float32 search.
+
+Corpus and queries come from the real embedding model when it can be
+loaded (synthetic troubleshooting texts). Otherwise, or with
+--synthetic, they come from an anisotropic low-rank Gaussian shaped like
+sentence embeddings. Numbers from the synthetic source only show the
+relative cost of each format. The PCA basis is fitted on a separate
+training split.
+
+Usage:
+  python -m benchmarks.bench_vector_codec [--corpus 5000] [--queries 200] [--synthetic]
+"""
+import argparse
+import json
+import random
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from app.services.vector_codec import Projection, VectorCodec, decode
+
+_SUBJECTS = ["wifi adapter", "VPN client", "npm install", "pip install", "Docker Desktop", "WSL2", "Outlook",
+             "Windows Update", "printer spooler", "Bluetooth headset", "DNS resolver", "PowerShell profile",
+             "Git credential manager", "Node.js PATH", "Python venv", "disk cleanup", "Defender scan"]
+_SYMPTOMS = ["fails with access denied", "times out after 30 seconds", "crashes on start", "is very slow",
+             "shows error 0x80070005", "cannot find the module", "drops every few minutes",
+             "returns exit code 1", "hangs at 99%", "reports certificate expired", "uses 100% CPU"]
+
+
+def _texts(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [f"{rng.choice(_SUBJECTS)} {rng.choice(_SYMPTOMS)} after {rng.choice(_SUBJECTS)} {rng.choice(_SYMPTOMS)} "
+            f"(attempt {rng.randint(1, 9)})" for _ in range(n)]
+
+
+def _model_vectors(n: int, seed: int) -> np.ndarray:
+    from app.services.embeddings import generate_embeddings_batch
+    return np.asarray(generate_embeddings_batch(_texts(n, seed)), dtype=np.float32)
+
+
+def _synthetic_vectors(n: int, seed: int, dim: int = 384) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    basis_rng = np.random.default_rng(0)  # same space for every split
+    rotation, _ = np.linalg.qr(basis_rng.normal(size=(dim, dim)))
+    spectrum = 1.0 / np.sqrt(np.arange(1, dim + 1))
+    offset = basis_rng.normal(size=dim) * 0.05
+    centres = basis_rng.normal(size=(64, dim)) * spectrum * 2.0
+    x = centres[rng.integers(0, len(centres), size=n)] + rng.normal(size=(n, dim)) * spectrum
+    x = x @ rotation + offset
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def _recall(truth: np.ndarray, found: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)]))
+
+
+def evaluate(name: str, codec: VectorCodec, corpus: np.ndarray, queries: np.ndarray,
+             truth: Tuple[np.ndarray, ...], ks: Tuple[int, ...]) -> None:
+    start = time.perf_counter()
+    rows = [codec.encode(v) for v in corpus]
+    encode_us = 1e6 * (time.perf_counter() - start) / len(rows)
+    stored = np.stack([decode(r) for r in rows])
+    projected = np.stack([codec.project(q) for q in queries])
+    row_bytes = np.mean([len(json.dumps({k: v for k, v in r.items() if k != "embedding_format"})) for r in rows])
+    recalls = "  ".join(f"{_recall(t, _top_k(stored, projected, k)):7.3f}" for t, k in zip(truth, ks))
+    print(f"{name:16s} {stored.shape[1]:4d} {row_bytes:9.0f} {encode_us:9.1f}  {recalls}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--train", type=int, default=5000, help="vectors used to fit the PCA basis")
+    parser.add_argument("--pca-dim", type=int, default=128)
+    parser.add_argument("--synthetic", action="store_true")
+    args = parser.parse_args()
+
+    source = "synthetic"
+    make = _synthetic_vectors
+    if not args.synthetic:
+        try:
+            _model_vectors(2, 0)
+            make, source = _model_vectors, "model"
+        except Exception as e:
+            print(f"embedding model unavailable ({type(e).__name__}); using synthetic vectors")
+
+    corpus = make(args.corpus, 1)
+    queries = make(args.queries, 2)
+    projection = Projection.fit(make(args.train, 3), args.pca_dim)
+    ks = (1, 10, 50)
+    truth = tuple(_top_k(corpus, queries, k) for k in ks)
+
+    print(f"source={source} corpus={args.corpus} queries={args.queries}")
+    print(f"{'format':16s} {'dim':>4s} {'row bytes':>9s} {'encode us':>9s}  " + "  ".join(f"{'R@' + str(k):>7s}" for k in ks))
+    for fmt in ("float32", "halfvec", "float16", "int8"):
+        evaluate(fmt, VectorCodec(fmt), corpus, queries, truth, ks)
+    for fmt in ("float32", "float16", "int8"):
+        evaluate(f"{fmt}+pca{args.pca_dim}", VectorCodec(fmt, projection), corpus, queries, truth, ks)
+
+
+if __name__ == "__main__":
+    main()
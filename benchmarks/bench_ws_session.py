@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Per-turn latency: HTTP diagnose routes vs the /ws/diagnose session.
+
+Starts the load-test server (fake Gemini/Supabase, see benchmarks/loadtest)
+and runs the same number of turns through both paths:
+
+  HTTP: POST /diagnose, then POST /diagnose/continue per turn (JWT decode,
+        user lookup, thread ownership check and history fetch every time)
+  WS:   one connection, then {"type": "problem"} / {"type": "results"} frames
+
+The fake LLM latency is fixed (sigma 0), so the difference between the two
+columns is the per-turn overhead the WebSocket session removes.
+
+Usage:
+  python -m benchmarks.bench_ws_session [--sessions 20] [--turns 5] [--db-latency-ms 15]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import List
+
+import httpx
+import websockets
+
+from benchmarks.loadtest.run_load import _free_port, start_server, wait_for_health
+from benchmarks.loadtest.server import LOAD_PASSWORD, add_fake_arguments
+
+
+async def _login(client: httpx.AsyncClient) -> str:
+    response = await client.post("/auth/login", json={"email": "load0@example.com", "password": LOAD_PASSWORD})
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+async def http_turns(client: httpx.AsyncClient, token: str, turns: int) -> List[float]:
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+    start = time.perf_counter()
+    body = (await client.post("/diagnose", json={"problem": "wifi keeps dropping"}, headers=headers)).json()
+    latencies.append(time.perf_counter() - start)
+    for _ in range(turns - 1):
+        start = time.perf_counter()
+        body = (await client.post(
+            "/diagnose/continue",
+            json={"thread_id": body["thread_id"], "command": "ipconfig /all", "command_output": "fake output\n" * 20},
+            headers=headers,
+        )).json()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def ws_turns(ws_url: str, token: str, turns: int) -> List[float]:
+    latencies = []
+    async with websockets.connect(f"{ws_url}/ws/diagnose?token={token}") as ws:
+        json.loads(await ws.recv())  # ready
+        frame = {"type": "problem", "problem": "wifi keeps dropping"}
+        for _ in range(turns):
+            start = time.perf_counter()
+            await ws.send(json.dumps(frame))
+            json.loads(await ws.recv())
+            latencies.append(time.perf_counter() - start)
+            frame = {"type": "results", "results": [{"command": "ipconfig /all", "command_output": "fake output\n" * 20}]}
+    return latencies
+
+
+def _report(name: str, latencies: List[float], llm_ms: float) -> None:
+    ordered = sorted(latencies)
+    mean = 1000 * statistics.mean(ordered)
+    p95 = 1000 * ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+    print(f"{name:6s} turns={len(ordered):4d}  mean={mean:7.1f} ms  p95={p95:7.1f} ms  "
+          f"overhead vs LLM={mean - llm_ms:7.1f} ms")
+
+
+async def run(args: argparse.Namespace, port: int) -> None:
+    base_url = f"http://127.0.0.1:{port}"
+    await wait_for_health(base_url)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        token = await _login(client)
+        http_lat: List[float] = []
+        ws_lat: List[float] = []
+        for _ in range(args.sessions):
+            http_lat += await http_turns(client, token, args.turns)
+            ws_lat += await ws_turns(f"ws://127.0.0.1:{port}", token, args.turns)
+
+    _report("http", http_lat, args.llm_latency_ms)
+    _report("ws", ws_lat, args.llm_latency_ms)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    add_fake_arguments(parser)
+    parser.set_defaults(
+        llm_latency_ms=50.0, llm_latency_sigma=0.0, llm_tail_rate=0.0,
+        llm_error_rate=0.0, llm_invalid_json_rate=0.0, users=1,
+    )
+    args = parser.parse_args()
+
+    port = _free_port()
+    server = start_server(args, port)
+    try:
+        asyncio.run(run(args, port))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Local stand-ins for Gemini, Supabase and the embedding model.
+
+Nothing in here touches the network. `install_fakes()` swaps the module-level
+clients the app already uses for lazy initialisation, so the real request
+path (routes, ThreadService, custom_agent) runs unchanged on top of them.
+"""
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import numpy as np
+
+
+# ============================================================
+# FAKE GEMINI
+# ============================================================
+
+class FakeLLMConfig:
+    """Latency and response-shape knobs for the fake Gemini client."""
+
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        latency_sigma: float = 0.35,
+        tail_rate: float = 0.03,
+        tail_multiplier: float = 4.0,
+        fence_rate: float = 0.3,
+        prose_rate: float = 0.1,
+        invalid_json_rate: float = 0.02,
+        error_rate: float = 0.01,
+        command_rate: float = 0.7,
+        multi_command_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tail_rate = tail_rate
+        self.tail_multiplier = tail_multiplier
+        self.fence_rate = fence_rate
+        self.prose_rate = prose_rate
+        self.invalid_json_rate = invalid_json_rate
+        self.error_rate = error_rate
+        self.command_rate = command_rate
+        # Share of command replies that also carry independent `commands`
+        self.multi_command_rate = multi_command_rate
+        self.seed = seed
+
+
+_FAKE_COMMANDS = [
+    "ipconfig /all",
+    "Test-NetConnection google.com -Port 443",
+    "Resolve-DnsName microsoft.com",
+    "Get-NetAdapter | Select-Object Name, Status, LinkSpeed",
+    "Get-Process | Sort-Object CPU -Descending | Select-Object -First 10",
+    "Get-PSDrive C",
+]
+
+
+# Present in the summariser's fold prompt, never in diagnose prompts
+_SUMMARY_MARKER = "## Current summary"
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeUpstreamError(Exception):
+    """Raised by the fake client to simulate a Gemini 5xx/429."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class _FakeModels:
+    def __init__(self, config: FakeLLMConfig):
+        self._config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            return (
+                self._rng.lognormvariate(0.0, self._config.latency_sigma),
+                self._rng.random(),
+                self._rng.random(),
+                self._rng.random(),
+                self._rng.random(),
+                self._rng.random(),
+                self._rng.choice(_FAKE_COMMANDS),
+                self._rng.random(),
+                self._rng.sample(_FAKE_COMMANDS, 3),
+            )
+
+    def generate_content(self, model: str, contents: Any, **kwargs) -> _FakeResponse:
+        cfg = self._config
+        jitter, tail, err, fence, prose, cmd, command, multi, extra = self._draw()
+
+        latency = cfg.latency_ms * jitter
+        if tail < cfg.tail_rate:
+            latency *= cfg.tail_multiplier
+        time.sleep(latency / 1000.0)
+
+        if err < cfg.error_rate:
+            raise FakeUpstreamError(503, "fake upstream unavailable")
+
+        if _SUMMARY_MARKER in str(contents):
+            # Background summary folds (app/agent/summarizer.py) expect {"summary": ...}
+            payload = {"summary": f"User is troubleshooting connectivity; {command} was run and checked."}
+        elif cmd < cfg.command_rate:
+            payload = {"message": f"Checking with {model}...", "command": command, "next_step": "command"}
+            if multi < cfg.multi_command_rate:
+                payload["commands"] = [c for c in extra if c != command]
+        else:
+            payload = {"message": "Looks resolved. Restart the app and try again.", "command": "", "next_step": "message"}
+        text = json.dumps(payload)
+
+        if err < cfg.error_rate + cfg.invalid_json_rate:
+            text = text[: len(text) // 2]
+        if fence < cfg.fence_rate:
+            text = f"```json\n{text}\n```"
+        if prose < cfg.prose_rate:
+            text = f"Here is my analysis.\n{text}\nLet me know if that helps."
+        return _FakeResponse(text)
+
+
+class FakeGenaiClient:
+    """Duck-types `google.genai.Client` for `client.models.generate_content`."""
+
+    def __init__(self, config: Optional[FakeLLMConfig] = None):
+        self.models = _FakeModels(config or FakeLLMConfig())
+
+
+# ============================================================
+# FAKE EMBEDDING MODEL
+# ============================================================
+
+class FakeEmbeddingModel:
+    """Deterministic hash-seeded vectors with the MiniLM shape."""
+
+    def __init__(self, dimension: int = 384, latency_ms: float = 2.0):
+        self._dimension = dimension
+        self._latency_ms = latency_ms
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dimension
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vec = np.random.default_rng(seed).standard_normal(self._dimension).astype(np.float32)
+        return vec / np.linalg.norm(vec)
+
+    def encode(self, sentences, convert_to_numpy: bool = True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        time.sleep(self._latency_ms * len(texts) / 1000.0)
+        out = np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self._dimension), np.float32)
+        return out[0] if single else out
+
+
+# ============================================================
+# FAKE SUPABASE / POSTGREST
+# ============================================================
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _Result:
+    def __init__(self, data: List[Dict], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class _Query:
+    """Subset of the postgrest-py request builder used by the app."""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._payload: Any = None
+        self._filters: List = []
+        self._order: List = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._on_conflict: Optional[str] = None
+
+    # ---- operations ----
+    def select(self, *columns, **kwargs) -> "_Query":
+        self._op = "select"
+        return self
+
+    def insert(self, data, **kwargs) -> "_Query":
+        self._op, self._payload = "insert", data
+        return self
+
+    def upsert(self, data, on_conflict: str = "id", **kwargs) -> "_Query":
+        self._op, self._payload, self._on_conflict = "upsert", data, on_conflict or "id"
+        return self
+
+    def update(self, data, **kwargs) -> "_Query":
+        self._op, self._payload = "update", data
+        return self
+
+    def delete(self, **kwargs) -> "_Query":
+        self._op = "delete"
+        return self
+
+    # ---- filters ----
+    def _filter(self, fn) -> "_Query":
+        self._filters.append(fn)
+        return self
+
+    def eq(self, col, val):
+        return self._filter(lambda r: r.get(col) == val)
+
+    def neq(self, col, val):
+        return self._filter(lambda r: r.get(col) != val)
+
+    def gt(self, col, val):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) > val)
+
+    def gte(self, col, val):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) >= val)
+
+    def lt(self, col, val):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) < val)
+
+    def lte(self, col, val):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) <= val)
+
+    def in_(self, col, values):
+        values = set(values)
+        return self._filter(lambda r: r.get(col) in values)
+
+    def is_(self, col, val):
+        target = None if val in (None, "null") else val
+        return self._filter(lambda r: r.get(col) is target or r.get(col) == target)
+
+    def or_(self, filters: str, **kwargs):
+        # Only the keyset form `and(a.eq.x,b.gt.y),a.gt.x` is needed
+        clauses = _parse_or(filters)
+        return self._filter(lambda r: any(all(f(r) for f in clause) for clause in clauses))
+
+    # ---- modifiers ----
+    def order(self, col, desc: bool = False, **kwargs):
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n: int, **kwargs):
+        self._limit = n
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def execute(self) -> _Result:
+        return self._db._execute(self)
+
+
+def _parse_or(expr: str):
+    ops = {"eq": lambda a, b: a == b, "gt": lambda a, b: a is not None and a > b,
+           "lt": lambda a, b: a is not None and a < b, "gte": lambda a, b: a is not None and a >= b}
+
+    def parse_cond(text):
+        col, op, val = text.split(".", 2)
+        val = val[1:-1] if len(val) >= 2 and val[0] == val[-1] == '"' else val
+        return lambda r, c=col, o=ops[op], v=val: o(str(r.get(c)) if r.get(c) is not None else None, v)
+
+    clauses, depth, buf = [], 0, ""
+    for ch in expr + ",":
+        if ch == "," and depth == 0:
+            part = buf.strip()
+            if part.startswith("and(") and part.endswith(")"):
+                clauses.append([parse_cond(c) for c in part[4:-1].split(",")])
+            elif part:
+                clauses.append([parse_cond(part)])
+            buf = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        buf += ch
+    return clauses
+
+
+class FakeSupabase:
+    """
+    Thread-safe in-process PostgREST stand-in.
+
+    Tables are lists of dict rows. `id`, `created_at` and `updated_at` get
+    server-side defaults on insert like the real schema. `latency_ms` is slept
+    per call to model the network round trip to Supabase.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.tables: Dict[str, List[Dict]] = {}
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def _execute(self, q: _Query) -> _Result:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+        with self._lock:
+            key = f"{q._table}.{q._op}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+            rows = self.tables.setdefault(q._table, [])
+
+            if q._op in ("insert", "upsert"):
+                payload = q._payload if isinstance(q._payload, list) else [q._payload]
+                out = []
+                for item in payload:
+                    row = dict(item)
+                    if q._op == "upsert":
+                        keys = [k.strip() for k in q._on_conflict.split(",")]
+                        existing = next((r for r in rows if all(r.get(k) == row.get(k) for k in keys)), None)
+                        if existing is not None:
+                            existing.update(row)
+                            out.append(dict(existing))
+                            continue
+                    row.setdefault("id", str(uuid4()))
+                    row.setdefault("created_at", _now_iso())
+                    if q._table == "threads":
+                        row.setdefault("updated_at", row["created_at"])
+                    rows.append(row)
+                    out.append(dict(row))
+                return _Result(out)
+
+            matched = [r for r in rows if all(f(r) for f in q._filters)]
+
+            if q._op == "delete":
+                ids = {id(r) for r in matched}
+                self.tables[q._table] = [r for r in rows if id(r) not in ids]
+                return _Result([dict(r) for r in matched])
+
+            if q._op == "update":
+                for r in matched:
+                    r.update(q._payload)
+                return _Result([dict(r) for r in matched])
+
+            for col, desc in reversed(q._order):
+                matched.sort(key=lambda r: (r.get(col) is None, r.get(col) or ""), reverse=desc)
+            end = None if q._limit is None else q._offset + q._limit
+            return _Result([dict(r) for r in matched[q._offset:end]])
+
+
+# ============================================================
+# WIRING
+# ============================================================
+
+def install_fakes(
+    llm_config: Optional[FakeLLMConfig] = None,
+    db_latency_ms: float = 0.0,
+    embedding_latency_ms: float = 2.0,
+    real_embeddings: bool = False,
+) -> FakeSupabase:
+    """
+    Point the already-imported app modules at the fakes.
+
+    Must be called after `run` (and therefore every app module) is imported.
+    """
+    from app.agent import agents
+    from app.database.storage import set_storage
+    from app.services import embeddings
+
+    db = FakeSupabase(latency_ms=db_latency_ms)
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and hasattr(module, "supabase"):
+            setattr(module, "supabase", db)
+    # Re-run backend selection now that "Supabase" is available
+    set_storage(None)
+
+    agents._client = FakeGenaiClient(llm_config)
+    if not real_embeddings:
+        embeddings._model = FakeEmbeddingModel(latency_ms=embedding_latency_ms)
+    return db
+
+
+def seed_users(db: FakeSupabase, count: int, password: str) -> List[str]:
+    """Create `count` users sharing one password and return their emails."""
+    from werkzeug.security import generate_password_hash
+
+    password_hash = generate_password_hash(password)
+    emails = []
+    for i in range(count):
+        email = f"load{i}@example.com"
+        db.table("users").insert({"email": email, "password_hash": password_hash, "name": f"load{i}"}).execute()
+        emails.append(email)
+    return emails
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the Glitch API with no network dependencies.
+
+Starts `benchmarks/loadtest/server.py` (run.py:app + fake Gemini/Supabase/
+embeddings) on a local port, then drives it with N concurrent virtual users.
+Each virtual user logs in once and loops over:
+
+  POST /diagnose -> POST /diagnose/continue[/batch] (while commands are suggested) -> GET /threads
+
+Throughput and p50/p95/p99 latency are reported per endpoint and written to a
+JSON file. Pass `--compare` with an earlier file to fail on regressions.
+
+Usage:
+  python -m benchmarks.loadtest.run_load --concurrency 32 --duration 60
+  python -m benchmarks.loadtest.run_load --out baseline.json
+  python -m benchmarks.loadtest.run_load --compare baseline.json --tolerance 0.15
+  python -m benchmarks.loadtest.run_load --url http://127.0.0.1:8080   # already-running server
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from benchmarks.loadtest.server import LOAD_PASSWORD, add_fake_arguments
+
+PROBLEMS = [
+    "Outlook won't connect to the server",
+    "My laptop is really slow after the update",
+    "Wi-Fi keeps dropping every few minutes",
+    "pip install fails with a permission error",
+    "npm install hangs on fetchMetadata",
+    "C drive is almost full",
+]
+
+ENDPOINTS = ["/auth/login", "/diagnose", "/diagnose/continue", "/diagnose/continue/batch", "/threads"]
+
+
+# ============================================================
+# STATS
+# ============================================================
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status_codes: Dict[int, int] = {}
+
+    def record(self, seconds: float, status_code: int) -> None:
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+        if 200 <= status_code < 300:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(stats: Dict[str, EndpointStats], wall_seconds: float) -> Dict[str, Dict]:
+    out = {}
+    for name in ENDPOINTS:
+        s = stats[name]
+        lat = sorted(s.latencies)
+        out[name] = {
+            "count": len(lat),
+            "errors": s.errors,
+            "status_codes": {str(k): v for k, v in sorted(s.status_codes.items())},
+            "throughput_rps": round(len(lat) / wall_seconds, 3) if wall_seconds else 0.0,
+            "mean_ms": round(1000 * sum(lat) / len(lat), 2) if lat else 0.0,
+            "p50_ms": round(1000 * _percentile(lat, 0.50), 2),
+            "p95_ms": round(1000 * _percentile(lat, 0.95), 2),
+            "p99_ms": round(1000 * _percentile(lat, 0.99), 2),
+        }
+    return out
+
+
+# ============================================================
+# VIRTUAL USERS
+# ============================================================
+
+async def _timed(stats: EndpointStats, coro) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        response = await coro
+    except httpx.HTTPError:
+        stats.record(time.perf_counter() - start, 599)
+        return None
+    stats.record(time.perf_counter() - start, response.status_code)
+    return response
+
+
+async def virtual_user(
+    client: httpx.AsyncClient,
+    email: str,
+    stats: Dict[str, EndpointStats],
+    deadline: float,
+    max_turns: int,
+    rng: random.Random,
+) -> None:
+    response = await _timed(
+        stats["/auth/login"],
+        client.post("/auth/login", json={"email": email, "password": LOAD_PASSWORD}),
+    )
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    while time.perf_counter() < deadline:
+        response = await _timed(
+            stats["/diagnose"],
+            client.post("/diagnose", json={"problem": rng.choice(PROBLEMS)}, headers=headers),
+        )
+        if response is None or response.status_code != 200:
+            continue
+        body = response.json()
+        thread_id = body["thread_id"]
+
+        turns = 0
+        while body.get("command") and turns < max_turns and time.perf_counter() < deadline:
+            turns += 1
+            commands = body.get("commands") or [body["command"]]
+            if len(commands) > 1:
+                results = [
+                    {"command": c, "command_output": f"fake output for {c}\n" * rng.randint(1, 40)}
+                    for c in commands
+                ]
+                response = await _timed(
+                    stats["/diagnose/continue/batch"],
+                    client.post(
+                        "/diagnose/continue/batch",
+                        json={"thread_id": thread_id, "results": results},
+                        headers=headers,
+                    ),
+                )
+            else:
+                response = await _timed(
+                    stats["/diagnose/continue"],
+                    client.post(
+                        "/diagnose/continue",
+                        json={
+                            "thread_id": thread_id,
+                            "command": body["command"],
+                            "command_output": f"fake output for {body['command']}\n" * rng.randint(1, 40),
+                        },
+                        headers=headers,
+                    ),
+                )
+            if response is None or response.status_code != 200:
+                break
+            body = response.json()
+
+        await _timed(stats["/threads"], client.get("/threads", headers=headers))
+
+
+# ============================================================
+# SERVER PROCESS
+# ============================================================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "benchmarks.loadtest.server", "--port", str(port)]
+    for action in _fake_actions():
+        value = getattr(args, action.dest)
+        flag = action.option_strings[0]
+        if isinstance(value, bool):
+            if value:
+                cmd.append(flag)
+        elif value is not None:
+            cmd += [flag, str(value)]
+    return subprocess.Popen(cmd, cwd=ROOT)
+
+
+def _fake_actions():
+    parser = argparse.ArgumentParser(add_help=False)
+    add_fake_arguments(parser)
+    return parser._actions
+
+
+async def wait_for_health(base_url: str, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"server at {base_url} did not become healthy within {timeout}s")
+
+
+# ============================================================
+# BASELINE COMPARISON
+# ============================================================
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return human-readable regressions of p95/p99 latency and throughput."""
+    problems = []
+    for name in ENDPOINTS:
+        cur, base = current["endpoints"].get(name), baseline["endpoints"].get(name)
+        if not cur or not base or not base["count"]:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if base[key] and cur[key] > base[key] * (1 + tolerance):
+                problems.append(f"{name} {key}: {base[key]:.1f} -> {cur[key]:.1f}")
+        if base["throughput_rps"] and cur["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{name} throughput_rps: {base['throughput_rps']:.2f} -> {cur['throughput_rps']:.2f}")
+        base_err = base["errors"] / max(base["count"] + base["errors"], 1)
+        cur_err = cur["errors"] / max(cur["count"] + cur["errors"], 1)
+        if cur_err > base_err + tolerance / 10:
+            problems.append(f"{name} error rate: {base_err:.2%} -> {cur_err:.2%}")
+    return problems
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+async def run(args: argparse.Namespace, base_url: str) -> Dict:
+    await wait_for_health(base_url)
+
+    stats = {name: EndpointStats() for name in ENDPOINTS}
+    emails = [f"load{i}@example.com" for i in range(args.users)]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.request_timeout) as client:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, emails[i % len(emails)], stats, deadline, args.max_turns, random.Random(i))
+            for i in range(args.concurrency)
+        ))
+        wall = time.perf_counter() - start
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "url")},
+        "wall_seconds": round(wall, 3),
+        "endpoints": summarize(stats, wall),
+    }
+
+
+def print_report(result: Dict) -> None:
+    print(f"\nwall time: {result['wall_seconds']:.1f}s  concurrency: {result['config']['concurrency']}")
+    print(f"{'endpoint':26s} {'count':>7s} {'err':>5s} {'rps':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:26s} {e['count']:7d} {e['errors']:5d} {e['throughput_rps']:8.2f} "
+              f"{e['p50_ms']:9.1f} {e['p95_ms']:9.1f} {e['p99_ms']:9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to drive load")
+    parser.add_argument("--max-turns", type=int, default=3, help="max /diagnose/continue calls per thread")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--url", default=None, help="drive an already-running server instead of booting one")
+    parser.add_argument("--out", default=None, help="write the JSON result (use as the next baseline)")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = _free_port()
+        server = start_server(args, port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        result = asyncio.run(run(args, base_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print_report(result)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresult written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        problems = compare(result, baseline, args.tolerance)
+        if problems:
+            print("\nREGRESSIONS vs baseline:")
+            for p in problems:
+                print(f"  {p}")
+            sys.exit(1)
+        print("\nno regressions vs baseline")
+
+
+if __name__ == "__main__":
+    main()
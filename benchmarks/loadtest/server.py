@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Boot `run.py:app` under uvicorn with the local Gemini/Supabase/embedding fakes.
+
+Usually started by `run_load.py`, but can be run on its own:
+  python -m benchmarks.loadtest.server --port 8765 --llm-latency-ms 800
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+LOAD_PASSWORD = "loadtest-password"
+
+
+def add_fake_arguments(parser: argparse.ArgumentParser) -> None:
+    """Arguments shared with run_load.py, which forwards them to this server."""
+    parser.add_argument("--users", type=int, default=16, help="number of seeded users")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.35)
+    parser.add_argument("--llm-tail-rate", type=float, default=0.03)
+    parser.add_argument("--llm-tail-multiplier", type=float, default=4.0)
+    parser.add_argument("--llm-fence-rate", type=float, default=0.3)
+    parser.add_argument("--llm-prose-rate", type=float, default=0.1)
+    parser.add_argument("--llm-invalid-json-rate", type=float, default=0.02)
+    parser.add_argument("--llm-error-rate", type=float, default=0.01)
+    parser.add_argument("--llm-multi-command-rate", type=float, default=0.0,
+                        help="share of command replies that batch extra independent commands")
+    parser.add_argument("--db-latency-ms", type=float, default=15.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=2.0)
+    parser.add_argument("--real-embeddings", action="store_true", help="load the real MiniLM model")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    # Config is read at import time, so these must be set before importing run
+    os.environ.setdefault("JWT_SECRET", "loadtest-secret")
+    os.environ.setdefault("GEMINI_API_KEY", "loadtest-fake-key")
+    # Never talk to the shared project, even if the shell or .env has it
+    os.environ["SUPABASE_URL"] = ""
+    os.environ["SUPABASE_KEY"] = ""
+
+    import uvicorn
+    import run
+    from benchmarks.loadtest.fakes import FakeLLMConfig, install_fakes, seed_users
+
+    db = install_fakes(
+        llm_config=FakeLLMConfig(
+            latency_ms=args.llm_latency_ms,
+            latency_sigma=args.llm_latency_sigma,
+            tail_rate=args.llm_tail_rate,
+            tail_multiplier=args.llm_tail_multiplier,
+            fence_rate=args.llm_fence_rate,
+            prose_rate=args.llm_prose_rate,
+            invalid_json_rate=args.llm_invalid_json_rate,
+            error_rate=args.llm_error_rate,
+            multi_command_rate=args.llm_multi_command_rate,
+            seed=args.seed,
+        ),
+        db_latency_ms=args.db_latency_ms,
+        embedding_latency_ms=args.embedding_latency_ms,
+        real_embeddings=args.real_embeddings,
+    )
+    seed_users(db, args.users, LOAD_PASSWORD)
+
+    uvicorn.run(run.app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
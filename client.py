@@ -1,191 +1,328 @@
 #!/usr/bin/env python3
-import requests
+import asyncio
+import getpass
+import locale
+import os
+import signal
 import subprocess
-import json
 import sys
-from typing import Optional
+from typing import List, Optional
+
+import httpx
+
+# Per-stream capture limit; anything beyond it is drained and dropped
+OUTPUT_CAP_BYTES = int(os.getenv("GLITCH_OUTPUT_CAP_BYTES", str(64 * 1024)))
+COMMAND_TIMEOUT_SECONDS = float(os.getenv("GLITCH_COMMAND_TIMEOUT", "30"))
+
 
 class DiagnosticClient:
+    """
+    Async API client. One pooled keep-alive connection is reused for the whole
+    session; HTTP/2 is negotiated over TLS (e.g. Cloud Run) and plain-http
+    local servers fall back to HTTP/1.1 keep-alive.
+    """
+
     def __init__(self, base_url: str = "http://localhost:8080"):
         self.base_url = base_url.rstrip('/')
-        self.session = requests.Session()
-    
-    def health_check(self) -> dict:
+        self.token: Optional[str] = None
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=True,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=300),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+        )
+
+    async def __aenter__(self) -> "DiagnosticClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        try:
+            response = await self.http.post(path, json=payload, headers=self._headers())
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            return {"error": _error_detail(e.response), "status_code": e.response.status_code}
+        except httpx.HTTPError as e:
+            return {"error": str(e) or type(e).__name__, "status_code": None}
+
+    async def health_check(self) -> dict:
         """Check API health"""
         try:
-            response = self.session.get(f"{self.base_url}/health")
+            response = await self.http.get("/health")
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             return {"error": str(e), "status": "unreachable"}
-    
-    def diagnose(self, problem: str, command_output: Optional[str] = None, session_id: Optional[str] = None) -> dict:
-        """Send diagnostic request"""
+
+    async def login(self, email: str, password: str) -> dict:
+        """Log in and keep the bearer token for later calls"""
+        result = await self._post("/auth/login", {"email": email, "password": password})
+        self.token = result.get("token")
+        return result
+
+    async def diagnose(self, problem: str, thread_id: Optional[str] = None) -> dict:
+        """Start a diagnosis (or add a new problem to an existing thread)"""
         payload = {"problem": problem}
-        if command_output:
-            payload["command_output"] = command_output
-        if session_id:
-            payload["session_id"] = session_id
-        
-        try:
-            response = self.session.post(
-                f"{self.base_url}/diagnose",
-                json=payload,
-                headers={"Content-Type": "application/json"}
+        if thread_id:
+            payload["thread_id"] = thread_id
+        return await self._post("/diagnose", payload)
+
+    async def continue_diagnosis(self, thread_id: str, command: str, command_output: str) -> dict:
+        """Send the output of the suggested command"""
+        return await self._post(
+            "/diagnose/continue",
+            {"thread_id": thread_id, "command": command, "command_output": command_output},
+        )
+
+    async def continue_batch(self, thread_id: str, results: List[dict]) -> dict:
+        """Send the outputs of several commands that ran in parallel"""
+        return await self._post("/diagnose/continue/batch", {"thread_id": thread_id, "results": results})
+
+
+def _error_detail(response: httpx.Response) -> str:
+    try:
+        return str(response.json().get("detail") or response.text)
+    except ValueError:
+        return response.text or f"HTTP {response.status_code}"
+
+
+class _CappedBuffer:
+    """Collects a stream up to `cap` bytes while remembering how much was dropped."""
+
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.dropped = 0
+
+    def feed(self, chunk: bytes) -> None:
+        room = self.cap - self.size
+        if room > 0:
+            self.chunks.append(chunk[:room])
+            self.size += min(len(chunk), room)
+        self.dropped += max(len(chunk) - room, 0)
+
+    def text(self) -> str:
+        text = b"".join(self.chunks).decode(locale.getpreferredencoding(False), errors="replace").strip()
+        if self.dropped:
+            text += f"\n... [{self.dropped} more bytes truncated]"
+        return text
+
+
+async def _pump(stream: asyncio.StreamReader, buffer: _CappedBuffer) -> None:
+    # Keep reading past the cap so the child never blocks on a full pipe
+    while True:
+        chunk = await stream.read(8192)
+        if not chunk:
+            return
+        buffer.feed(chunk)
+
+
+def _process_group_options() -> dict:
+    """Start the shell as the leader of its own process group, so a timeout can kill everything it started."""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+async def _kill_tree(proc: asyncio.subprocess.Process) -> None:
+    """Kill the shell and every process it spawned; killing only the shell leaves them running."""
+    try:
+        if sys.platform == "win32":
+            killer = await asyncio.create_subprocess_exec(
+                "taskkill", "/T", "/F", "/PID", str(proc.pid),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
             )
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            return {"error": str(e), "status_code": getattr(e.response, 'status_code', None)}
+            await killer.wait()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError):
+        pass
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
 
-def run_command(command: str) -> dict:
-    """Execute a shell command and return the result"""
+
+async def run_command(command: str, timeout: float = COMMAND_TIMEOUT_SECONDS) -> dict:
+    """Execute a shell command, streaming its output into capped buffers"""
+    print(f"🔧 Running: {command}")
+    stdout, stderr = _CappedBuffer(OUTPUT_CAP_BYTES), _CappedBuffer(OUTPUT_CAP_BYTES)
     try:
-        print(f"🔧 Running: {command}")
-        result = subprocess.run(
+        proc = await asyncio.create_subprocess_shell(
             command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **_process_group_options(),
         )
-        
-        output = result.stdout.strip()
-        error = result.stderr.strip()
-        
-        if result.returncode == 0:
-            print(f"✅ Command executed successfully")
-            if output:
-                print(f"📤 Output:\n{output}")
-            return {"success": True, "output": output, "error": error}
-        else:
-            print(f"❌ Command failed (exit code: {result.returncode})")
-            if error:
-                print(f"📤 Error:\n{error}")
-            return {"success": False, "output": output, "error": error}
-            
-    except subprocess.TimeoutExpired:
-        print("⏰ Command timed out after 30 seconds")
-        return {"success": False, "output": "", "error": "Command timed out"}
     except Exception as e:
         print(f"❌ Failed to execute command: {e}")
         return {"success": False, "output": "", "error": str(e)}
 
-def main():
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(_pump(proc.stdout, stdout), _pump(proc.stderr, stderr), proc.wait()),
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        await _kill_tree(proc)
+        await proc.wait()
+        print(f"⏰ {command}: timed out after {timeout:g} seconds")
+        return {"success": False, "output": stdout.text(), "error": "Command timed out"}
+
+    output, error = stdout.text(), stderr.text()
+    if proc.returncode == 0:
+        print(f"✅ {command}: done ({len(output)} characters)")
+        return {"success": True, "output": output, "error": error}
+
+    print(f"❌ {command}: failed (exit code: {proc.returncode})")
+    return {"success": False, "output": output, "error": error}
+
+
+def format_command_output(cmd_result: dict) -> str:
+    """Turn a run_command result into the text sent back to the API"""
+    if cmd_result['success']:
+        command_output = cmd_result['output']
+        if cmd_result['error']:
+            command_output += f"\nStderr: {cmd_result['error']}"
+    else:
+        command_output = f"Command failed: {cmd_result['error']}"
+        if cmd_result['output']:
+            command_output += f"\nOutput: {cmd_result['output']}"
+    return command_output
+
+
+async def run_commands(commands: List[str]) -> List[dict]:
+    """Run independent commands concurrently; results keep the input order"""
+    cmd_results = await asyncio.gather(*(run_command(command) for command in commands))
+    return [
+        {"command": command, "command_output": format_command_output(cmd_result)}
+        for command, cmd_result in zip(commands, cmd_results)
+    ]
+
+
+async def ask(prompt: str) -> str:
+    """input() without blocking the event loop"""
+    return (await asyncio.to_thread(input, prompt)).strip()
+
+
+async def login(client: DiagnosticClient) -> bool:
+    email = os.getenv("GLITCH_EMAIL") or await ask("📧 Email: ")
+    password = os.getenv("GLITCH_PASSWORD") or await asyncio.to_thread(getpass.getpass, "🔑 Password: ")
+    result = await client.login(email, password)
+    if not client.token:
+        print(f"❌ Login failed: {result.get('error', 'no token returned')}")
+        return False
+    print(f"✅ Logged in as {email}\n")
+    return True
+
+
+def show_result(result: dict) -> None:
+    print(f"\n💬 {result.get('message', 'No response available')}")
+    thread_id = result.get('thread_id')
+    if thread_id:
+        history_count = len(result.get('history', []))
+        print(f"📋 Thread: {thread_id} | Steps: {history_count}")
+
+
+async def session(client: DiagnosticClient, problem: str) -> bool:
+    """One troubleshooting thread. Returns False when the user wants to quit."""
+    print("\n🔍 Analyzing...")
+    result = await client.diagnose(problem)
+
+    while True:
+        if 'error' in result:
+            print(f"❌ API Error: {result['error']}")
+            return True
+
+        show_result(result)
+        thread_id = result.get('thread_id') or result.get('session_id')
+        commands = result.get('commands') or ([result['command']] if result.get('command') else [])
+
+        if not commands:
+            # No command to run, diagnosis is complete
+            print("\n✅ Diagnosis complete!")
+            return True
+
+        if len(commands) == 1:
+            print(f"\n🔧 Suggested command: {commands[0]}")
+            choice = (await ask("\nRun this command? (y/n/quit): ")).lower()
+        else:
+            print("\n🔧 Suggested independent commands:")
+            for command in commands:
+                print(f"   • {command}")
+            choice = (await ask(f"\nRun these {len(commands)} commands in parallel? (y/n/quit): ")).lower()
+
+        if choice in ['quit', 'q']:
+            return False
+        if choice not in ['y', 'yes']:
+            print("Command skipped. You can run it manually if needed.")
+            return True
+
+        results = await run_commands(commands)
+        total = sum(len(r['command_output']) for r in results)
+        print(f"\n📤 Sending {len(results)} command output(s) to bot ({total} characters)")
+        print("🔍 Analyzing...")
+        if len(results) == 1:
+            result = await client.continue_diagnosis(thread_id, results[0]['command'], results[0]['command_output'])
+        else:
+            result = await client.continue_batch(thread_id, results)
+
+
+async def main():
     """Main interactive diagnostic session"""
     print("🤖 Glitch - AI Troubleshooting Assistant")
     print("=" * 50)
     print("Describe your technical issue and I'll help diagnose it!")
-    print("Commands will be executed automatically when suggested.")
+    print("Suggested commands run on this machine after you confirm them.")
     print("Type 'quit' to exit.\n")
-    
-    # Initialize client
-    client = DiagnosticClient()
-    
-    # Quick health check
-    health = client.health_check()
-    if health.get("status") != "healthy":
-        print("❌ API is not available. Make sure the server is running:")
-        print("   python run.py")
-        sys.exit(1)
-    
-    print("✅ Connected to Glitch\n")
-    
-    # Main interaction loop
-    current_problem = None
-    session_id = None
-    command_output = None
-    
-    while True:
-        try:
-            if not current_problem:
-                problem = input("🔍 What technical issue are you experiencing? ").strip()
-                
+
+    async with DiagnosticClient(os.getenv("GLITCH_API_URL", "http://localhost:8080")) as client:
+        # Quick health check
+        health = await client.health_check()
+        if health.get("status") != "healthy":
+            print("❌ API is not available. Make sure the server is running:")
+            print("   python run.py")
+            sys.exit(1)
+
+        print("✅ Connected to Glitch\n")
+        if not await login(client):
+            sys.exit(1)
+
+        while True:
+            try:
+                problem = await ask("🔍 What technical issue are you experiencing? ")
+
                 if problem.lower() in ['quit', 'exit', 'q']:
-                    print("👋 Goodbye!")
                     break
-                
                 if not problem:
                     continue
-                
-                current_problem = problem
-                session_id = None  # Start new session
-                command_output = None
-            
-            print("\n� Analy:zing...")
-            
-            # Debug: Show what we're sending
-            if command_output:
-                print(f"📋 Sending command output: {len(command_output)} characters")
-            
-            # Get diagnosis from API
-            result = client.diagnose(current_problem, command_output, session_id)
-            
-            if 'error' in result:
-                print(f"❌ API Error: {result['error']}")
-                current_problem = None
-                session_id = None
-                continue
-            
-            # Update session ID
-            session_id = result.get('session_id')
-            
-            # Display the diagnosis
-            print(f"\n💬 {result.get('message', 'No response available')}")
-            
-            # Show session info
-            if session_id:
-                history_count = len(result.get('history', []))
-                print(f"📋 Session: {session_id} | Steps: {history_count}")
-            
-            # Handle next steps
-            if result.get('next_step') == 'command' or result.get('command'):
-                command = result['command']
-                print(f"\n🔧 Suggested command: {command}")
-                
-                # Ask user if they want to run the command
-                choice = input("\nRun this command? (y/n/quit): ").strip().lower()
-                
-                if choice in ['quit', 'q']:
-                    print("👋 Goodbye!")
+
+                if not await session(client, problem):
                     break
-                elif choice in ['y', 'yes']:
-                    # Execute the command
-                    cmd_result = run_command(command)
-                    print(f"🔧 Command result: {cmd_result}")
-
-                    # Prepare output for next API call
-                    if cmd_result['success']:
-                        command_output = cmd_result['output']
-                        if cmd_result['error']:
-                            command_output += f"\nStderr: {cmd_result['error']}"
-                    else:
-                        command_output = f"Command failed: {cmd_result['error']}"
-                        if cmd_result['output']:
-                            command_output += f"\nOutput: {cmd_result['output']}"
-                    
-                    print(f"\n📤 Sending command output to bot ({len(command_output)} characters)")
-                    # Continue with the same problem and session
-                    continue
-                else:
-                    print("Command skipped. You can run it manually if needed.")
-                    current_problem = None
-                    session_id = None
-            else:
-                # No command to run, diagnosis is complete
-                print("\n✅ Diagnosis complete!")
-                current_problem = None
-                session_id = None
-            
-            print("\n" + "-" * 50)
-            
-        except KeyboardInterrupt:
-            print("\n👋 Goodbye!")
-            break
-        except Exception as e:
-            print(f"❌ Unexpected error: {e}")
-            current_problem = None
-            session_id = None
+                print("\n" + "-" * 50)
+            except (KeyboardInterrupt, EOFError):
+                break
+            except Exception as e:
+                print(f"❌ Unexpected error: {e}")
+
+    print("👋 Goodbye!")
+
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n👋 Goodbye!")
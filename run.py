@@ -3,15 +3,41 @@
 Main application runner for Glitch Backend
 """
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+
+import anyio.to_thread
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import QueryParams
+from starlette.types import ASGIApp, Receive, Scope, Send
 from app.routes.route import router as api_router
 from app.routes.auth import router as auth_router
 from app.routes.threads import router as threads_router
+from app.routes.admin import router as admin_router
+from app.routes.ws import router as ws_router
+from app.config.config import THREADPOOL_SIZE
+from app.services.embeddings import get_embedding_pool
+from app.services.metrics import InFlightMiddleware
 from os import environ
 
-app = FastAPI(title="Glitch API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync routes share this pool; diagnose requests waiting on the fair
+    # scheduler each hold a thread, so the default of 40 is too small
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # Load the model in the embedding workers before traffic arrives, not on the first add_message
+    pool = get_embedding_pool()
+    if pool is not None:
+        await anyio.to_thread.run_sync(pool.start)
+    yield
+    if pool is not None:
+        pool.shutdown()
+
+
+app = FastAPI(title="Glitch API", version="1.0.0", lifespan=lifespan)
 
 # Server switch state (ON by default)
 app.state.server_enabled = True
@@ -46,37 +72,74 @@ app.add_middleware(
 # SERVER SWITCH MIDDLEWARE (with correct preflight behavior)
 # ============================================================
 
-@app.middleware("http")
-async def switch_middleware(request: Request, call_next):
-    # Handle preflight immediately
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    # Handle switch control
-    switch_param = request.query_params.get("switch")
-    if switch_param is not None:
-        value = switch_param.strip().lower()
-
-        if value in {"true", "false"}:
-            request.app.state.server_enabled = (value == "true")
-            return JSONResponse({
-                "message": "server switch updated",
-                "server_enabled": request.app.state.server_enabled
-            })
-
-        return JSONResponse(
-            {"error": "invalid switch value; use true or false"},
-            status_code=400
-        )
-
-    # If server disabled → block all endpoints
-    if not request.app.state.server_enabled:
-        return JSONResponse(
-            {"error": "server is currently disabled"},
-            status_code=503
-        )
-
-    # Process request normally
-    return await call_next(request)
+# Paths that ignore the switch entirely (scrapes must work while disabled)
+SWITCH_EXEMPT_PATHS = frozenset({"/metrics"})
+
+
+class ServerSwitchMiddleware:
+    """
+    Pure ASGI server switch.
+
+    Same behaviour as the old `@app.middleware("http")` version but without
+    BaseHTTPMiddleware, so responses (including streaming ones) and client
+    disconnects pass straight through.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Handle preflight (and exempt paths) immediately
+        if scope["method"] == "OPTIONS" or scope["path"] in SWITCH_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        state = scope["app"].state
+
+        # Handle switch control (only parse the query string when it can match;
+        # percent-encoded keys still go through the full parser)
+        query_string = scope.get("query_string", b"")
+        if b"switch" in query_string or b"%" in query_string:
+            switch_param = QueryParams(query_string).get("switch")
+            if switch_param is not None:
+                value = switch_param.strip().lower()
+
+                if value in {"true", "false"}:
+                    state.server_enabled = (value == "true")
+                    response = JSONResponse({
+                        "message": "server switch updated",
+                        "server_enabled": state.server_enabled
+                    })
+                else:
+                    response = JSONResponse(
+                        {"error": "invalid switch value; use true or false"},
+                        status_code=400
+                    )
+                await response(scope, receive, send)
+                return
+
+        # If server disabled → block all endpoints
+        if not state.server_enabled:
+            response = JSONResponse(
+                {"error": "server is currently disabled"},
+                status_code=503
+            )
+            await response(scope, receive, send)
+            return
+
+        # Process request normally
+        await self.app(scope, receive, send)
+
+
+# The last middleware added is the outermost. The in-flight gauge wraps CORS
+# and the routes; the server switch is added last so it stays the outermost
+# layer, as before, and disabled-server 503s never reach the layers below
+app.add_middleware(InFlightMiddleware)
+app.add_middleware(ServerSwitchMiddleware)
 
 
 # ============================================================
@@ -86,6 +149,17 @@ async def switch_middleware(request: Request, call_next):
 app.include_router(api_router)
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(threads_router, tags=["threads"])
+app.include_router(admin_router, prefix="/admin", tags=["admin"])
+app.include_router(ws_router)
+
+
+# ============================================================
+# METRICS (no auth, not affected by the server switch)
+# ============================================================
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 # ============================================================